@@ -0,0 +1,136 @@
+"""Benchmark ensemble statistics and verification from one station to a whole RFC.
+
+Writes a synthetic cardfile cache (the ``.npy`` arrays and index that
+``CardfileCache.update`` produces) with an ensemble and an observed series
+per station, then scores growing numbers of stations with
+``verify_ensembles`` at several worker counts. Each run is timed cold (no
+cached scores) and warm (every station served from the fingerprint
+cache). Results are appended as JSON lines tagged with the current git
+commit so runs can be compared across commits.
+
+Usage:
+    python scripts/benchmark_ensemble_stats.py --stations 1 10 100 --workers 1 4 --output bench.jsonl
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from hefs_fews_hub.cardfiles import CACHE_DIRNAME, INDEX_FILENAME, INDEX_VERSION, CardfileCache
+from hefs_fews_hub.ensemble_stats import STATS_CACHE_DIRNAME, verify_ensembles
+
+START = "1990-01-01T00:00"
+TIMESTEP_HOURS = 6
+
+
+def write_synthetic_cache(root: Path, stations: int, members: int, years: int, seed: int) -> CardfileCache:
+    """Write ensembles and observations of ``stations`` stations into a cardfile cache."""
+    rng = np.random.default_rng(seed)
+    cardfiles = root / "cardfiles"
+    cache_dir = root / CACHE_DIRNAME
+    cardfiles.mkdir(parents=True)
+    cache_dir.mkdir(parents=True)
+    count = years * 365 * 24 // TIMESTEP_HOURS
+    files = {}
+
+    def add(name: str, station: str, variable: str, values: np.ndarray) -> None:
+        np.save(cache_dir / f"{name}.npy", values.astype(np.float32))
+        files[name] = {
+            "array": f"{name}.npy",
+            "station": station,
+            "variable": variable,
+            "dimension": "L3/T",
+            "units": "CMS",
+            "timestep_hours": TIMESTEP_HOURS,
+            "description": "synthetic",
+            "start": START,
+            "count": count,
+            "source_mtime_ns": 0,
+            "source_size": 0,
+        }
+
+    seasonal = 50 + 40 * np.sin(np.arange(count) * 2 * np.pi / (365 * 24 / TIMESTEP_HOURS))
+    for i in range(stations):
+        station = f"STA{i:04d}"
+        observed = seasonal * rng.lognormal(0, 0.3, count)
+        add(f"{station}.QME", station, "QME", observed)
+        for member in range(members):
+            add(f"{station}.{member:02d}.SQME", station, "SQME", seasonal * rng.lognormal(0, 0.35, count))
+    with open(cache_dir / INDEX_FILENAME, "w") as f:
+        json.dump({"version": INDEX_VERSION, "files": files}, f)
+    return CardfileCache(cardfiles, cache_dir)
+
+
+def run(cache: CardfileCache, stations: int, workers: int) -> dict:
+    """Score the first ``stations`` stations cold, then warm."""
+    selection = [f"STA{i:04d}" for i in range(stations)]
+    shutil.rmtree(cache.cache_dir.parent / STATS_CACHE_DIRNAME, ignore_errors=True)
+    timings = {}
+    for phase in ("cold", "warm"):
+        started = time.perf_counter()
+        results = verify_ensembles(
+            None, None, "SQME", "QME", stations=selection,
+            thresholds=(100.0, 150.0), max_workers=workers, cache=cache,
+        )
+        timings[phase] = time.perf_counter() - started
+    crps = float(np.mean([scores.mean_crps for scores in results.values()]))
+    return {"cold_seconds": timings["cold"], "warm_seconds": timings["warm"], "mean_crps": crps}
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", nargs="+", type=int, default=[1, 10, 100])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, os.cpu_count() or 1])
+    parser.add_argument("--members", type=int, default=40)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Append results as JSON lines to this file.")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="hefs-stats-bench-"))
+    try:
+        cache = write_synthetic_cache(workdir, max(args.stations), args.members, args.years, args.seed)
+        print(
+            f"{max(args.stations)} stations x {args.members} members x "
+            f"{args.years} years of {TIMESTEP_HOURS}-hourly values"
+        )
+        commit = git_commit()
+        for stations in args.stations:
+            for workers in args.workers:
+                record = {
+                    "commit": commit,
+                    "timestamp": time.time(),
+                    "stations": stations,
+                    "workers": workers,
+                    "members": args.members,
+                    "years": args.years,
+                    **run(cache, stations, workers),
+                }
+                record["stations_per_second"] = stations / record["cold_seconds"]
+                print(
+                    f"{stations:5d} stations x{workers:<3} {record['cold_seconds']:8.2f}s cold "
+                    f"{record['warm_seconds']:7.2f}s warm "
+                    f"{record['stations_per_second']:7.2f} stations/s"
+                )
+                if args.output:
+                    with open(args.output, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark publishing an RFC tree against a local S3 stand-in.
+
+Starts the moto S3 server of ``benchmark_transfer.py``, writes the same
+synthetic RFC tree and publishes it with ``publish_rfc``: once into an
+empty bucket, again after editing a handful of files, and once more with
+nothing changed. Each run reports its duration, the objects and bytes
+uploaded and the requests made, and the published manifest is checked
+against the SHA-256 of the local files. Finally a bundle of the Config is
+published and the tree republished with ``delete=True`` after removing a
+file, which must delete that file's object but keep the bundle. Results are appended as JSON lines
+tagged with the current git commit so runs can be compared across commits.
+
+Requires moto[server] in addition to the package's dependencies.
+
+Usage:
+    python scripts/benchmark_publish.py --concurrency 8 32 --edits 5 --output bench.jsonl
+"""
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmark_transfer import (
+    BUCKET,
+    RFC,
+    configure_environment,
+    generate_tree,
+    git_commit,
+    start_s3_server,
+)
+
+
+def edit_files(root: Path, count: int, seed: int) -> None:
+    """Rewrite ``count`` random files of the tree with new content of the same size."""
+    rng = random.Random(seed)
+    paths = sorted(path for path in root.rglob("*") if path.is_file() and not path.name.startswith("."))
+    for path in rng.sample(paths, min(count, len(paths))):
+        path.write_bytes(rng.randbytes(path.stat().st_size))
+
+
+def check_manifest(manifest: dict, root: Path) -> int:
+    """Return the number of local files whose digest differs from the manifest."""
+    from hefs_fews_hub.catalog import hash_file
+
+    return sum(
+        entry.get("sha256") != hash_file(root / path)
+        for path, entry in manifest["objects"].items()
+    )
+
+
+def check_delete(fs, root: Path, concurrency: int, part_size: int) -> dict:
+    """Publish a bundle, remove a local file and republish with ``delete=True``."""
+    from hefs_fews_hub.bundle import INDEX_FILENAME, bundle_prefix, publish_bundle
+    from hefs_fews_hub.catalog import publish_rfc
+
+    prefix = bundle_prefix(RFC)
+    publish_bundle(root / "Config", prefix, BUCKET)
+    removed = min((root / "Config").rglob("*.xml"))
+    removed.unlink()
+    publish_rfc(root, RFC, BUCKET, concurrency=concurrency, part_size=part_size, delete=True)
+    fs.invalidate_cache()
+    return {
+        "object_removed": not fs.exists(f"{BUCKET}/{RFC}/{removed.relative_to(root).as_posix()}"),
+        "bundle_kept": fs.exists(f"{BUCKET}/{prefix}/{INDEX_FILENAME}"),
+    }
+
+
+def run(root: Path, concurrency: int, part_size: int, counter) -> dict:
+    """Publish the tree once and return its timings and counts."""
+    from hefs_fews_hub.catalog import publish_rfc
+
+    uploaded = []
+    before = counter.snapshot()
+    start = time.perf_counter()
+    manifest = publish_rfc(
+        root, RFC, BUCKET, concurrency=concurrency, part_size=part_size,
+        callback=uploaded.append,
+    )
+    seconds = time.perf_counter() - start
+    requests = counter.snapshot() - before
+    return {
+        "seconds": seconds,
+        "objects": len(manifest["objects"]),
+        "bytes_uploaded": sum(uploaded),
+        "requests": dict(requests),
+        "digest_mismatches": check_manifest(manifest, root),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[8, 32])
+    parser.add_argument("--part-size", type=int, default=8, help="Part size in MiB.")
+    parser.add_argument("--edits", type=int, default=5)
+    parser.add_argument("--small-files", type=int, default=2000)
+    parser.add_argument("--cardfiles", type=int, default=10)
+    parser.add_argument("--jar-mb", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Append results as JSON lines to this file.")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="hefs-publish-bench-"))
+    try:
+        endpoint_url, counter = start_s3_server()
+        configure_environment(endpoint_url, workdir)
+        root = workdir / "source" / RFC
+        total = generate_tree(root, args.small_files, args.cardfiles, args.jar_mb, args.seed)
+        print(f"Publishing {total / 2**20:.0f} MiB to {endpoint_url}")
+        commit = git_commit()
+        for concurrency in args.concurrency:
+            import s3fs
+
+            fs = s3fs.S3FileSystem(anon=False, skip_instance_cache=True)
+            if fs.exists(BUCKET):
+                fs.rm(BUCKET, recursive=True)
+            fs.mkdir(BUCKET)
+            (root / ".hefs_publish_state.json").unlink(missing_ok=True)
+            for phase in ("initial", "edited", "unchanged"):
+                if phase == "edited":
+                    edit_files(root, args.edits, args.seed + concurrency)
+                record = {
+                    "commit": commit,
+                    "timestamp": time.time(),
+                    "phase": phase,
+                    "concurrency": concurrency,
+                    "part_size_mb": args.part_size,
+                    "edits": args.edits if phase == "edited" else 0,
+                    **run(root, concurrency, args.part_size * 2**20, counter),
+                }
+                print(
+                    f"{phase:9s} x{concurrency:<3} {record['seconds']:7.2f}s "
+                    f"{record['bytes_uploaded'] / 2**20:8.1f} MiB uploaded "
+                    f"{sum(record['requests'].values()):6d} requests "
+                    f"{record['digest_mismatches']} digest mismatches"
+                )
+                if args.output:
+                    with open(args.output, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+            record = {
+                "commit": commit,
+                "timestamp": time.time(),
+                "phase": "delete",
+                "concurrency": concurrency,
+                **check_delete(fs, root, concurrency, args.part_size * 2**20),
+            }
+            print(
+                f"delete    x{concurrency:<3} object removed: {record['object_removed']}, "
+                f"bundle kept: {record['bundle_kept']}"
+            )
+            if args.output:
+                with open(args.output, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+            if not (record["object_removed"] and record["bundle_kept"]):
+                raise SystemExit("publish --delete did not keep the bundle in place")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
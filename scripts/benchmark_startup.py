@@ -0,0 +1,116 @@
+"""Benchmark the startup time of the Panel dashboard.
+
+Measures the import time of the dashboard modules in a fresh interpreter and
+the time from launching ``panel serve`` until the first page is rendered,
+and compares the latter with the jupyter-server-proxy timeout. Fails if
+importing ``dashboard_funcs`` loads any of ``DEFERRED_MODULES``, which the
+dashboard only needs after the page rendered.
+
+Usage:
+    python scripts/benchmark_startup.py [--runs 3] [--output results.json]
+"""
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+from hefs_fews_hub.jupyter_server_proxy_config import setup_panel_dashboard
+
+MODULES = [
+    "hefs_fews_hub.dashboard_funcs",
+    "panel",
+    "ipyleaflet",
+]
+# Imported on first use; loading them eagerly slows every dashboard start
+DEFERRED_MODULES = ["numpy", "s3fs", "ipyleaflet", "hefs_fews_hub.bundle", "hefs_fews_hub.storage"]
+
+
+def time_import(module: str) -> float:
+    """Return the seconds a fresh interpreter needs to import ``module``."""
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def eager_imports(module: str, candidates: list) -> list:
+    """Return the ``candidates`` a fresh interpreter loads when importing ``module``."""
+    code = f"import sys; import {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    loaded = set(result.stdout.split())
+    return [name for name in candidates if name in loaded]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_first_render(timeout: float) -> float:
+    """Return the seconds from ``panel serve`` until the dashboard page renders."""
+    config = setup_panel_dashboard()
+    port = free_port()
+    command = [arg.replace("{port}", str(port)) for arg in config["command"]]
+    app_name = Path(command[2]).stem
+    url = f"http://127.0.0.1:{port}/{app_name}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                # The first GET runs the module body and renders the template
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.1)
+        raise TimeoutError(f"Dashboard did not render within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per measurement.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    proxy_timeout = setup_panel_dashboard()["timeout"]
+    results = {"proxy_timeout": proxy_timeout, "import_seconds": {}}
+    eager = eager_imports("hefs_fews_hub.dashboard_funcs", DEFERRED_MODULES)
+    results["eager_imports"] = eager
+    print(f"eagerly imported by dashboard_funcs: {', '.join(eager) or 'none'}")
+    for module in MODULES:
+        timings = [time_import(module) for _ in range(args.runs)]
+        results["import_seconds"][module] = min(timings)
+        print(f"import {module}: {min(timings):.2f}s")
+    renders = [time_first_render(proxy_timeout * 2) for _ in range(args.runs)]
+    results["first_render_seconds"] = renders
+    print(f"time to first render: {min(renders):.2f}s (max {max(renders):.2f}s, "
+          f"proxy timeout {proxy_timeout}s)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if eager:
+        sys.exit(f"dashboard_funcs imports {', '.join(eager)} eagerly.")
+    if max(renders) > proxy_timeout / 2:
+        sys.exit("Dashboard startup uses more than half of the proxy timeout.")
+
+
+if __name__ == "__main__":
+    main()
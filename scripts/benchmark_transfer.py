@@ -0,0 +1,235 @@
+"""Benchmark the S3 download strategies against a local S3 stand-in.
+
+Starts a moto S3 server in-process (wrapped to count requests), uploads a
+synthetic RFC tree with a realistic mix of file sizes (many small Config
+files, some large cardfiles and one large jar), then downloads it with each
+strategy and concurrency level in a fresh subprocess. Reports time to
+complete, throughput, request counts and peak memory, and appends the
+results as JSON lines tagged with the current git commit so runs can be
+compared across commits.
+
+Requires moto[server] in addition to the package's dependencies.
+
+Usage:
+    python scripts/benchmark_transfer.py --concurrency 8 32 --output bench.jsonl
+"""
+import argparse
+from collections import Counter
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+from pathlib import Path
+
+BUCKET = "hefs-benchmark"
+RFC = "BMRFC"
+# Outside the RFC prefix so the file-by-file strategies do not fetch it
+BUNDLE_PREFIX = f"{RFC}-bundle"
+STRATEGIES = ["engine", "s3fs-threads", "bundle", "aws-cli"]
+
+
+class CountingMiddleware:
+    """WSGI middleware counting requests by method."""
+
+    def __init__(self, app):
+        self.app = app
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.counts[environ["REQUEST_METHOD"]] += 1
+        return self.app(environ, start_response)
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.counts)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_s3_server():
+    """Start moto's S3 server in a thread; return its URL and request counter."""
+    from moto.server import DomainDispatcherApplication, create_backend_app
+    from werkzeug.serving import make_server
+
+    app = CountingMiddleware(DomainDispatcherApplication(create_backend_app))
+    port = free_port()
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}", app
+
+
+def configure_environment(endpoint_url: str, workdir: Path) -> None:
+    """Point boto, s3fs and the package's caches at the local stand-in."""
+    os.environ.update({
+        "AWS_ENDPOINT_URL": endpoint_url,
+        "FSSPEC_S3_ENDPOINT_URL": endpoint_url,
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "HEFS_FEWS_CATALOG_DIR": str(workdir / "catalog"),
+    })
+    os.environ.pop("HEFS_FEWS_CACHE_DIR", None)
+
+
+def generate_tree(root: Path, small_files: int, cardfiles: int, jar_mb: int, seed: int) -> int:
+    """Write a synthetic RFC tree and return its size in bytes."""
+    rng = random.Random(seed)
+    total = 0
+
+    def write(path: Path, size: int):
+        nonlocal total
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(size))
+        total += size
+
+    for i in range(small_files):
+        # Config XML and map files: lognormal around a few KiB
+        size = min(int(rng.lognormvariate(8.3, 1.2)), 2 * 2**20)
+        write(root / "Config" / f"dir{i % 40:02d}" / f"file{i:05d}.xml", size)
+    for i in range(cardfiles):
+        write(root / "historicalData" / f"STA{i:03d}.MAP06.txt", rng.randint(2, 24) * 2**20)
+    write(root / "fews-install" / "patch.jar", jar_mb * 2**20)
+    return total
+
+
+def upload_tree(root: Path) -> None:
+    import s3fs
+
+    fs = s3fs.S3FileSystem(anon=False, skip_instance_cache=True)
+    fs.mkdir(BUCKET)
+    fs.put(f"{root}/", f"{BUCKET}/{RFC}/", recursive=True)
+
+
+def run_worker(strategy: str, concurrency: int, dest: str) -> dict:
+    """Download the synthetic tree with one strategy; runs in a subprocess."""
+    start = time.perf_counter()
+    if strategy == "engine":
+        from hefs_fews_hub.dashboard_funcs import s3_download_directory
+
+        s3_download_directory(RFC, dest, bucket=BUCKET, concurrency=concurrency)
+    elif strategy == "s3fs-threads":
+        # The original implementation: glob, then one s3.get per file in threads
+        import s3fs
+
+        fs = s3fs.S3FileSystem(anon=False)
+        prefix = f"{BUCKET}/{RFC}"
+
+        def get(path):
+            local = os.path.join(dest, path[len(prefix):].lstrip("/"))
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            fs.get(path, local)
+
+        paths = [p for p in fs.find(prefix)]
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(get, paths))
+    elif strategy == "bundle":
+        from hefs_fews_hub.bundle import install_bundle
+
+        install_bundle(BUNDLE_PREFIX, dest, BUCKET, max_workers=concurrency)
+    elif strategy == "aws-cli":
+        config = Path(dest).parent / f"aws-config-{concurrency}"
+        config.write_text(f"[default]\ns3 =\n  max_concurrent_requests = {concurrency}\n")
+        subprocess.run(
+            ["aws", "s3", "cp", f"s3://{BUCKET}/{RFC}", dest, "--recursive",
+             "--only-show-errors", "--endpoint-url", os.environ["AWS_ENDPOINT_URL"]],
+            check=True,
+            env={**os.environ, "AWS_CONFIG_FILE": str(config)},
+        )
+    seconds = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    size = sum(p.stat().st_size for p in Path(dest).rglob("*") if p.is_file())
+    return {"seconds": seconds, "bytes": size, "peak_rss_mb": max(usage, children) / 1024}
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--strategies", nargs="+", default=STRATEGIES, choices=STRATEGIES)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[8, 32, 64])
+    parser.add_argument("--small-files", type=int, default=2000)
+    parser.add_argument("--cardfiles", type=int, default=10)
+    parser.add_argument("--jar-mb", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Append results as JSON lines to this file.")
+    parser.add_argument("--worker", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        strategy, concurrency, dest = args.worker
+        print(json.dumps(run_worker(strategy, int(concurrency), dest)))
+        return
+
+    workdir = Path(tempfile.mkdtemp(prefix="hefs-bench-"))
+    try:
+        endpoint_url, counter = start_s3_server()
+        configure_environment(endpoint_url, workdir)
+        total = generate_tree(
+            workdir / "source", args.small_files, args.cardfiles, args.jar_mb, args.seed
+        )
+        upload_tree(workdir / "source")
+        print(f"Uploaded {total / 2**20:.0f} MiB to {endpoint_url}")
+        if "bundle" in args.strategies:
+            from hefs_fews_hub.bundle import publish_bundle
+
+            publish_bundle(workdir / "source", BUNDLE_PREFIX, BUCKET)
+        if "aws-cli" in args.strategies and not shutil.which("aws"):
+            print("aws CLI not found, skipping the aws-cli strategy.")
+            args.strategies.remove("aws-cli")
+
+        commit = git_commit()
+        for strategy in args.strategies:
+            for concurrency in args.concurrency:
+                dest = workdir / f"{strategy}-{concurrency}"
+                before = counter.snapshot()
+                result = subprocess.run(
+                    [sys.executable, __file__, "--worker", strategy, str(concurrency), str(dest)],
+                    capture_output=True, text=True, check=True,
+                )
+                requests = counter.snapshot() - before
+                record = {
+                    "commit": commit,
+                    "timestamp": time.time(),
+                    "strategy": strategy,
+                    "concurrency": concurrency,
+                    **json.loads(result.stdout.strip().splitlines()[-1]),
+                    "requests": sum(requests.values()),
+                    "requests_by_method": dict(requests),
+                }
+                record["throughput_mib_s"] = record["bytes"] / 2**20 / record["seconds"]
+                print(
+                    f"{strategy:>13} x{concurrency:<3} {record['seconds']:7.2f}s "
+                    f"{record['throughput_mib_s']:8.1f} MiB/s {record['requests']:6d} requests "
+                    f"{record['peak_rss_mb']:7.1f} MiB peak RSS"
+                )
+                if args.output:
+                    with open(args.output, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                shutil.rmtree(dest, ignore_errors=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Load test the Panel dashboard with many concurrent sessions.
+
+Starts ``panel serve`` on the dashboard with the given number of worker
+processes (or targets a running server with ``--url``), then opens rounds of
+N concurrent sessions by requesting the app page, which runs the dashboard
+module for a new session on the server. After each round the sessions are
+left to expire so the server destroys them. Reports the page latency
+percentiles of every round and the resident memory of the server processes
+after it. RSS that keeps growing from round to round means per-session
+state is not released. Results are appended as JSON lines tagged with the
+current git commit so runs can be compared across commits.
+
+Usage:
+    python scripts/load_test_dashboard.py --procs 1 4 --sessions 10 50 --rounds 3 --output load.jsonl
+"""
+import argparse
+from concurrent import futures
+import json
+import os
+from pathlib import Path
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+# Sessions without a browser connection are destroyed after this long
+UNUSED_SESSION_LIFETIME_MS = 2000
+CHECK_UNUSED_SESSIONS_MS = 1000
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(procs: int, port: int, download_dir: Path) -> subprocess.Popen:
+    """Serve the dashboard with ``procs`` worker processes."""
+    import hefs_fews_hub
+
+    dashboard = Path(hefs_fews_hub.__file__).parent / "panel_dashboard.py"
+    panel = shutil.which("panel") or "panel"
+    return subprocess.Popen(
+        [
+            panel, "serve", str(dashboard),
+            "--port", str(port),
+            "--allow-websocket-origin=*",
+            "--num-procs", str(procs),
+            "--warm",
+            "--check-unused-sessions", str(CHECK_UNUSED_SESSIONS_MS),
+            "--unused-session-lifetime", str(UNUSED_SESSION_LIFETIME_MS),
+        ],
+        cwd=download_dir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(url: str, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                response.read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1)
+
+
+def process_tree(pid: int) -> list:
+    """Return ``pid`` and its descendants, from /proc."""
+    children = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def rss_mb(pid: int) -> float:
+    """Return the total resident memory of a process tree in MiB."""
+    total = 0
+    for process in process_tree(pid):
+        try:
+            for line in Path(f"/proc/{process}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+
+def open_session(url: str) -> float:
+    """Request the app page, creating a session; return the latency in seconds."""
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=300) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_round(url: str, sessions: int) -> dict:
+    """Open ``sessions`` sessions at once and summarize their latencies."""
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=sessions) as executor:
+        for job in futures.as_completed(executor.submit(open_session, url) for _ in range(sessions)):
+            try:
+                latencies.append(job.result())
+            except OSError:
+                errors += 1
+    result = {"seconds": time.perf_counter() - started, "errors": errors}
+    if latencies:
+        result.update(
+            p50_seconds=percentile(latencies, 0.5),
+            p95_seconds=percentile(latencies, 0.95),
+            max_seconds=max(latencies),
+        )
+    return result
+
+
+def git_commit() -> str:
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="App URL of a running server instead of starting one.")
+    parser.add_argument("--pid", type=int, help="Server PID to measure with --url.")
+    parser.add_argument("--procs", nargs="+", type=int, default=[1, os.cpu_count() or 1])
+    parser.add_argument("--sessions", nargs="+", type=int, default=[10, 50])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--output", help="Append results as JSON lines to this file.")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    configurations = [None] if args.url else args.procs
+    for procs in configurations:
+        workdir = Path(tempfile.mkdtemp(prefix="hefs-load-"))
+        server = None
+        try:
+            if args.url:
+                url, pid = args.url, args.pid
+            else:
+                port = free_port()
+                server = start_server(procs, port, workdir)
+                url, pid = f"http://127.0.0.1:{port}/panel_dashboard", server.pid
+            wait_until_ready(url)
+            baseline = rss_mb(pid) if pid else None
+            for sessions in args.sessions:
+                for number in range(1, args.rounds + 1):
+                    record = {
+                        "commit": commit,
+                        "timestamp": time.time(),
+                        "procs": procs,
+                        "sessions": sessions,
+                        "round": number,
+                        **run_round(url, sessions),
+                    }
+                    # Let the server destroy the round's sessions before measuring
+                    time.sleep((UNUSED_SESSION_LIFETIME_MS + 2 * CHECK_UNUSED_SESSIONS_MS) / 1000)
+                    if pid:
+                        record["rss_mb"] = rss_mb(pid)
+                        record["rss_growth_mb"] = record["rss_mb"] - baseline
+                    print(
+                        f"procs={procs} sessions={sessions:4d} round={number} "
+                        f"p50={record.get('p50_seconds', float('nan')):6.2f}s "
+                        f"p95={record.get('p95_seconds', float('nan')):6.2f}s "
+                        f"errors={record['errors']} "
+                        f"rss={record.get('rss_mb', float('nan')):8.1f} MiB "
+                        f"(+{record.get('rss_growth_mb', float('nan')):.1f})",
+                        flush=True,
+                    )
+                    if args.output:
+                        with open(args.output, "a") as f:
+                            f.write(json.dumps(record) + "\n")
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Packed per-RFC configuration bundles.
+
+A bundle is a directory tree packed into a handful of compressed tar chunks
+plus an ``index.json`` describing them. Installing a bundle streams every
+chunk from S3 straight into extraction, so an RFC Config costs a few large
+sequential reads instead of thousands of small GETs.
+
+Chunks are compressed with zstandard when it is installed (the ``zstd``
+extra, which the Docker image includes) and fall back to gzip otherwise;
+the index records which one was used.
+
+Every publish writes its chunks under a new publish id and replaces the
+index last, so a client reading the previous index keeps finding its
+chunks; the chunks of older publishes are removed. The index records the
+SHA-256 of every file, computed while it is packed, so an install can
+record which manifest entries it provided as the state of a later sync.
+"""
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+from concurrent import futures
+from datetime import datetime, timezone
+from pathlib import Path, PurePosixPath
+import tarfile
+from typing import Dict, List, Optional, Union
+import uuid
+
+from hefs_fews_hub.transfer import PART_SUFFIX, LimitedReader, get_transfer_filesystem
+from hefs_fews_hub.verify import file_matches
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUNDLE_DIRNAME = "bundles"
+INDEX_FILENAME = "index.json"
+DEFAULT_CHUNK_SIZE = 256 * 2**20
+DEFAULT_COMPRESSION_LEVEL = 3
+DEFAULT_EXTRACT_WORKERS = 4
+READ_BLOCK_SIZE = 16 * 2**20
+
+
+def bundle_prefix(rfc: str, subdir: str = "Config") -> str:
+    """Return the S3 prefix holding the bundle of ``{rfc}/{subdir}``."""
+    return f"{rfc}/{BUNDLE_DIRNAME}/{subdir}"
+
+
+def default_compression() -> str:
+    """Return the best compression available in this environment."""
+    return "zst" if zstandard is not None else "gz"
+
+
+def _require_zstandard() -> None:
+    if zstandard is None:
+        raise ImportError(
+            "zstandard is required for zst bundles; install hefs-fews-hub[zstd]."
+        )
+
+
+@contextlib.contextmanager
+def _compressed_writer(raw, compression: str, level: int):
+    if compression == "zst":
+        _require_zstandard()
+        compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+        with compressor.stream_writer(raw, closefd=False) as writer:
+            yield writer
+    elif compression == "gz":
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=level) as writer:
+            yield writer
+    else:
+        raise ValueError(f"Unsupported bundle compression: {compression}")
+
+
+@contextlib.contextmanager
+def _decompressed_reader(raw, compression: str):
+    if compression == "zst":
+        _require_zstandard()
+        with zstandard.ZstdDecompressor().stream_reader(raw, closefd=False) as reader:
+            yield reader
+    elif compression == "gz":
+        with gzip.GzipFile(fileobj=raw, mode="rb") as reader:
+            yield reader
+    else:
+        raise ValueError(f"Unsupported bundle compression: {compression}")
+
+
+def plan_chunks(
+        local_dir: Union[str, Path],
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> List[List[str]]:
+    """Group the files under ``local_dir`` into chunks of about ``chunk_size`` bytes."""
+    local_dir = Path(local_dir)
+    chunks = [[]]
+    chunk_bytes = 0
+    for path in sorted(p for p in local_dir.rglob("*") if p.is_file()):
+        size = path.stat().st_size
+        if chunks[-1] and chunk_bytes + size > chunk_size:
+            chunks.append([])
+            chunk_bytes = 0
+        chunks[-1].append(path.relative_to(local_dir).as_posix())
+        chunk_bytes += size
+    return chunks if chunks[0] else []
+
+
+class _HashingReader:
+    """A file wrapper hashing what is read through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+
+
+def publish_bundle(
+        local_dir: Union[str, Path],
+        prefix: str,
+        bucket: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        compression: Optional[str] = None,
+        level: int = DEFAULT_COMPRESSION_LEVEL
+) -> dict:
+    """Pack ``local_dir`` into compressed tar chunks and upload them to ``bucket/prefix``.
+
+    The chunks are streamed to S3 while they are being compressed, under
+    ``{prefix}/{publish id}/``. The index is uploaded last, so clients never
+    see a partially published bundle, then the chunks of publishes before
+    the previous one are removed.
+    """
+    fs = get_transfer_filesystem()
+    compression = compression or default_compression()
+    local_dir = Path(local_dir)
+    # Entries under the prefix holding the chunks of the current index
+    try:
+        previous = {
+            chunk["key"][len(prefix) + 1:].split("/")[0]
+            for chunk in read_bundle_index(prefix, bucket)["chunks"]
+        }
+    except FileNotFoundError:
+        previous = set()
+    publish_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    index = {
+        "version": 2,
+        "publish_id": publish_id,
+        "compression": compression,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "chunks": [],
+    }
+    for number, relative_paths in enumerate(plan_chunks(local_dir, chunk_size)):
+        key = f"{prefix}/{publish_id}/chunk-{number:04d}.tar.{compression}"
+        logger.info(f"Publishing {len(relative_paths)} files to s3://{bucket}/{key}")
+        files, digests = {}, {}
+        with fs.open(f"{bucket}/{key}", "wb", block_size=READ_BLOCK_SIZE) as raw:
+            with _compressed_writer(raw, compression, level) as writer:
+                with tarfile.open(fileobj=writer, mode="w|") as tar:
+                    for relative_path in relative_paths:
+                        path = local_dir / relative_path
+                        info = tar.gettarinfo(path, arcname=relative_path)
+                        with open(path, "rb") as f:
+                            reader = _HashingReader(f)
+                            tar.addfile(info, reader)
+                        files[relative_path] = info.size
+                        digests[relative_path] = reader.digest.hexdigest()
+        index["chunks"].append({
+            "key": key,
+            "size": fs.info(f"{bucket}/{key}")["size"],
+            "raw_size": sum(files.values()),
+            "files": files,
+            "sha256": digests,
+        })
+    fs.pipe(f"{bucket}/{prefix}/{INDEX_FILENAME}", json.dumps(index).encode())
+    logger.info(f"Published bundle s3://{bucket}/{prefix} ({len(index['chunks'])} chunks).")
+    # Clients may still be installing from the previous index; keep its chunks
+    keep = {publish_id, *previous}
+    stale = [
+        path for path in fs.ls(f"{bucket}/{prefix}", detail=False)
+        if path.rstrip("/").rsplit("/", 1)[-1] not in keep
+        and not path.endswith(f"/{INDEX_FILENAME}")
+    ]
+    if stale:
+        logger.info(f"Removing {len(stale)} older bundle publishes and chunks.")
+        fs.rm(stale, recursive=True)
+    return index
+
+
+def read_bundle_index(prefix: str, bucket: str) -> dict:
+    """Fetch the index of a published bundle."""
+    fs = get_transfer_filesystem()
+    return json.loads(fs.cat(f"{bucket}/{prefix}/{INDEX_FILENAME}"))
+
+
+def _member_destination(local_dir: Path, name: str) -> Path:
+    """Return where a tar member is extracted, refusing paths outside ``local_dir``."""
+    relative = PurePosixPath(name)
+    if relative.is_absolute() or ".." in relative.parts:
+        raise ValueError(f"Refusing to extract unsafe bundle member: {name}")
+    return local_dir.joinpath(*relative.parts)
+
+
+def _extract_chunk(
+        path: str,
+        local_dir: Path,
+        compression: str,
+        progress
+) -> int:
+    """Stream one chunk from S3 and extract it without a temporary archive.
+
+    The chunk is read within the limits of ``set_transfer_limits``.
+    """
+    fs = get_transfer_filesystem()
+    count = 0
+    with fs.open(path, "rb", block_size=READ_BLOCK_SIZE, cache_type="readahead") as f:
+        raw = LimitedReader(f, fs.loop)
+        with _decompressed_reader(raw, compression) as reader:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                for member in tar:
+                    destination = _member_destination(local_dir, member.name)
+                    if member.isdir():
+                        destination.mkdir(parents=True, exist_ok=True)
+                        continue
+                    if not member.isfile():
+                        logger.warning(f"Skipping non-file bundle member: {member.name}")
+                        continue
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    part_path = f"{destination}{PART_SUFFIX}"
+                    with tar.extractfile(member) as source, open(part_path, "wb") as f:
+                        while block := source.read(2**20):
+                            f.write(block)
+                            if progress is not None:
+                                progress.advance(len(block))
+                    os.replace(part_path, destination)
+                    count += 1
+    return count
+
+
+def install_bundle(
+        prefix: str,
+        local_dir: Union[str, Path],
+        bucket: str,
+        max_workers: int = DEFAULT_EXTRACT_WORKERS,
+        progress=None,
+        index: Optional[dict] = None
+) -> int:
+    """Stream a published bundle into ``local_dir``, extracting chunks in parallel.
+
+    Returns the number of files extracted. ``progress`` (a ``JobProgress``)
+    is advanced by the number of uncompressed bytes written. ``index`` is
+    the bundle's index when it was already read.
+    """
+    index = index or read_bundle_index(prefix, bucket)
+    if progress is not None:
+        progress.add_total(sum(chunk["raw_size"] for chunk in index["chunks"]))
+    local_dir = Path(local_dir)
+    local_dir.mkdir(parents=True, exist_ok=True)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jobs = [
+            executor.submit(
+                _extract_chunk,
+                f"{bucket}/{chunk['key']}",
+                local_dir,
+                index["compression"],
+                progress,
+            )
+            for chunk in index["chunks"]
+        ]
+        count = sum(job.result() for job in jobs)
+    logger.info(f"Extracted {count} files from s3://{bucket}/{prefix}.")
+    return count
+
+
+def bundle_sync_state(
+        index: dict,
+        manifest: Dict[str, dict],
+        local_dir: Union[str, Path]
+) -> Dict[str, dict]:
+    """Return the manifest entries an installed bundle provided, as sync state.
+
+    A file counts when its bundled SHA-256 equals the manifest's, or, for
+    entries or bundles without digests, when the extracted file matches the
+    entry's ETag. Other files are left for the next sync to fetch.
+    """
+    state = {}
+    for chunk in index["chunks"]:
+        digests = chunk.get("sha256", {})
+        for relative_path, size in chunk["files"].items():
+            entry = manifest.get(relative_path)
+            if entry is None or entry["size"] != size:
+                continue
+            if "sha256" in entry and relative_path in digests:
+                matches = entry["sha256"] == digests[relative_path]
+            else:
+                try:
+                    matches = file_matches(Path(local_dir, relative_path), entry)
+                except OSError:
+                    matches = False
+            if matches:
+                state[relative_path] = entry
+    return state
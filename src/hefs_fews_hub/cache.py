@@ -0,0 +1,257 @@
+"""Shared content-addressed download cache.
+
+When ``HEFS_FEWS_CACHE_DIR`` points at a directory, typically a node-level or
+shared persistent volume, every downloaded object is stored there keyed by
+its ETag and size. Later installs of the same object, by any user or for any
+RFC, are materialized from the cache with a reflink where the filesystem
+allows and a copy otherwise. The least recently used objects are
+evicted once the cache exceeds ``HEFS_FEWS_CACHE_MAX_BYTES``.
+
+Objects enter the cache as a reflink or a copy of the downloaded file,
+never a hardlink, so making them read-only does not touch the install they
+came from. Installs are never hardlinked from the cache either: FEWS
+configurations are edited in place, which would change the shared object
+for every other install. Reflinks are copy-on-write and safe. Set
+``HEFS_FEWS_CACHE_LINK=copy`` to always copy instead. Accesses are appended to a log in the cache rather than
+stamped on the objects, which are shared with installs and may belong to
+another user.
+"""
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+from hefs_fews_hub.transfer import PART_SUFFIX, TransferItem
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+CACHE_DIR_ENV = "HEFS_FEWS_CACHE_DIR"
+CACHE_MAX_BYTES_ENV = "HEFS_FEWS_CACHE_MAX_BYTES"
+CACHE_LINK_ENV = "HEFS_FEWS_CACHE_LINK"
+DEFAULT_MAX_BYTES = 20 * 2**30
+ACCESS_LOG_FILENAME = "access.log"
+# From linux/fs.h, clones a file's extents on btrfs, XFS and similar.
+FICLONE = 0x40049409
+
+
+def _reflink(src: Union[str, Path], dest: Union[str, Path]) -> None:
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def materialize(
+        src: Union[str, Path],
+        dest: Union[str, Path],
+        link: str = "auto"
+) -> str:
+    """Place a copy of ``src`` at ``dest`` as cheaply as the filesystem allows.
+
+    With ``link="auto"`` a reflink, then a hardlink, then a plain copy is
+    attempted; ``link="reflink"`` skips the hardlink, so ``dest`` never
+    shares an inode with ``src``. The result is renamed into place
+    atomically. Returns the method that was used.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{dest}{PART_SUFFIX}"
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(tmp_path)
+    method = "copy"
+    if link in ("auto", "reflink"):
+        try:
+            _reflink(src, tmp_path)
+            method = "reflink"
+        except OSError:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+    if link == "auto" and method == "copy":
+        try:
+            os.link(src, tmp_path)
+            method = "hardlink"
+        except OSError:
+            pass
+    if method == "copy":
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dest)
+    return method
+
+
+class ContentCache:
+    """A size-capped, LRU-evicted store of objects keyed by ETag and size."""
+
+    def __init__(
+            self,
+            root: Union[str, Path],
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            link: str = "auto"
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.link = link
+        self.objects_dir = self.root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(item: TransferItem) -> Optional[str]:
+        """Return the content key of ``item``, or None if it has no ETag."""
+        if not item.etag:
+            return None
+        return hashlib.sha256(f"{item.etag}:{item.size}".encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        """Return the location of a cached object."""
+        return self.objects_dir / key[:2] / key
+
+    def fetch(self, item: TransferItem) -> bool:
+        """Materialize ``item`` from the cache; return False on a miss."""
+        key = self.key(item)
+        if key is None:
+            return False
+        cached = self.path(key)
+        try:
+            if cached.stat().st_size != item.size:
+                return False
+            # Never a hardlink: an in-place edit of the install would change the object
+            materialize(cached, item.local, "reflink" if self.link == "auto" else "copy")
+        except FileNotFoundError:
+            # Missing, or evicted by another process while materializing
+            return False
+        self._record_access(key)
+        return True
+
+    @property
+    def access_log(self) -> Path:
+        return self.root / ACCESS_LOG_FILENAME
+
+    def _record_access(self, key: str) -> None:
+        """Append an access of ``key`` to the log ordering eviction."""
+        try:
+            fd = os.open(self.access_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        except OSError as e:
+            logger.warning(f"Could not record a cache access in {self.access_log}: {e}")
+            return
+        try:
+            # Shared by every user of the cache, whatever their umask
+            with contextlib.suppress(OSError):
+                os.fchmod(fd, 0o666)
+            # Lines are far below PIPE_BUF, so concurrent appends do not interleave
+            os.write(fd, f"{key} {time.time():.0f}\n".encode())
+        finally:
+            os.close(fd)
+
+    def _last_access(self) -> Dict[str, float]:
+        accessed = {}
+        with contextlib.suppress(FileNotFoundError):
+            with open(self.access_log) as f:
+                for line in f:
+                    key, _, timestamp = line.partition(" ")
+                    with contextlib.suppress(ValueError):
+                        accessed[key] = max(accessed.get(key, 0.0), float(timestamp))
+        return accessed
+
+    def _write_access_log(self, accessed: Dict[str, float]) -> None:
+        tmp_path = self.access_log.with_name(f"{ACCESS_LOG_FILENAME}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            f.writelines(f"{key} {timestamp:.0f}\n" for key, timestamp in accessed.items())
+        with contextlib.suppress(OSError):
+            os.chmod(tmp_path, 0o666)
+        os.replace(tmp_path, self.access_log)
+
+    def store(self, item: TransferItem) -> None:
+        """Add a downloaded ``item`` to the cache."""
+        key = self.key(item)
+        if key is None or self.path(key).exists():
+            return
+        cached = self.path(key)
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cached.with_name(f"{cached.name}.{os.getpid()}{PART_SUFFIX}")
+        # A new inode, so the chmod below leaves the downloaded file writable
+        try:
+            if self.link != "auto":
+                raise OSError("linking disabled")
+            _reflink(item.local, tmp_path)
+        except OSError:
+            shutil.copyfile(item.local, tmp_path)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, cached)
+        self._record_access(key)
+
+    def fetch_many(self, items: Iterable[TransferItem]) -> List[TransferItem]:
+        """Materialize every cached item; return the items that missed."""
+        misses = [item for item in items if not self.fetch(item)]
+        return misses
+
+    def store_many(self, items: Iterable[TransferItem]) -> None:
+        """Add downloaded items to the cache, then enforce the size cap."""
+        for item in items:
+            try:
+                self.store(item)
+            except OSError as e:
+                logger.warning(f"Could not cache {item.local}: {e}")
+        self.evict()
+
+    def size(self) -> int:
+        """Return the total size of the cached objects."""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries = []
+        for shard in os.scandir(self.objects_dir):
+            if shard.is_dir():
+                entries.extend(
+                    entry for entry in os.scandir(shard.path)
+                    if not entry.name.endswith(PART_SUFFIX)
+                )
+        return entries
+
+    def evict(self) -> int:
+        """Remove least recently used objects until the cache fits its cap.
+
+        Objects are ordered by their last access in the access log, or by
+        when they were stored if they were never accessed since. The log is
+        compacted to the remaining objects. Returns the number of bytes
+        freed. An exclusive lock keeps concurrent evictions from several
+        processes from over-deleting.
+        """
+        freed = 0
+        with open(self.root / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            accessed = self._last_access()
+            stats = []
+            for entry in self._entries():
+                with contextlib.suppress(FileNotFoundError):
+                    stat = entry.stat()
+                    stats.append((entry, stat, max(stat.st_mtime, accessed.get(entry.name, 0.0))))
+            total = sum(stat.st_size for _, stat, _ in stats)
+            kept = {}
+            for entry, stat, last_access in sorted(stats, key=lambda s: s[2]):
+                if total - freed <= self.max_bytes:
+                    kept[entry.name] = last_access
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(entry.path)
+                    freed += stat.st_size
+            try:
+                self._write_access_log(kept)
+            except OSError as e:
+                logger.warning(f"Could not compact the cache access log {self.access_log}: {e}")
+        if freed:
+            logger.info(f"Evicted {freed} bytes from the download cache {self.root}.")
+        return freed
+
+
+def get_cache() -> Optional[ContentCache]:
+    """Return the configured shared cache, or None if caching is disabled."""
+    root = os.environ.get(CACHE_DIR_ENV)
+    if not root:
+        return None
+    return ContentCache(
+        root,
+        max_bytes=int(os.environ.get(CACHE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES)),
+        link=os.environ.get(CACHE_LINK_ENV, "auto"),
+    )
@@ -0,0 +1,289 @@
+"""Columnar cache of the NWS datacard (cardfile) time series of an RFC.
+
+``download_historical_data`` stores ``{rfc}/historicalData`` as datacard
+text files in ``{rfc}/cardfiles``. Parsing them line by line for every
+analysis is slow, so ``CardfileCache.update`` decodes each file once with
+vectorized fixed-width parsing (across processes) into a ``.npy`` array
+next to a station/variable index. Later loads are memory-mapped reads of
+those arrays. An entry is re-parsed whenever the modification time or size
+of its source file changes.
+
+Datacard layout: ``$`` comment lines, then a header card with the data
+type, dimension, units, time step (hours), station id and description, a
+second card with the first and last month/year, the number of values per
+line and their Fortran format (e.g. ``F9.3``), then data cards holding the
+station id, month, year and sequence number in columns 1-20 followed by
+fixed-width values. Missing values are kept as written (usually -999).
+"""
+import calendar
+from concurrent import futures
+import json
+import logging
+import os
+from pathlib import Path
+import re
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+CACHE_DIRNAME = "cardfile_cache"
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+VALUE_OFFSET = 20
+VALUE_DTYPE = np.float32
+_FORMAT_PATTERN = re.compile(r"(\d*)F(\d+)\.\d+", re.IGNORECASE)
+
+
+class CardHeader(NamedTuple):
+    """The two header cards of a datacard file."""
+
+    data_type: str
+    dimension: str
+    units: str
+    timestep_hours: int
+    station: str
+    description: str
+    first_month: int
+    first_year: int
+    last_month: int
+    last_year: int
+    per_line: int
+    width: int
+
+    @property
+    def start(self) -> str:
+        """Return the start of the first month as an ISO timestamp."""
+        return f"{self.first_year:04d}-{self.first_month:02d}-01T00:00"
+
+    def expected_count(self) -> int:
+        """Return the number of values the header's period holds."""
+        hours = 0
+        year, month = self.first_year, self.first_month
+        while (year, month) <= (self.last_year, self.last_month):
+            hours += calendar.monthrange(year, month)[1] * 24
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return hours // self.timestep_hours
+
+
+def parse_header(card1: str, card2: str) -> CardHeader:
+    """Parse the two header cards of a datacard file."""
+    timestep = card1[36:38].strip()
+    if timestep.isdigit():
+        data_type, dimension, units = card1[14:18], card1[23:27], card1[29:33]
+        station, description = card1[45:57], card1[61:81]
+    else:
+        # Not column aligned: fall back to whitespace separated fields
+        tokens = card1.split()
+        if tokens and tokens[0].upper() == "DATACARD":
+            tokens = tokens[1:]
+        if len(tokens) < 5:
+            raise ValueError(f"Unrecognized datacard header: {card1!r}")
+        data_type, dimension, units, timestep, station = tokens[:5]
+        description = " ".join(tokens[5:])
+    tokens = card2.split()
+    match = _FORMAT_PATTERN.search(card2)
+    if len(tokens) < 5 or match is None:
+        raise ValueError(f"Unrecognized datacard period card: {card2!r}")
+    first_month, first_year, last_month, last_year, per_line = map(int, tokens[:5])
+    return CardHeader(
+        data_type=data_type.strip(),
+        dimension=dimension.strip(),
+        units=units.strip(),
+        timestep_hours=int(timestep),
+        station=station.strip(),
+        description=description.strip(),
+        first_month=first_month,
+        first_year=first_year,
+        last_month=last_month,
+        last_year=last_year,
+        per_line=per_line,
+        width=int(match.group(2)),
+    )
+
+
+def decode_values(lines: List[bytes], per_line: int, width: int) -> np.ndarray:
+    """Decode the fixed-width values of data cards in one vectorized pass.
+
+    Lines are padded to full width; blank fields (the unused tail of the
+    last card of each month) are dropped.
+    """
+    line_width = VALUE_OFFSET + per_line * width
+    if not lines:
+        return np.empty(0, dtype=VALUE_DTYPE)
+    block = b"".join(line[:line_width].ljust(line_width) for line in lines)
+    chars = np.frombuffer(block, dtype=np.uint8).reshape(len(lines), line_width)
+    fields = chars[:, VALUE_OFFSET:].reshape(len(lines), per_line, width)
+    blank = (fields == ord(" ")).all(axis=2)
+    text = np.ascontiguousarray(fields[~blank]).view(f"S{width}").ravel()
+    return text.astype(np.float64).astype(VALUE_DTYPE)
+
+
+def read_cardfile(path: Union[str, Path]) -> Tuple[CardHeader, np.ndarray]:
+    """Parse a datacard file into its header and values."""
+    with open(path, "rb") as f:
+        lines = [line.rstrip(b"\r\n") for line in f.read().split(b"\n")]
+    cards = [line for line in lines if line.strip() and not line.startswith(b"$")]
+    if len(cards) < 2:
+        raise ValueError(f"{path} is not a datacard file")
+    header = parse_header(cards[0].decode(errors="replace"), cards[1].decode(errors="replace"))
+    values = decode_values(cards[2:], header.per_line, header.width)
+    if len(values) != header.expected_count():
+        logger.warning(
+            f"{path}: {len(values)} values, {header.expected_count()} expected "
+            "from the header period."
+        )
+    return header, values
+
+
+def _write_array(path: Path, values: np.ndarray) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, values)
+    os.replace(tmp_path, path)
+
+
+def _parse_to_cache(source: str, target: str) -> dict:
+    """Parse one cardfile into ``target``; runs in a worker process."""
+    stat = os.stat(source)
+    header, values = read_cardfile(source)
+    _write_array(Path(target), values)
+    return {
+        "array": Path(target).name,
+        "station": header.station,
+        "variable": header.data_type,
+        "dimension": header.dimension,
+        "units": header.units,
+        "timestep_hours": header.timestep_hours,
+        "description": header.description,
+        "start": header.start,
+        "count": len(values),
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_size": stat.st_size,
+    }
+
+
+class CardfileCache:
+    """Memory-mappable arrays and a station/variable index of a cardfile tree."""
+
+    def __init__(
+            self,
+            cardfile_dir: Union[str, Path],
+            cache_dir: Optional[Union[str, Path]] = None
+    ):
+        self.cardfile_dir = Path(cardfile_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else self.cardfile_dir.parent / CACHE_DIRNAME
+        self._index: Optional[Dict[str, dict]] = None
+
+    @property
+    def index_path(self) -> Path:
+        return self.cache_dir / INDEX_FILENAME
+
+    @property
+    def index(self) -> Dict[str, dict]:
+        """Return the cache entries keyed by cardfile path relative to the tree."""
+        if self._index is None:
+            self._index = {}
+            if self.index_path.exists():
+                try:
+                    with open(self.index_path) as f:
+                        index = json.load(f)
+                    if index.get("version") == INDEX_VERSION:
+                        self._index = index["files"]
+                except (OSError, ValueError):
+                    logger.warning(f"Ignoring unreadable cardfile index: {self.index_path}")
+        return self._index
+
+    def _write_index(self) -> None:
+        tmp_path = self.index_path.with_name(f"{INDEX_FILENAME}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "files": self.index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def sources(self) -> Dict[str, Path]:
+        """Return the cardfiles of the tree keyed by relative path."""
+        if not self.cardfile_dir.exists():
+            raise ValueError(f"The directory: {self.cardfile_dir}, does not exist.")
+        return {
+            path.relative_to(self.cardfile_dir).as_posix(): path
+            for path in sorted(self.cardfile_dir.rglob("*"))
+            if path.is_file() and not path.name.startswith(".")
+            and not path.name.endswith(".hefs-part")
+        }
+
+    def is_current(self, relative_path: str, path: Path) -> bool:
+        """Return True if the cached entry still matches its source file."""
+        entry = self.index.get(relative_path)
+        if entry is None or (entry["array"] and not (self.cache_dir / entry["array"]).exists()):
+            return False
+        stat = path.stat()
+        return entry["source_mtime_ns"] == stat.st_mtime_ns \
+            and entry["source_size"] == stat.st_size
+
+    def update(self, max_workers: Optional[int] = None) -> int:
+        """Parse new and changed cardfiles, drop removed ones; return the number parsed."""
+        sources = self.sources()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        stale = {
+            relative_path: path for relative_path, path in sources.items()
+            if not self.is_current(relative_path, path)
+        }
+        removed = [relative_path for relative_path in self.index if relative_path not in sources]
+        for relative_path in removed:
+            array = self.index.pop(relative_path)["array"]
+            if array:
+                (self.cache_dir / array).unlink(missing_ok=True)
+        if stale:
+            logger.info(f"Parsing {len(stale)} of {len(sources)} cardfiles into {self.cache_dir}.")
+            with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                jobs = {
+                    executor.submit(
+                        _parse_to_cache,
+                        str(path),
+                        str(self.cache_dir / (relative_path.replace("/", "__") + ".npy")),
+                    ): relative_path
+                    for relative_path, path in stale.items()
+                }
+                for job in futures.as_completed(jobs):
+                    relative_path = jobs[job]
+                    try:
+                        self.index[relative_path] = job.result()
+                    except ValueError as e:
+                        # Remember unparseable files so they are skipped until they change
+                        logger.warning(f"Skipping {relative_path}: {e}")
+                        stat = stale[relative_path].stat()
+                        self.index[relative_path] = {
+                            "array": None,
+                            "error": str(e),
+                            "source_mtime_ns": stat.st_mtime_ns,
+                            "source_size": stat.st_size,
+                        }
+        if stale or removed:
+            self._write_index()
+        return len(stale)
+
+    def find(
+            self,
+            station: Optional[str] = None,
+            variable: Optional[str] = None
+    ) -> Iterator[Tuple[str, dict]]:
+        """Yield ``(relative_path, entry)`` for the series of a station and/or variable."""
+        for relative_path, entry in self.index.items():
+            if not entry["array"]:
+                continue
+            if station is not None and entry["station"] != station:
+                continue
+            if variable is not None and entry["variable"] != variable:
+                continue
+            yield relative_path, entry
+
+    def values(self, relative_path: str) -> np.ndarray:
+        """Return the values of a cached cardfile as a read-only memory map."""
+        return np.load(self.cache_dir / self.index[relative_path]["array"], mmap_mode="r")
+
+    def times(self, relative_path: str) -> np.ndarray:
+        """Return the end-of-period timestamps of a cached cardfile's values."""
+        entry = self.index[relative_path]
+        steps = np.arange(1, entry["count"] + 1) * entry["timestep_hours"]
+        return np.datetime64(entry["start"], "h") + steps.astype("timedelta64[h]")
@@ -0,0 +1,367 @@
+"""Catalog of the HEFS data bucket built from published per-RFC manifests.
+
+Listing a large prefix on S3 takes many paginated LIST round-trips before the
+first byte moves. Instead, maintainers publish ``{rfc}/manifest.json``
+(keys, sizes, ETags and modification times of everything under ``{rfc}/``)
+with ``publish_manifest``. Clients fetch it with a single GET, keep it in a
+local cache for ``HEFS_FEWS_CATALOG_TTL`` seconds, and answer size, listing
+and availability questions from it without any LIST calls.
+
+``publish_rfc`` uploads a local RFC tree and writes its manifest in the same
+pass: only files changed since the last publish are uploaded, their SHA-256
+is computed while they are read for the upload, and the manifest is
+replaced once every upload has succeeded.
+"""
+from concurrent import futures
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from hefs_fews_hub.transfer import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_PART_SIZE,
+    PART_SUFFIX,
+    TransferItem,
+    get_transfer_filesystem,
+    upload_items,
+)
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+MANIFEST_FILENAME = "manifest.json"
+CATALOG_TTL_ENV = "HEFS_FEWS_CATALOG_TTL"
+CATALOG_DIR_ENV = "HEFS_FEWS_CATALOG_DIR"
+DEFAULT_TTL = 3600
+DEFAULT_CATALOG_DIR = Path.home() / ".cache" / "hefs_fews_hub" / "catalog"
+PUBLISH_STATE_FILENAME = ".hefs_publish_state.json"
+HASH_BLOCK_SIZE = 8 * 2**20
+
+_memory_cache: Dict[tuple, dict] = {}
+_lock = threading.Lock()
+
+
+def catalog_dir() -> Path:
+    """Return the directory holding cached manifests."""
+    return Path(os.environ.get(CATALOG_DIR_ENV, DEFAULT_CATALOG_DIR))
+
+
+def object_entry(info: dict) -> dict:
+    """Return the manifest entry of an object from its s3fs info."""
+    return {
+        "size": info["size"],
+        "etag": info.get("ETag", "").strip('"'),
+        "last_modified": str(info.get("LastModified", "")),
+    }
+
+
+def list_objects(prefix: str, bucket: str) -> Dict[str, dict]:
+    """List the objects under a prefix, keyed by path relative to it.
+
+    This issues LIST requests; prefer ``get_manifest`` where a manifest is
+    published.
+    """
+    s3_path = f"{bucket}/{prefix}".rstrip("/")
+    listing = get_transfer_filesystem().find(s3_path, detail=True)
+    return {
+        path[len(s3_path):].lstrip("/"): object_entry(info)
+        for path, info in listing.items()
+        if info.get("type") == "file" and not path.endswith("/")
+    }
+
+
+def _previous_objects(rfc: str, bucket: str) -> Dict[str, dict]:
+    """Return the objects of the published manifest, or an empty dict."""
+    try:
+        return get_manifest(rfc, bucket, refresh=True)["objects"]
+    except FileNotFoundError:
+        return {}
+
+
+def publish_manifest(rfc: str, bucket: str) -> dict:
+    """List everything under ``{rfc}/`` and publish it as ``{rfc}/manifest.json``.
+
+    SHA-256 digests of the previous manifest are kept for unchanged objects.
+    """
+    previous = _previous_objects(rfc, bucket)
+    objects = list_objects(rfc, bucket)
+    objects.pop(MANIFEST_FILENAME, None)
+    for key, entry in objects.items():
+        old = previous.get(key, {})
+        if "sha256" in old and old["etag"] == entry["etag"] and old["size"] == entry["size"]:
+            entry["sha256"] = old["sha256"]
+    manifest = {
+        "version": 1,
+        "rfc": rfc,
+        "generated": datetime.now(timezone.utc).isoformat(),
+        "objects": objects,
+    }
+    write_manifest(manifest, bucket)
+    return manifest
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _local_files(local_dir: Path) -> Dict[str, os.stat_result]:
+    return {
+        path.relative_to(local_dir).as_posix(): path.stat()
+        for path in sorted(local_dir.rglob("*"))
+        if path.is_file() and not path.name.startswith(".")
+        and not path.name.endswith(PART_SUFFIX)
+    }
+
+
+def _read_publish_state(local_dir: Path) -> Dict[str, dict]:
+    try:
+        with open(local_dir / PUBLISH_STATE_FILENAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_publish_state(local_dir: Path, state: Dict[str, dict]) -> None:
+    path = local_dir / PUBLISH_STATE_FILENAME
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def publish_rfc(
+        local_dir: Union[str, Path],
+        rfc: str,
+        bucket: str,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        part_size: int = DEFAULT_PART_SIZE,
+        delete: bool = False,
+        callback: Optional[Callable[[int], None]] = None
+) -> dict:
+    """Upload the changed files of ``local_dir`` to ``{rfc}/`` and publish its manifest.
+
+    A file is unchanged when its size and modification time match the last
+    publish from this tree (recorded in ``local_dir``) and the published
+    ETag is the one uploaded then. Files without a record are hashed and
+    skipped if their digest matches the manifest's. Uploaded files are
+    hashed while they are read. With ``delete=True``, objects under
+    ``{rfc}/`` that are not in ``local_dir`` are removed, except the
+    published bundles under ``{rfc}/bundles/``. The manifest, with
+    the SHA-256 of every object that has one, replaces the previous one
+    only after all uploads succeeded.
+    """
+    from hefs_fews_hub.bundle import BUNDLE_DIRNAME
+
+    local_dir = Path(local_dir)
+    if not local_dir.exists():
+        raise ValueError(f"The directory: {local_dir}, does not exist.")
+    local = _local_files(local_dir)
+    previous = _previous_objects(rfc, bucket) or list_objects(rfc, bucket)
+    previous.pop(MANIFEST_FILENAME, None)
+    state = _read_publish_state(local_dir)
+
+    objects = {}
+    changed = {}
+    unverified = []
+    for relative_path, stat in local.items():
+        remote = previous.get(relative_path)
+        record = state.get(relative_path)
+        if remote is None or remote["size"] != stat.st_size:
+            changed[relative_path] = stat
+        elif record is not None and record["size"] == stat.st_size \
+                and record["mtime_ns"] == stat.st_mtime_ns and record["etag"] == remote["etag"]:
+            objects[relative_path] = {**remote, "sha256": record["sha256"]}
+        elif "sha256" in remote:
+            unverified.append(relative_path)
+        else:
+            changed[relative_path] = stat
+    if unverified:
+        logger.info(f"Hashing {len(unverified)} files without a publish record.")
+        with futures.ThreadPoolExecutor() as executor:
+            digests = executor.map(hash_file, [local_dir / path for path in unverified])
+            for relative_path, digest in zip(unverified, digests):
+                stat = local[relative_path]
+                if digest == previous[relative_path]["sha256"]:
+                    objects[relative_path] = previous[relative_path]
+                    state[relative_path] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "etag": previous[relative_path]["etag"],
+                        "sha256": digest,
+                    }
+                else:
+                    changed[relative_path] = stat
+
+    logger.info(
+        f"Publishing {len(changed)} of {len(local)} files to s3://{bucket}/{rfc}/."
+    )
+    uploaded = upload_items(
+        [
+            TransferItem(f"{bucket}/{rfc}/{path}", str(local_dir / path), stat.st_size)
+            for path, stat in changed.items()
+        ],
+        concurrency=concurrency,
+        part_size=part_size,
+        callback=callback,
+    )
+    for relative_path, stat in changed.items():
+        result = uploaded[f"{bucket}/{rfc}/{relative_path}"]
+        objects[relative_path] = {
+            "size": stat.st_size,
+            "etag": result["etag"],
+            "last_modified": result["last_modified"],
+            "sha256": result["sha256"],
+        }
+        state[relative_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "etag": result["etag"],
+            "sha256": result["sha256"],
+        }
+
+    removed = [path for path in previous if path not in local]
+    # Bundles are published separately from the tree and never deleted here
+    bundles = [path for path in removed if path.startswith(f"{BUNDLE_DIRNAME}/")]
+    removed = [path for path in removed if not path.startswith(f"{BUNDLE_DIRNAME}/")]
+    if delete and removed:
+        logger.info(f"Removing {len(removed)} objects missing from {local_dir}.")
+        get_transfer_filesystem().rm([f"{bucket}/{rfc}/{path}" for path in removed])
+    elif removed:
+        objects.update({path: previous[path] for path in removed})
+    objects.update({path: previous[path] for path in bundles})
+    for path in [path for path in state if path not in local]:
+        del state[path]
+
+    manifest = {
+        "version": 1,
+        "rfc": rfc,
+        "generated": datetime.now(timezone.utc).isoformat(),
+        "objects": dict(sorted(objects.items())),
+    }
+    write_manifest(manifest, bucket)
+    _write_publish_state(local_dir, state)
+    return manifest
+
+
+def write_manifest(manifest: dict, bucket: str) -> None:
+    """Upload a manifest; a single PUT replaces the previous one atomically."""
+    rfc = manifest["rfc"]
+    get_transfer_filesystem().pipe(
+        f"{bucket}/{rfc}/{MANIFEST_FILENAME}",
+        json.dumps(manifest, separators=(",", ":")).encode(),
+    )
+    logger.info(
+        f"Published s3://{bucket}/{rfc}/{MANIFEST_FILENAME} "
+        f"({len(manifest['objects'])} objects)."
+    )
+    invalidate(rfc, bucket)
+
+
+def invalidate(rfc: Optional[str] = None, bucket: Optional[str] = None) -> None:
+    """Drop cached manifests, for one RFC or all of them."""
+    with _lock:
+        for key in list(_memory_cache):
+            if (rfc is None or key[1] == rfc) and (bucket is None or key[0] == bucket):
+                del _memory_cache[key]
+    pattern = f"{bucket or '*'}--{rfc or '*'}.json"
+    for path in catalog_dir().glob(pattern):
+        path.unlink(missing_ok=True)
+
+
+def get_manifest(
+        rfc: str,
+        bucket: str,
+        ttl: Optional[float] = None,
+        refresh: bool = False
+) -> dict:
+    """Return the published manifest of an RFC, cached for ``ttl`` seconds.
+
+    Raises FileNotFoundError if no manifest is published.
+    """
+    ttl = float(os.environ.get(CATALOG_TTL_ENV, DEFAULT_TTL)) if ttl is None else ttl
+    key = (bucket, rfc)
+    cache_path = catalog_dir() / f"{bucket}--{rfc}.json"
+    with _lock:
+        cached = _memory_cache.get(key)
+    if cached is None and cache_path.exists():
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = None
+    if cached is not None and not refresh and time.time() - cached["fetched"] < ttl:
+        with _lock:
+            _memory_cache[key] = cached
+        return cached["manifest"]
+
+    manifest = json.loads(
+        get_transfer_filesystem().cat(f"{bucket}/{rfc}/{MANIFEST_FILENAME}")
+    )
+    cached = {"fetched": time.time(), "manifest": manifest}
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(cached, f)
+    os.replace(tmp_path, cache_path)
+    with _lock:
+        _memory_cache[key] = cached
+    return manifest
+
+
+def list_files(rfc: str, bucket: str, prefix: str = "") -> Dict[str, dict]:
+    """Return the manifest entries under ``{rfc}/{prefix}``, keyed relative to it."""
+    objects = get_manifest(rfc, bucket)["objects"]
+    prefix = prefix.strip("/")
+    if not prefix:
+        return dict(objects)
+    return {
+        key[len(prefix) + 1:]: entry
+        for key, entry in objects.items()
+        if key.startswith(prefix + "/")
+    }
+
+
+def total_size(rfc: str, bucket: str, prefix: str = "") -> int:
+    """Return the total size in bytes of the objects under ``{rfc}/{prefix}``."""
+    return sum(entry["size"] for entry in list_files(rfc, bucket, prefix).values())
+
+
+def has_historical_data(rfc: str, bucket: str) -> bool:
+    """Return True if the RFC publishes ``historicalData``."""
+    return bool(list_files(rfc, bucket, "historicalData"))
+
+
+def rfcs_with_historical_data(rfcs: Iterable[str], bucket: str) -> List[str]:
+    """Return the RFCs among ``rfcs`` that publish ``historicalData``."""
+    available = []
+    for rfc in rfcs:
+        try:
+            if has_historical_data(rfc, bucket):
+                available.append(rfc)
+        except FileNotFoundError:
+            logger.warning(f"No manifest published for {rfc}.")
+    return available
+
+
+def manifest_for_prefix(prefix: str, bucket: str) -> Dict[str, dict]:
+    """Return the objects under ``prefix``, from the manifest when published.
+
+    ``prefix`` is ``{rfc}/{path}``. Falls back to listing the bucket when the
+    RFC has no manifest.
+    """
+    rfc, _, path = prefix.strip("/").partition("/")
+    try:
+        return list_files(rfc, bucket, path)
+    except FileNotFoundError:
+        logger.info(f"No manifest published for {rfc}, listing s3://{bucket}/{prefix}.")
+        return list_objects(prefix, bucket)
@@ -0,0 +1,309 @@
+"""Command line entry point for HEFS FEWS Hub maintenance tasks."""
+import argparse
+import logging
+from pathlib import Path
+import sys
+import time
+from typing import List, Optional
+
+from hefs_fews_hub.bundle import bundle_prefix, publish_bundle
+from hefs_fews_hub.catalog import publish_manifest, publish_rfc
+from hefs_fews_hub.dashboard_funcs import (
+    BUCKET_NAME,
+    RFC_IDS,
+    download_historical_data,
+    install_fews_standalone,
+    verify_install,
+)
+from hefs_fews_hub.geo import GEO_DIR, RFC_BOUNDARIES, build_boundary_levels
+from hefs_fews_hub.jobs import Job, JobManager, format_bytes
+from hefs_fews_hub.transfer import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_PART_SIZE,
+    MIN_UPLOAD_PART_SIZE,
+    set_transfer_limits,
+)
+
+
+def publish_bundle_command(args: argparse.Namespace) -> None:
+    """Pack and upload the Config bundle of one or more RFCs."""
+    for rfc in args.rfc:
+        publish_bundle(
+            local_dir=Path(args.source, rfc, "Config"),
+            prefix=bundle_prefix(rfc),
+            bucket=args.bucket,
+            chunk_size=args.chunk_size * 2**20,
+            compression=args.compression,
+            level=args.level,
+        )
+
+
+def publish_manifest_command(args: argparse.Namespace) -> None:
+    """Publish the catalog manifest of one or more RFCs."""
+    for rfc in args.rfc or RFC_IDS:
+        publish_manifest(rfc, args.bucket)
+
+
+def part_size_mib(value: str) -> int:
+    """Parse a multipart upload part size in MiB, at least the S3 minimum."""
+    size = int(value)
+    if size * 2**20 < MIN_UPLOAD_PART_SIZE:
+        raise argparse.ArgumentTypeError(
+            f"must be at least {MIN_UPLOAD_PART_SIZE // 2**20} MiB"
+        )
+    return size
+
+
+def publish_command(args: argparse.Namespace) -> None:
+    """Upload the changed files of one or more local RFC trees and their manifests."""
+    for rfc in args.rfc:
+        started = time.monotonic()
+        manifest = publish_rfc(
+            local_dir=Path(args.source, rfc),
+            rfc=rfc,
+            bucket=args.bucket,
+            concurrency=args.concurrency,
+            part_size=args.part_size * 2**20,
+            delete=args.delete,
+        )
+        print(
+            f"{rfc}: published {len(manifest['objects'])} objects "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+
+
+def build_boundaries_command(args: argparse.Namespace) -> None:
+    """Write the simplified RFC boundary levels used by the dashboard map."""
+    build_boundary_levels(args.source, args.output_dir)
+
+
+def report_progress(jobs: List[Job], started: float) -> str:
+    """Return one line summarizing the progress of all jobs."""
+    done = sum(job.progress.bytes_done for job in jobs)
+    total = sum(job.progress.bytes_total for job in jobs)
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    line = (
+        f"[{elapsed:6.0f}s] {sum(job.done for job in jobs)}/{len(jobs)} jobs done, "
+        f"{format_bytes(done)} of {format_bytes(total)} at {format_bytes(rate)}/s"
+    )
+    if rate and total > done:
+        line += f", about {(total - done) / rate:.0f}s remaining"
+    return line
+
+
+def install_command(args: argparse.Namespace) -> None:
+    """Install the configuration and historical data of several RFCs at once."""
+    download_dir = Path(args.download_dir).resolve()
+    download_dir.mkdir(parents=True, exist_ok=True)
+    set_transfer_limits(
+        max_requests=args.concurrency,
+        bytes_per_second=args.bandwidth * 2**20 if args.bandwidth else None,
+    )
+    manager = JobManager(max_workers=args.workers)
+    jobs = []
+    # Configs first so they start before the larger historical downloads
+    for rfc in args.rfc or RFC_IDS:
+        jobs.append(manager.submit(
+            ("install", rfc),
+            install_fews_standalone,
+            download_dir.as_posix(),
+            rfc,
+            method=args.method,
+            shortcut=not args.no_shortcut,
+            description=f"{rfc} configuration",
+        ))
+    if not args.skip_historical:
+        for rfc in args.rfc or RFC_IDS:
+            jobs.append(manager.submit(
+                ("historical", rfc),
+                download_historical_data,
+                download_dir.as_posix(),
+                rfc,
+                description=f"{rfc} historical data",
+            ))
+
+    started = time.monotonic()
+    try:
+        while not all(job.done for job in jobs):
+            time.sleep(args.report_interval)
+            print(report_progress(jobs, started), flush=True)
+    except KeyboardInterrupt:
+        print("Cancelling...", flush=True)
+        for job in jobs:
+            job.cancel()
+        while not all(job.done for job in jobs):
+            time.sleep(0.5)
+
+    print(f"\nSummary ({time.monotonic() - started:.0f}s):")
+    for job in jobs:
+        print(f"  {job.status_text()}")
+    failed = [job for job in jobs if job.state != "done"]
+    if failed:
+        sys.exit(f"{len(failed)} of {len(jobs)} jobs did not complete.")
+
+
+def verify_command(args: argparse.Namespace) -> None:
+    """Verify installed configurations against the bucket."""
+    failed = []
+    for rfc in args.rfc:
+        report = verify_install(args.download_dir, rfc, refetch=args.refetch)
+        print(f"{rfc}: {report.summary()}")
+        for path in report.mismatched:
+            print(f"  mismatched: {path}")
+        for path in report.missing:
+            print(f"  missing: {path}")
+        if not report.ok:
+            failed.append(rfc)
+    if failed:
+        sys.exit(f"Verification failed for {', '.join(failed)}.")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser for the ``hefs-fews`` command."""
+    parser = argparse.ArgumentParser(prog="hefs-fews", description=__doc__)
+    parser.add_argument("--bucket", default=BUCKET_NAME, help="S3 bucket name.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    publish = subparsers.add_parser(
+        "publish-bundle",
+        help="Pack {rfc}/Config into compressed chunks and upload them.",
+    )
+    publish.add_argument(
+        "--rfc", action="append", required=True, choices=RFC_IDS,
+        help="RFC to publish; may be given several times.",
+    )
+    publish.add_argument(
+        "--source", required=True,
+        help="Local directory containing one {rfc}/Config tree per RFC.",
+    )
+    publish.add_argument(
+        "--chunk-size", type=int, default=256,
+        help="Uncompressed size of each chunk in MiB (default: 256).",
+    )
+    publish.add_argument(
+        "--compression", choices=["zst", "gz"], default=None,
+        help="Chunk compression (default: zst if zstandard is installed, else gz).",
+    )
+    publish.add_argument("--level", type=int, default=3, help="Compression level.")
+    publish.set_defaults(func=publish_bundle_command)
+
+    manifest = subparsers.add_parser(
+        "publish-manifest",
+        help="List {rfc}/ once and publish it as {rfc}/manifest.json.",
+    )
+    manifest.add_argument(
+        "--rfc", action="append", choices=RFC_IDS,
+        help="RFC to publish; may be given several times (default: all).",
+    )
+    manifest.set_defaults(func=publish_manifest_command)
+
+    upload = subparsers.add_parser(
+        "publish",
+        help="Upload the changed files of local {rfc}/ trees and publish their manifests.",
+    )
+    upload.add_argument(
+        "--rfc", action="append", required=True, choices=RFC_IDS,
+        help="RFC to publish; may be given several times.",
+    )
+    upload.add_argument(
+        "--source", required=True, help="Local directory containing one {rfc}/ tree per RFC."
+    )
+    upload.add_argument(
+        "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+        help=f"Parts read or in flight at once (default: {DEFAULT_CONCURRENCY}).",
+    )
+    upload.add_argument(
+        "--part-size", type=part_size_mib, default=DEFAULT_PART_SIZE // 2**20,
+        help=f"Multipart upload part size in MiB, at least {MIN_UPLOAD_PART_SIZE // 2**20} "
+             f"(default: {DEFAULT_PART_SIZE // 2**20}).",
+    )
+    upload.add_argument(
+        "--delete", action="store_true",
+        help="Remove objects under {rfc}/ that are not in the local tree, "
+             "except the published bundles under {rfc}/bundles/.",
+    )
+    upload.set_defaults(func=publish_command)
+
+    boundaries = subparsers.add_parser(
+        "build-boundaries",
+        help="Build simplified multi-resolution RFC boundaries for the map.",
+    )
+    boundaries.add_argument(
+        "--source", default=RFC_BOUNDARIES, help="Full-resolution GeoJSON boundaries."
+    )
+    boundaries.add_argument(
+        "--output-dir", default=GEO_DIR, help="Directory for the simplified levels."
+    )
+    boundaries.set_defaults(func=build_boundaries_command)
+
+    install = subparsers.add_parser(
+        "install",
+        help="Install the configuration and historical data of several RFCs concurrently.",
+    )
+    install.add_argument(
+        "--rfc", action="append", choices=RFC_IDS,
+        help="RFC to install; may be given several times (default: all).",
+    )
+    install.add_argument(
+        "--download-dir", required=True, help="Directory to install the RFCs into."
+    )
+    install.add_argument(
+        "--method", choices=["sync", "bundle"], default="sync",
+        help="How to fetch Config (default: sync).",
+    )
+    install.add_argument(
+        "--skip-historical", action="store_true", help="Only install the configurations."
+    )
+    install.add_argument(
+        "--no-shortcut", action="store_true",
+        help="Do not write desktop shortcuts, e.g. on headless provisioning hosts.",
+    )
+    install.add_argument(
+        "--workers", type=int, default=8,
+        help="RFC downloads to run at the same time (default: 8).",
+    )
+    install.add_argument(
+        "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+        help=f"Requests in flight across all RFCs (default: {DEFAULT_CONCURRENCY}).",
+    )
+    install.add_argument(
+        "--bandwidth", type=float, default=None,
+        help="Bandwidth cap across all RFCs in MiB/s (default: none).",
+    )
+    install.add_argument(
+        "--report-interval", type=float, default=5.0,
+        help="Seconds between progress reports (default: 5).",
+    )
+    install.set_defaults(func=install_command)
+
+    verify = subparsers.add_parser(
+        "verify",
+        help="Check installed configurations against the bucket's ETags.",
+    )
+    verify.add_argument(
+        "--rfc", action="append", required=True, choices=RFC_IDS,
+        help="RFC to verify; may be given several times.",
+    )
+    verify.add_argument(
+        "--download-dir", required=True, help="Directory the RFCs are installed in."
+    )
+    verify.add_argument(
+        "--refetch", action="store_true", help="Download mismatched and missing files again."
+    )
+    verify.set_defaults(func=verify_command)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the ``hefs-fews`` command."""
+    logging.basicConfig(
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        level=logging.INFO,
+    )
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,108 @@
 """Utility functions for the RTI HEFS dashboard."""
-import contextlib
+import atexit
+import functools
+import json
 import os
 from pathlib import Path
 import shutil
-from typing import Union, List
-from concurrent import futures
-import subprocess
+import threading
+import time
+from typing import Dict, Optional, Tuple, Union, List
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
 
-logger = logging.getLogger("HEFS-Dashboard")
+# Bundles, storage tiers and the numpy-based cardfile modules are imported
+# where they are used, so importing this module (and starting the dashboard)
+# stays fast.
+from hefs_fews_hub.catalog import list_files, manifest_for_prefix
+from hefs_fews_hub.jobs import JobProgress
+from hefs_fews_hub.jvm import LaunchProfile, java_command, launch_profile, start_script
+from hefs_fews_hub.metrics import stage
+from hefs_fews_hub.planning import (
+    SPACE_MARGIN_BYTES,
+    DownloadPlan,
+    check_space,
+    fit_subset,
+    make_plan,
+    record_throughput,
+)
+from hefs_fews_hub.verify import VerifyReport, verify_directory
+from hefs_fews_hub.transfer import (
+    DEFAULT_CONCURRENCY,
+    TransferItem,
+)
 
-with contextlib.suppress(ImportError):
-    import s3fs
-    s3 = s3fs.S3FileSystem(anon=False)
+logger = logging.getLogger("HEFS-Dashboard")
 
 BUCKET_NAME = "ciroh-rti-hefs-data"
 FEWS_INSTALL_DIR = Path("/opt", "fews")
+RFC_IDS = [
+    "ABRFC",
+    "APRFC",
+    "CBRFC",
+    "CNRFC",
+    "LMRFC",
+    "MARFC",
+    "MBRFC",
+    "NCRFC",
+    "NERFC",
+    "NWRFC",
+    "OHRFC",
+    "SERFC",
+    "WGRFC",
+]
+SYNC_STATE_FILENAME = ".hefs_sync_state.json"
+JOURNAL_FILENAME = ".hefs_journal.jsonl"
+STAGING_DIRNAME = ".hefs_staging"
+FEWS_PATCH_JAR = "fews-install/fews-NA-202102-125264-patch.jar"
+# Prefetches run with few requests and a bandwidth cap, behind user downloads
+PREFETCH_ENV = "HEFS_FEWS_PREFETCH"
+PREFETCH_MAX_BYTES_ENV = "HEFS_FEWS_PREFETCH_MAX_BYTES"
+PREFETCH_BANDWIDTH_ENV = "HEFS_FEWS_PREFETCH_BANDWIDTH"
+DEFAULT_PREFETCH_MAX_BYTES = 2 * 2**30
+DEFAULT_PREFETCH_BANDWIDTH = 20 * 2**20
+PREFETCH_CONCURRENCY = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3():
+    """Return the process-wide s3fs client, created on first use."""
+    import s3fs
+    return s3fs.S3FileSystem(anon=False)
+
+
+# Log files already attached to the dashboard logger in this process
+_log_files = set()
+_log_files_lock = threading.Lock()
+
 
 def set_up_logger(file_path: Union[str, Path]) -> logging.Logger:
-    """Set up a logger for the dashboard."""
+    """Set up a logger for the dashboard.
+
+    Records are put on a queue and written to the file by a listener thread,
+    so logging never blocks a download thread on disk I/O. Each file is
+    attached once per process, so calling this from every Panel session
+    does not stack handlers.
+    """
     logger = logging.getLogger("HEFS-Dashboard")
     logger.setLevel(logging.INFO)
-    handler = logging.FileHandler(file_path)
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-        '%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s'
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    file_path = Path(file_path).resolve()
+    with _log_files_lock:
+        if file_path in _log_files:
+            return logger
+        handler = logging.FileHandler(file_path)
+        handler.setLevel(logging.INFO)
+        formatter = logging.Formatter(
+            '%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s'
+        )
+        handler.setFormatter(formatter)
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(QueueHandler(log_queue))
+        _log_files.add(file_path)
     return logger
 
 
@@ -44,18 +119,19 @@ def extract_archive(
 
 def create_start_standalone_command(
         fews_root_dir: Union[str, Path],
-        configuration_dir: Union[str, Path]
+        configuration_dir: Union[str, Path],
+        profile: Optional[LaunchProfile] = None
 ) -> str:
-    """Create a shell alias for running FEWS."""
+    """Create a shell alias for running FEWS.
+
+    The heap and GC follow ``profile``, by default sized for this container
+    and the installed configuration by ``launch_profile``.
+    """
     # configuration_dir = /home/jovyan/fews/configurations/abrfc_sa_arcful
     # fews_binaries_dir = /opt/fews
-    bash_command = f"{fews_root_dir}/linux/jre/bin/java " \
-        f"-Dregion.home={configuration_dir} " \
-        f"-Xmx100m -splash:{fews_root_dir}/fews-splash.jpg " \
-        f"-Djava.library.path={fews_root_dir}/linux " \
-        f"-XX:ErrorFile={configuration_dir}/jvm-error.txt -XX:-UsePerfData " \
-        f"-cp '{fews_root_dir}/*' Delft.FEWS"
-    return bash_command
+    if profile is None:
+        profile = launch_profile(configuration_dir)
+    return java_command(fews_root_dir, configuration_dir, profile)
 
 
 def _opener(path, flags):
@@ -81,6 +157,7 @@ def write_fews_desktop_shortcut(
         rfc_name: str
 ) -> None:
     """Write a desktop shortcut file to the remote desktop."""
+    Path(output_filepath).parent.mkdir(parents=True, exist_ok=True)
     os.umask(0)
     with open(Path(output_filepath), "w", opener=_opener) as f:
         f.write("[Desktop Entry]\n")
@@ -92,76 +169,297 @@ def write_fews_desktop_shortcut(
     return
 
 
-def s3_download_file(remote_filepath: str, local_filepath: str) -> None:
-    """Download a file from an S3 bucket."""
+def download_with_cache(
+        items: List[TransferItem],
+        progress: Optional[JobProgress] = None,
+        staging: Optional[Union[str, Path]] = None,
+        tiers: Optional[Tuple[str, ...]] = None,
+        **kwargs
+) -> Dict[str, int]:
+    """Download ``items`` through the configured storage tiers.
+
+    Objects come from the ``staging`` directory, the local mirror or the
+    shared cache when those are configured and from S3 otherwise;
+    ``tiers`` restricts them by name, e.g. ``("s3",)``. Keyword
+    arguments are passed on to ``download_items``. Returns its statistics
+    plus the number of objects served by the other tiers.
+    """
+    from hefs_fews_hub.storage import get_storage
+
+    return get_storage(staging, tiers=tiers).fetch(items, progress=progress, **kwargs)
+
+
+def s3_download_file(
+        remote_filepath: str,
+        local_filepath: str,
+        sync: bool = False,
+        progress: Optional[JobProgress] = None,
+        staging: Optional[Union[str, Path]] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        bytes_per_second: Optional[float] = None
+) -> Dict[str, int]:
+    """Download a file from an S3 bucket.
+
+    With ``sync=True`` the download is skipped when the local file has the
+    same size and is not older than the remote object. ``concurrency`` and
+    ``bytes_per_second`` bound the requests and bandwidth of the download.
+    Returns the transfer statistics of ``download_with_cache``.
+    """
+    from hefs_fews_hub.storage import get_storage
+
     Path(local_filepath).parent.mkdir(exist_ok=True, parents=True)
     s3_path = f"{BUCKET_NAME}/{remote_filepath}"
-    s3.get(s3_path, local_filepath)
+    info = get_storage().info(s3_path)
+    if sync and Path(local_filepath).exists():
+        local_stat = Path(local_filepath).stat()
+        last_modified = info.get("LastModified")
+        if local_stat.st_size == info["size"] and (
+            last_modified is None
+            or local_stat.st_mtime >= last_modified.timestamp()
+        ):
+            logger.info(f"{local_filepath} is up to date.")
+            return {}
+    return download_with_cache(
+        [TransferItem(s3_path, str(local_filepath), info["size"], info.get("ETag", "").strip('"'))],
+        progress=progress,
+        staging=staging,
+        concurrency=concurrency,
+        journal_path=f"{local_filepath}{JOURNAL_FILENAME}",
+        bytes_per_second=bytes_per_second,
+    )
+
+
+def s3_download_directory_cli(
+        prefix,
+        local,
+        bucket=BUCKET_NAME,
+        sync=False,
+        prune=False
+):
+    """Download a directory from an S3 bucket.
+
+    Kept for backwards compatibility, this no longer shells out to the AWS CLI
+    and uses the same transfer engine as ``s3_download_directory``.
+    """
+    s3_download_directory(prefix, local, bucket=bucket, sync=sync, prune=prune)
     return
 
 
-def s3_download_directory_cli(prefix, local, bucket=BUCKET_NAME):
-    """Download a directory from an S3 bucket using AWS CLI."""
-    subprocess.run(
-            [
-                "aws",
-                "s3",
-                "cp",
-                f"s3://{bucket}/{prefix}",
-                local,
-                "--recursive",
-                "--only-show-errors"
-            ],
-        )
+def s3_manifest(prefix: str, bucket: str = BUCKET_NAME) -> Dict[str, dict]:
+    """Build a manifest of the objects under a prefix, keyed by relative path.
+
+    Uses the RFC's published catalog manifest and only lists the bucket if
+    none is published. Without an S3 storage tier the mirror is listed.
+    """
+    from hefs_fews_hub.storage import get_storage
+
+    storage = get_storage()
+    if storage.s3 is None and storage.mirror is not None:
+        return storage.mirror.list_objects(prefix)
+    return manifest_for_prefix(prefix, bucket)
+
+
+def read_sync_state(local: Union[str, Path]) -> Dict[str, dict]:
+    """Read the manifest recorded by the last sync of a local directory."""
+    state_path = Path(local, SYNC_STATE_FILENAME)
+    if not state_path.exists():
+        return {}
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.warning(f"Ignoring unreadable sync state: {state_path}")
+        return {}
+
+
+def write_sync_state(local: Union[str, Path], manifest: Dict[str, dict]) -> None:
+    """Atomically record the manifest of a synced local directory."""
+    state_path = Path(local, SYNC_STATE_FILENAME)
+    tmp_path = state_path.with_name(state_path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, state_path)
+    return
+
+
+def plan_sync(
+        manifest: Dict[str, dict],
+        state: Dict[str, dict],
+        local: Union[str, Path]
+) -> Tuple[List[str], List[str]]:
+    """Compare a remote manifest with the state of a local directory.
+
+    A file is up to date when its recorded size and ETag match the
+    manifest's; other fields, such as modification times, may differ between
+    manifests of unchanged objects. Returns the relative paths that need to
+    be fetched and the relative paths that were deleted upstream since the
+    last sync.
+    """
+    to_fetch = []
+    for relative_path, entry in manifest.items():
+        local_path = Path(local, relative_path)
+        recorded = state.get(relative_path, {})
+        if recorded.get("size") != entry["size"] or recorded.get("etag") != entry["etag"] \
+                or not local_path.is_file() or local_path.stat().st_size != entry["size"]:
+            to_fetch.append(relative_path)
+    deleted = [path for path in state if path not in manifest]
+    return to_fetch, deleted
+
+
+def prune_local_files(local: Union[str, Path], relative_paths: List[str]) -> None:
+    """Remove local files that were deleted upstream."""
+    for relative_path in relative_paths:
+        local_path = Path(local, relative_path)
+        if local_path.is_file():
+            logger.info(f"Removing {local_path}, deleted upstream.")
+            local_path.unlink()
     return
 
 
-def s3_download_directory(prefix, local, bucket=BUCKET_NAME):
-    """Download a directory from an S3 bucket using s3fs."""
+def plan_directory(
+        prefix: str,
+        local: Union[str, Path],
+        bucket: str = BUCKET_NAME,
+        sync: bool = False,
+        relative_paths: Optional[List[str]] = None,
+        concurrency: int = DEFAULT_CONCURRENCY
+) -> DownloadPlan:
+    """Plan the download of a directory from an S3 bucket without fetching anything.
+
+    See ``s3_download_directory`` for the arguments.
+    """
+    s3_path = f"{bucket}/{prefix}"
+    manifest = s3_manifest(prefix, bucket)
+    if relative_paths is not None:
+        relative_paths = set(relative_paths)
+        manifest = {k: v for k, v in manifest.items() if k in relative_paths}
+    if sync:
+        to_fetch, deleted = plan_sync(manifest, read_sync_state(local), local)
+        if relative_paths is not None:
+            # Files outside the subset were not deleted upstream
+            deleted = []
+    else:
+        to_fetch, deleted = list(manifest), []
+    items = [
+        TransferItem(
+            remote=f"{s3_path}/{relative_path}",
+            local=os.path.join(local, relative_path),
+            size=manifest[relative_path]["size"],
+            etag=manifest[relative_path]["etag"],
+        )
+        for relative_path in to_fetch
+    ]
+    return make_plan(s3_path, local, items, manifest, deleted, concurrency)
+
+
+def s3_download_directory(
+        prefix,
+        local,
+        bucket=BUCKET_NAME,
+        sync=False,
+        prune=False,
+        concurrency=DEFAULT_CONCURRENCY,
+        progress=None,
+        relative_paths=None,
+        check_free_space=True,
+        staging=None,
+        bytes_per_second=None,
+        tiers=None
+):
+    """Download a directory from an S3 bucket using the async transfer engine.
+
+    With ``sync=True`` the remote manifest is compared with the state recorded
+    by the previous sync and only new or changed objects are fetched;
+    ``prune=True`` also deletes local files that were removed upstream.
+    ``concurrency`` bounds the number of requests in flight. Progress is
+    journaled in the local directory so an interrupted download resumes.
+    ``progress`` (a ``JobProgress``) receives byte counts and cancellation.
+    ``relative_paths`` limits the download to those paths under the prefix.
+    Unless ``check_free_space=False``, raises InsufficientSpaceError before
+    fetching anything if the download would not fit on the local volume.
+    ``staging`` is a directory of prefetched objects to use first and
+    ``bytes_per_second`` caps the bandwidth of this download.
+    ``tiers`` restricts the storage tiers by name, e.g. ``("s3",)``.
+    Returns the transfer statistics of ``download_with_cache``.
+    """
     # Ensure local directory exists
     Path(local).mkdir(exist_ok=True, parents=True)
-    
-    # Construct S3 path
-    s3_path = f"{bucket}/{prefix}"
-    
-    # Get all files in the directory
-    files = s3.glob(f"{s3_path}/**")
-    
-    def download_file(s3_file):
-        # Skip directories
-        if s3_file.endswith('/'):
-            return
-        
-        # Calculate relative path and local destination
-        relative_path = s3_file.replace(f"{bucket}/{prefix}", "").lstrip('/')
-        dest_pathname = os.path.join(local, relative_path)
-        
-        # Create parent directory if needed
-        os.makedirs(os.path.dirname(dest_pathname), exist_ok=True)
-        
-        # Download file
-        s3.get(s3_file, dest_pathname)
-    
-    # Download files in parallel
-    with futures.ThreadPoolExecutor() as executor:
-        futures.wait(
-            [executor.submit(download_file, f) for f in files],
-            return_when=futures.FIRST_EXCEPTION,
+
+    plan = plan_directory(prefix, local, bucket, sync, relative_paths, concurrency)
+    if sync:
+        logger.info(
+            f"Syncing {plan.description}: {len(plan.items)} of {len(plan.manifest)} "
+            f"objects changed, {len(plan.deleted)} deleted upstream."
         )
+    if check_free_space:
+        check_space(plan)
+    if sync and prune:
+        prune_local_files(local, plan.deleted)
+
+    # Download files concurrently, largest first, large objects as parallel byte ranges
+    started = time.monotonic()
+    stats = download_with_cache(
+        plan.items,
+        progress=progress,
+        staging=staging,
+        tiers=tiers,
+        concurrency=concurrency,
+        journal_path=Path(local, JOURNAL_FILENAME),
+        bytes_per_second=bytes_per_second,
+    )
+    record_throughput(stats["bytes"], time.monotonic() - started)
+
+    # Only record the state once everything landed, so a failed sync is retried
+    if sync:
+        state = plan.manifest
+        if relative_paths is not None:
+            state = {**read_sync_state(local), **plan.manifest}
+        write_sync_state(local, state)
     print("Download complete.")
+    return stats
 
 
 def s3_list_contents(prefix: str) -> List[str]:
     """List the contents of an S3 bucket."""
+    rfc, _, path = prefix.strip("/").partition("/")
+    try:
+        files = list_files(rfc, BUCKET_NAME, path)
+        children = sorted({key.split("/")[0] for key in files})
+        return [f"{prefix.strip('/')}/{child}" for child in children]
+    except FileNotFoundError:
+        pass
     s3_path = f"{BUCKET_NAME}/{prefix}"
-    files = s3.ls(s3_path, detail=False)
+    files = get_s3().ls(s3_path, detail=False)
     # Remove bucket name from paths to match original behavior
     filelist = [f.replace(f"{BUCKET_NAME}/", "") for f in files]
     return filelist
 
 
-def install_fews_standalone(download_dir: str, rfc: str) -> None:
-    """Download standalone configuration from S3 to the working directory."""
+def install_fews_standalone(
+        download_dir: str,
+        rfc: str,
+        sync: bool = True,
+        prune: bool = False,
+        method: str = "sync",
+        progress: Optional[JobProgress] = None,
+        class_data_sharing: bool = True,
+        staging: Optional[Union[str, Path]] = None,
+        shortcut: bool = True
+) -> None:
+    """Download standalone configuration from S3 to the working directory.
+
+    By default only objects that changed since the previous install are
+    fetched; pass ``prune=True`` to also delete files removed upstream.
+    With ``method="bundle"`` the packed Config bundle is streamed and
+    extracted first, then a sync fetches the files added or changed since
+    it was published; without a published bundle this is a plain sync.
+    The start script sizes the JVM for this container and the configuration
+    and, with ``class_data_sharing=True``, builds and reuses an AppCDS
+    archive so FEWS starts faster after its first launch. Files prefetched
+    into ``staging`` by ``prefetch_config`` are used first and the RFC's
+    staged files are removed once the install completes. ``shortcut=False``
+    skips the desktop shortcut, e.g. on headless provisioning hosts.
+    """
     fews_download_dir = Path(download_dir)
     if not fews_download_dir.exists():
         logger.info(f"The directory: {fews_download_dir}, does not exist. Please create it first!")
@@ -169,49 +467,364 @@ def install_fews_standalone(download_dir: str, rfc: str) -> None:
 
     # 1. Download sa from S3
     logger.info(f"Downloading {rfc} configuration to {fews_download_dir.as_posix()}...This will take a few minutes...")
-    s3_download_directory_cli(
-        prefix=f"{rfc}/Config",
-        local=Path(fews_download_dir, f"{rfc}/Config").as_posix(),
-    )
+    config_dir = Path(fews_download_dir, f"{rfc}/Config")
+    if method not in ("sync", "bundle"):
+        raise ValueError(f"Unknown install method: {method}")
+    with stage("config", rfc=rfc) as span:
+        extracted = 0
+        if method == "bundle":
+            from hefs_fews_hub.bundle import (
+                bundle_prefix,
+                bundle_sync_state,
+                install_bundle,
+                read_bundle_index,
+            )
+
+            try:
+                index = read_bundle_index(bundle_prefix(rfc), BUCKET_NAME)
+                extracted = install_bundle(
+                    bundle_prefix(rfc), config_dir, BUCKET_NAME, progress=progress, index=index
+                )
+                # Record what the bundle provided, so the sync below only fetches the rest
+                state = {
+                    path: entry for path, entry in read_sync_state(config_dir).items()
+                    if not any(path in chunk["files"] for chunk in index["chunks"])
+                }
+                state.update(bundle_sync_state(index, s3_manifest(f"{rfc}/Config"), config_dir))
+                write_sync_state(config_dir, state)
+            except FileNotFoundError:
+                logger.info(f"No bundle published for {rfc}, syncing instead.")
+                method = "sync"
+        # After a bundle, fetch the files added or changed since it was published
+        stats = s3_download_directory(
+            prefix=f"{rfc}/Config",
+            local=config_dir.as_posix(),
+            sync=sync or method == "bundle",
+            prune=prune,
+            progress=progress,
+            staging=staging,
+        )
+        span.add(stats, objects=stats.get("objects", 0) + extracted)
     # 2. Create the bash command to run the standalone configuration
     logger.info("Creating bash command to start FEWS...")
     sa_dir_path = Path(fews_download_dir, rfc)
-    bash_command_str = create_start_standalone_command(
-        fews_root_dir=FEWS_INSTALL_DIR.as_posix(),
-        configuration_dir=sa_dir_path.as_posix()
-    )
-    # 3. Write the command to start FEWS to a shell script
-    logger.info("Writing shell script to start FEWS...")
-    shell_script_filepath = Path(sa_dir_path, "start_fews_standalone.sh")
-    write_shell_file(shell_script_filepath, bash_command_str)
+    with stage("shell_script", rfc=rfc):
+        profile = launch_profile(sa_dir_path, class_data_sharing=class_data_sharing)
+        logger.info(f"FEWS launch profile: {profile.describe()}")
+        bash_command_str = start_script(
+            fews_root_dir=FEWS_INSTALL_DIR.as_posix(),
+            configuration_dir=sa_dir_path.as_posix(),
+            profile=profile,
+        )
+        # 3. Write the command to start FEWS to a shell script
+        logger.info("Writing shell script to start FEWS...")
+        shell_script_filepath = Path(sa_dir_path, "start_fews_standalone.sh")
+        write_shell_file(shell_script_filepath, bash_command_str)
 
     # 4. Copy in patch file for the downloaded standalone config.
     logger.info("Downloading patch file and global properties...")
-    s3_download_file(
-        remote_filepath="fews-install/fews-NA-202102-125264-patch.jar",
-        local_filepath=Path(sa_dir_path, "fews-NA-202102-125264-patch.jar")
-    )
+    with stage("patch_jar", rfc=rfc) as span:
+        span.add(s3_download_file(
+            remote_filepath=FEWS_PATCH_JAR,
+            local_filepath=Path(sa_dir_path, Path(FEWS_PATCH_JAR).name),
+            sync=sync,
+            progress=progress,
+            staging=staging,
+        ))
     logger.info("Downloading sa_global.properties...Temporarily to Config dir.")
-    s3_download_file(
-        remote_filepath=f"{rfc}/sa_global.properties",
-        local_filepath=Path(sa_dir_path, "Config", "sa_global.properties")
-    )
+    with stage("global_properties", rfc=rfc) as span:
+        span.add(s3_download_file(
+            remote_filepath=f"{rfc}/sa_global.properties",
+            local_filepath=Path(sa_dir_path, "Config", "sa_global.properties"),
+            sync=sync,
+            progress=progress,
+            staging=staging,
+        ))
     # 5. Create FEWS desktop shortcut that calls the shell script
-    desktop_shortcut_filepath = Path(
-        Path.home(),
-        "Desktop",
-        f"{sa_dir_path.name}.desktop"
-    )
-    logger.info(f"Creating FEWS desktop shortcut...{desktop_shortcut_filepath}")
-    write_fews_desktop_shortcut(
-        desktop_shortcut_filepath,
-        shell_script_filepath,
-        rfc
-    )
+    if shortcut:
+        desktop_shortcut_filepath = Path(
+            Path.home(),
+            "Desktop",
+            f"{sa_dir_path.name}.desktop"
+        )
+        logger.info(f"Creating FEWS desktop shortcut...{desktop_shortcut_filepath}")
+        with stage("desktop_shortcut", rfc=rfc):
+            write_fews_desktop_shortcut(
+                desktop_shortcut_filepath,
+                shell_script_filepath,
+                rfc
+            )
+    if staging is not None:
+        shutil.rmtree(Path(staging, rfc), ignore_errors=True)
     logger.info("Installation complete.")
     return
 
 
+def staging_dir(download_dir: Union[str, Path]) -> Path:
+    """Return the directory prefetched objects are staged in, laid out like the bucket."""
+    return Path(download_dir, STAGING_DIRNAME)
+
+
+def evict_staging(download_dir: Union[str, Path], keep: Optional[str] = None) -> None:
+    """Remove the staged files of every RFC but ``keep``."""
+    for path in staging_dir(download_dir).glob("*"):
+        if path.is_dir() and path.name in RFC_IDS and path.name != keep:
+            logger.info(f"Evicting prefetched {path.name} configuration.")
+            shutil.rmtree(path, ignore_errors=True)
+    return
+
+
+def prefetch_config(
+        download_dir: str,
+        rfc: str,
+        max_bytes: Optional[int] = None,
+        bytes_per_second: Optional[float] = None,
+        progress: Optional[JobProgress] = None
+) -> Dict[str, int]:
+    """Stage the files an install of ``rfc`` would fetch, at low priority.
+
+    The patch jar and ``sa_global.properties`` are staged first; then only
+    the Config objects that differ from the installed configuration are
+    staged, smallest first, until ``max_bytes`` of staged files, so the many
+    small files that dominate install time come first. Staged files of
+    other RFCs are evicted. ``max_bytes`` and ``bytes_per_second`` default
+    to ``HEFS_FEWS_PREFETCH_MAX_BYTES`` and ``HEFS_FEWS_PREFETCH_BANDWIDTH``
+    (in MiB/s). Pass ``staging=staging_dir(download_dir)`` to
+    ``install_fews_standalone`` to finalize from the staged files.
+    """
+    from hefs_fews_hub.storage import get_storage
+
+    if max_bytes is None:
+        max_bytes = int(os.environ.get(PREFETCH_MAX_BYTES_ENV, DEFAULT_PREFETCH_MAX_BYTES))
+    if bytes_per_second is None:
+        bytes_per_second = float(os.environ.get(PREFETCH_BANDWIDTH_ENV, 0)) * 2**20 \
+            or DEFAULT_PREFETCH_BANDWIDTH
+    staging = staging_dir(download_dir)
+    evict_staging(download_dir, keep=rfc)
+    staged_config = Path(staging, rfc, "Config")
+    plan = plan_directory(f"{rfc}/Config", Path(download_dir, rfc, "Config"), sync=True)
+    stats = {}
+    budget = max_bytes
+    with stage("prefetch", rfc=rfc) as span:
+        # The install's other files share the bandwidth cap and the byte budget
+        for remote_filepath in (FEWS_PATCH_JAR, f"{rfc}/sa_global.properties"):
+            size = get_storage().info(f"{BUCKET_NAME}/{remote_filepath}")["size"]
+            if size > budget:
+                logger.info(f"Not prefetching {remote_filepath}, it exceeds the prefetch cap.")
+                continue
+            span.add(s3_download_file(
+                remote_filepath=remote_filepath,
+                local_filepath=Path(staging, remote_filepath),
+                sync=True,
+                progress=progress,
+                concurrency=PREFETCH_CONCURRENCY,
+                bytes_per_second=bytes_per_second,
+            ))
+            budget -= size
+        prefix = f"{BUCKET_NAME}/{rfc}/Config/"
+        items = [
+            item._replace(local=os.path.join(staged_config, item.remote[len(prefix):]))
+            for item in plan.items
+        ]
+        subset = fit_subset(items, budget)
+        if len(subset) < len(items):
+            logger.info(f"Prefetching {len(subset)} of {len(items)} {rfc} Config objects (cap).")
+        if subset:
+            stats = s3_download_directory(
+                prefix=f"{rfc}/Config",
+                local=staged_config.as_posix(),
+                sync=True,
+                concurrency=PREFETCH_CONCURRENCY,
+                progress=progress,
+                relative_paths=[item.remote[len(prefix):] for item in subset],
+                bytes_per_second=bytes_per_second,
+            )
+            span.add(stats)
+    return stats
+
+
+def download_historical_data(
+        download_dir: str,
+        rfc: str,
+        sync: bool = True,
+        progress: Optional[JobProgress] = None,
+        build_cache: bool = True,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        geometry: Optional[dict] = None,
+        basin_ids: Optional[List[str]] = None,
+        allow_subset: bool = False,
+        convert_pixml: bool = True
+) -> None:
+    """Download the historical data of an RFC as cardfiles.
+
+    With ``build_cache=True`` new and changed cardfiles are then parsed into
+    the columnar ``CardfileCache`` next to them and, with
+    ``convert_pixml=True``, written as PI-XML files FEWS imports in bulk
+    (see ``pixml.convert_to_pixml``). ``bbox`` (min_lon, min_lat,
+    max_lon, max_lat), ``geometry`` (a GeoJSON polygon) and ``basin_ids``
+    limit the download to the cardfiles of the stations they select; this
+    needs the RFC's published station metadata. If the data does not fit on
+    the volume, InsufficientSpaceError is raised, or with
+    ``allow_subset=True`` as many cardfiles as fit are downloaded.
+    """
+    from hefs_fews_hub.cardfiles import CardfileCache
+    from hefs_fews_hub.historical import STATIONS_FILENAME, cardfile_dir, stations_path
+    from hefs_fews_hub.pixml import convert_to_pixml, pixml_dir
+
+    fews_download_dir = Path(download_dir)
+    if not fews_download_dir.exists():
+        raise ValueError(
+            f"The directory: {fews_download_dir}, "
+            "does not exist. Please create it first!"
+        )
+
+    logger.info(f"Downloading historical data to {fews_download_dir.as_posix()}...")
+    with stage("historical_data", rfc=rfc) as span:
+        # Station locations for spatial selection and queries, where published
+        try:
+            span.add(s3_download_file(
+                remote_filepath=f"{rfc}/{STATIONS_FILENAME}",
+                local_filepath=stations_path(fews_download_dir, rfc),
+                sync=sync,
+                progress=progress,
+            ))
+        except FileNotFoundError:
+            logger.info(f"No station metadata published for {rfc}.")
+        relative_paths = None
+        if bbox is not None or geometry is not None or basin_ids is not None:
+            relative_paths = select_historical_files(
+                fews_download_dir, rfc, bbox=bbox, geometry=geometry, basin_ids=basin_ids
+            )
+        local = cardfile_dir(fews_download_dir, rfc).as_posix()
+        if allow_subset:
+            plan = plan_directory(
+                f"{rfc}/historicalData", local, sync=sync, relative_paths=relative_paths
+            )
+            if not plan.fits:
+                subset = fit_subset(plan.items, plan.free_bytes - SPACE_MARGIN_BYTES)
+                logger.warning(
+                    f"Only {len(subset)} of {len(plan.items)} cardfiles fit, downloading those."
+                )
+                relative_paths = [
+                    Path(item.local).relative_to(local).as_posix() for item in subset
+                ]
+        span.add(s3_download_directory(
+            prefix=f"{rfc}/historicalData",
+            local=local,
+            sync=sync,
+            progress=progress,
+            relative_paths=relative_paths,
+        ))
+    if build_cache:
+        logger.info("Updating the cardfile cache...")
+        with stage("cardfile_cache", rfc=rfc) as span:
+            cache = CardfileCache(cardfile_dir(fews_download_dir, rfc))
+            span.add(objects=cache.update())
+        if convert_pixml:
+            logger.info("Converting cardfiles to PI-XML...")
+            with stage("pixml", rfc=rfc) as span:
+                span.add(objects=convert_to_pixml(cache, pixml_dir(fews_download_dir, rfc)))
+    logger.info("Data download complete.")
+    return
+
+
+def verify_install(
+        download_dir: Union[str, Path],
+        rfc: str,
+        refetch: bool = False,
+        progress: Optional[JobProgress] = None
+) -> VerifyReport:
+    """Check an installed configuration against the bucket.
+
+    Files whose size and modification time did not change since they last
+    verified are not hashed again. With ``refetch=True`` mismatched and
+    missing files are downloaded again from S3, bypassing the staging,
+    mirror and cache tiers, and verified once more.
+    """
+    local = Path(download_dir, rfc, "Config")
+    prefix = f"{rfc}/Config"
+    manifest = s3_manifest(prefix)
+    if progress is not None:
+        progress.add_total(sum(entry["size"] for entry in manifest.values()))
+    report = verify_directory(
+        local, manifest, callback=progress.advance if progress is not None else None
+    )
+    logger.info(f"Verified {local}: {report.summary()}")
+    if refetch and not report.ok:
+        logger.info(f"Fetching {len(report.bad)} files again...")
+        # Only from S3; a mirror or the cache may hold the same bad copy
+        s3_download_directory(
+            prefix, local.as_posix(), relative_paths=report.bad, tiers=("s3",)
+        )
+        report = verify_directory(local, {path: manifest[path] for path in report.bad})
+        logger.info(f"After fetching again: {report.summary()}")
+    return report
+
+
+def plan_install(download_dir: Union[str, Path], rfc: str, sync: bool = True) -> DownloadPlan:
+    """Plan the configuration download of ``install_fews_standalone``."""
+    return plan_directory(
+        f"{rfc}/Config", Path(download_dir, rfc, "Config").as_posix(), sync=sync
+    )
+
+
+def plan_historical(
+        download_dir: Union[str, Path],
+        rfc: str,
+        sync: bool = True,
+        **selection
+) -> DownloadPlan:
+    """Plan the download of ``download_historical_data``.
+
+    ``selection`` takes the ``bbox``, ``geometry`` and ``basin_ids`` of
+    ``select_historical_files``.
+    """
+    from hefs_fews_hub.historical import cardfile_dir
+
+    relative_paths = None
+    if any(value is not None for value in selection.values()):
+        relative_paths = select_historical_files(download_dir, rfc, **selection)
+    return plan_directory(
+        f"{rfc}/historicalData",
+        cardfile_dir(download_dir, rfc).as_posix(),
+        sync=sync,
+        relative_paths=relative_paths,
+    )
+
+
+def select_historical_files(
+        download_dir: Union[str, Path],
+        rfc: str,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        geometry: Optional[dict] = None,
+        basin_ids: Optional[List[str]] = None
+) -> List[str]:
+    """Return the historicalData paths of the stations inside a selection.
+
+    Stations are selected from the downloaded station metadata of the RFC
+    and must match every criterion given.
+    """
+    from hefs_fews_hub.historical import cardfiles_for_stations, read_stations, station_index
+
+    index = station_index(download_dir, rfc)
+    if not index.stations:
+        raise ValueError(
+            f"No station metadata for {rfc}, cannot select a subset of its historical data."
+        )
+    stations = set(index.stations)
+    if bbox is not None:
+        stations &= index.in_bbox(bbox)
+    if geometry is not None:
+        stations &= index.in_geometry(geometry)
+    if basin_ids is not None:
+        stations &= index.in_basins(basin_ids)
+    files = cardfiles_for_stations(
+        s3_manifest(f"{rfc}/historicalData"), stations, read_stations(download_dir, rfc)
+    )
+    logger.info(f"Selected {len(files)} cardfiles of {len(stations)} stations in {rfc}.")
+    return files
+
+
 
 # if __name__ == "__main__":
 #     s3_download_directory("ABRFC", "/home/sam/temp/abrfc", BUCKET_NAME)
@@ -0,0 +1,198 @@
+"""Server-side decimation of ensemble traces for plotting.
+
+A 40-member, multi-decade series has millions of points; the browser only
+needs about two per pixel. ``decimate_view`` returns, for a visible index
+range, every member decimated by the smallest power-of-two factor that
+keeps the view under a point budget, so zooming in reveals more detail.
+Two methods are available: ``minmax`` keeps the minimum and maximum of each
+bucket, so peaks and the envelope are never lost, and ``lttb``
+(Largest-Triangle-Three-Buckets) keeps the point of each bucket forming the
+largest triangle with its neighbours, which preserves the shape of a trace
+with half as many points. Both are vectorized over the members.
+
+Decimated levels cover the whole series and are kept in a process-wide LRU
+cache bounded in bytes (``HEFS_FEWS_VIEWER_CACHE_BYTES``), so zooming and
+panning reuse them and the memory used does not grow with the number of
+sessions.
+"""
+from collections import OrderedDict
+import functools
+import math
+import os
+import threading
+from typing import Callable, Hashable, NamedTuple, Optional
+
+import numpy as np
+
+CACHE_BYTES_ENV = "HEFS_FEWS_VIEWER_CACHE_BYTES"
+DEFAULT_CACHE_BYTES = 256 * 2**20
+DEFAULT_TARGET_POINTS = 2000
+
+
+class Level(NamedTuple):
+    """Decimated members: value indices and values of shape ``(member, point)``.
+
+    ``starts`` holds the first value index of the bucket of each point
+    column; every member has its points of a bucket in the same columns.
+    """
+
+    indices: np.ndarray
+    values: np.ndarray
+    starts: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return self.indices.nbytes + self.values.nbytes + self.starts.nbytes
+
+
+def _pad(values: np.ndarray, factor: int) -> np.ndarray:
+    buckets = math.ceil(values.shape[1] / factor)
+    padded = np.full((values.shape[0], buckets * factor), np.nan, dtype=values.dtype)
+    padded[:, :values.shape[1]] = values
+    return padded.reshape(values.shape[0], buckets, factor)
+
+
+def minmax_decimate(values: np.ndarray, factor: int) -> Level:
+    """Keep the minimum and maximum of every ``factor`` values, in time order."""
+    if factor <= 1:
+        starts = np.arange(values.shape[1])
+        return Level(np.broadcast_to(starts, values.shape), values, starts)
+    buckets = _pad(values, factor)
+    nan = np.isnan(buckets)
+    low = np.where(nan, np.inf, buckets).argmin(axis=-1)
+    high = np.where(nan, -np.inf, buckets).argmax(axis=-1)
+    offsets = (np.arange(buckets.shape[1]) * factor)[None, :, None]
+    indices = np.stack([np.minimum(low, high), np.maximum(low, high)], axis=-1) + offsets
+    indices = np.minimum(indices.reshape(values.shape[0], -1), values.shape[1] - 1).astype(np.int32)
+    starts = np.repeat(offsets.ravel(), 2)
+    return Level(indices, np.take_along_axis(values, indices, axis=1), starts)
+
+
+def lttb_decimate(values: np.ndarray, factor: int) -> Level:
+    """Keep one point per ``factor`` values by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. Time is the value index, as
+    the series are evenly spaced.
+    """
+    members, count = values.shape
+    buckets = math.ceil(count / factor)
+    if factor <= 1 or buckets < 3:
+        return minmax_decimate(values, factor)
+    rows = np.arange(members)
+    # Inner buckets split the points between the first and the last evenly
+    edges = np.linspace(1, count - 1, buckets - 1).astype(int)
+    indices = np.empty((members, buckets), dtype=np.int32)
+    indices[:, 0] = 0
+    indices[:, -1] = count - 1
+    filled = np.nan_to_num(values)
+    previous = np.zeros(members, dtype=np.int64)
+    for bucket in range(buckets - 2):
+        first, last = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        # The third vertex is the mean of the next bucket (the last point at the end)
+        following = slice(last, max(edges[bucket + 2], last + 1)) \
+            if bucket + 2 < len(edges) else slice(count - 1, count)
+        next_x = (following.start + following.stop - 1) / 2
+        next_y = filled[:, following].mean(axis=1)
+        x = np.arange(first, last)
+        previous_y = filled[rows, previous]
+        area = np.abs(
+            (previous - next_x)[:, None] * (filled[:, first:last] - previous_y[:, None])
+            - (previous[:, None] - x[None, :]) * (next_y - previous_y)[:, None]
+        )
+        previous = first + area.argmax(axis=1)
+        indices[:, bucket + 1] = previous
+    starts = np.concatenate([[0], edges[:-1], [count - 1]])
+    return Level(indices, np.take_along_axis(values, indices, axis=1), starts)
+
+
+METHODS = {"minmax": minmax_decimate, "lttb": lttb_decimate}
+POINTS_PER_BUCKET = {"minmax": 2, "lttb": 1}
+
+
+def choose_factor(count: int, target_points: int, method: str = "minmax") -> int:
+    """Return the smallest power of two decimating ``count`` points to the budget."""
+    buckets = max(target_points // POINTS_PER_BUCKET[method], 1)
+    factor = 1
+    while math.ceil(count / factor) > buckets:
+        factor *= 2
+    return factor
+
+
+class LevelCache:
+    """Thread-safe LRU cache of decimated levels, bounded in bytes."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._levels: "OrderedDict[Hashable, Level]" = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key: Hashable, compute: Callable[[], Level]) -> Level:
+        """Return a cached level, computing and storing it on a miss."""
+        with self._lock:
+            if key in self._levels:
+                self._levels.move_to_end(key)
+                return self._levels[key]
+        level = compute()
+        size = level.nbytes
+        with self._lock:
+            if key not in self._levels and size <= self.max_bytes:
+                self._levels[key] = level
+                self.nbytes += size
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self._levels.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+        return level
+
+    def clear(self) -> None:
+        with self._lock:
+            self._levels.clear()
+            self.nbytes = 0
+
+
+@functools.lru_cache(maxsize=None)
+def get_level_cache() -> LevelCache:
+    """Return the level cache shared by every session of this process."""
+    return LevelCache(int(os.environ.get(CACHE_BYTES_ENV, DEFAULT_CACHE_BYTES)))
+
+
+def decimate_view(
+        key: Hashable,
+        load: Callable[[int, int], np.ndarray],
+        count: int,
+        first: int = 0,
+        last: Optional[int] = None,
+        method: str = "minmax",
+        target_points: int = DEFAULT_TARGET_POINTS,
+        cache: Optional[LevelCache] = None
+) -> Level:
+    """Return the members decimated for the visible index range ``[first, last)``.
+
+    ``key`` identifies the series (it must change when the data do),
+    ``load(first, last)`` returns its ``(member, time)`` values in
+    ``[first, last)`` and ``count`` is their length. The level for the
+    view's point budget is computed over the whole series once and cached;
+    views small enough to show every value read only their window. The
+    returned points include one bucket beyond each edge of the view so lines
+    run off the plot instead of stopping short.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown decimation method: {method}")
+    last = count if last is None else min(last, count)
+    first = min(max(first, 0), last)
+    factor = choose_factor(last - first, target_points, method)
+    if factor == 1:
+        start, stop = max(first - 1, 0), min(last + 1, count)
+        values = load(start, stop)
+        indices = np.arange(start, stop)
+        return Level(np.broadcast_to(indices, values.shape), values, indices)
+    cache = cache or get_level_cache()
+    level = cache.get((key, method, factor), lambda: METHODS[method](load(0, count), factor))
+    # The buckets overlapping the view, plus one more on each side
+    buckets = np.unique(level.starts)
+    low = max(int(np.searchsorted(buckets, first, side="right")) - 2, 0)
+    high = int(np.searchsorted(buckets, last, side="left")) + 1
+    start = int(np.searchsorted(level.starts, buckets[low], side="left"))
+    stop = len(level.starts) if high >= len(buckets) \
+        else int(np.searchsorted(level.starts, buckets[high], side="left"))
+    return Level(level.indices[:, start:stop], level.values[:, start:stop], level.starts[start:stop])
@@ -0,0 +1,327 @@
+"""Ensemble statistics and verification scores of the downloaded series.
+
+Every function works on ``(member, time)`` arrays as returned by
+``read_ensemble`` and is vectorized over members and time; missing values
+are NaN. ``verify_ensembles`` scores the ensembles of many stations against
+their observed series in parallel worker processes. Each station's scores
+are cached in ``{rfc}/ensemble_stats_cache`` under a fingerprint of its
+inputs (the cached cardfiles' modification times and sizes, the time window
+and the parameters), so unchanged stations are not computed again.
+
+Scores:
+
+* CRPS of the ensemble as an empirical distribution, per time step, with
+  ``E|X - y| - E|X - X'| / 2`` computed from the sorted members.
+* Brier score of the exceedance probability of each threshold.
+* Rank histogram of the observation among the members, ties broken at
+  random, over the time steps where every member has a value.
+"""
+from concurrent import futures
+import functools
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Sequence, Union
+import warnings
+
+import numpy as np
+
+from hefs_fews_hub.cardfiles import INDEX_FILENAME, CardfileCache
+from hefs_fews_hub.historical import TimeLike, cardfile_dir, read_ensemble
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+STATS_CACHE_DIRNAME = "ensemble_stats_cache"
+# Bump when the computation changes, to invalidate cached scores
+STATS_VERSION = 1
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class EnsembleScores(NamedTuple):
+    """Statistics and scores of one station's ensemble."""
+
+    station: str
+    variable: str
+    observed_variable: str
+    times: np.ndarray
+    mean: np.ndarray
+    quantile_levels: np.ndarray
+    quantiles: np.ndarray
+    thresholds: np.ndarray
+    exceedance: np.ndarray
+    observed: np.ndarray
+    crps: np.ndarray
+    brier: np.ndarray
+    rank_histogram: np.ndarray
+
+    @property
+    def mean_crps(self) -> float:
+        """Return the CRPS averaged over the time steps with an observation."""
+        valid = ~np.isnan(self.crps)
+        return float(self.crps[valid].mean()) if valid.any() else float("nan")
+
+
+def ensemble_mean(values: np.ndarray) -> np.ndarray:
+    """Return the mean over members of each time step."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(values, axis=0)
+
+
+def ensemble_quantiles(values: np.ndarray, levels: Sequence[float] = DEFAULT_QUANTILES) -> np.ndarray:
+    """Return the quantiles over members, of shape ``(level, time)``.
+
+    Interpolates linearly between the sorted members like ``np.nanquantile``,
+    which loops over time steps when there are NaNs and is much slower.
+    """
+    counts = (~np.isnan(values)).sum(axis=0)
+    # NaN sorts last, so the first ``counts`` rows hold the members in order
+    ordered = np.sort(values, axis=0)
+    position = np.asarray(levels, dtype=np.float64)[:, None] * np.maximum(counts - 1, 0)
+    low = np.floor(position).astype(np.intp)
+    high = np.minimum(low + 1, np.maximum(counts - 1, 0))
+    below = np.take_along_axis(ordered, low, axis=0)
+    above = np.take_along_axis(ordered, high, axis=0)
+    quantiles = below + (position - low) * (above - below)
+    quantiles[:, counts == 0] = np.nan
+    return quantiles.astype(values.dtype)
+
+
+def exceedance_probability(values: np.ndarray, thresholds: Sequence[float]) -> np.ndarray:
+    """Return the fraction of members above each threshold, of shape ``(threshold, time)``."""
+    thresholds = np.asarray(thresholds, dtype=values.dtype)
+    counts = (~np.isnan(values)).sum(axis=0)
+    above = (values[None, :, :] > thresholds[:, None, None]).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, above / counts, np.nan)
+
+
+def crps_ensemble(values: np.ndarray, observed: np.ndarray) -> np.ndarray:
+    """Return the CRPS of each time step; NaN where there is no observation or member."""
+    counts = (~np.isnan(values)).sum(axis=0)
+    # NaN sorts last, so the first ``counts`` rows hold the members in order
+    ordered = np.nan_to_num(np.sort(values, axis=0).astype(np.float64))
+    rank = np.arange(1, values.shape[0] + 1)[:, None]
+    weights = np.where(rank <= counts, 2 * rank - counts - 1, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        error = np.nansum(np.abs(values - observed[None, :]), axis=0) / counts
+        spread = (weights * ordered).sum(axis=0) / counts.astype(np.float64) ** 2
+        crps = error - spread
+    crps[(counts == 0) | np.isnan(observed)] = np.nan
+    return crps
+
+
+def brier_score(
+        probability: np.ndarray,
+        observed: np.ndarray,
+        thresholds: Sequence[float]
+) -> np.ndarray:
+    """Return the Brier score of the exceedance probabilities of each threshold."""
+    thresholds = np.asarray(thresholds)
+    outcome = observed[None, :] > thresholds[:, None]
+    valid = ~np.isnan(observed)[None, :] & ~np.isnan(probability)
+    squared = np.where(valid, (probability - outcome) ** 2, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return squared.sum(axis=1) / valid.sum(axis=1)
+
+
+def rank_histogram(
+        values: np.ndarray,
+        observed: np.ndarray,
+        rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
+    """Count the rank of the observation among the members, ``members + 1`` bins."""
+    rng = rng or np.random.default_rng(0)
+    complete = ~np.isnan(values).any(axis=0) & ~np.isnan(observed)
+    members, obs = values[:, complete], observed[complete]
+    below = (members < obs).sum(axis=0)
+    ties = (members == obs).sum(axis=0)
+    ranks = below + rng.integers(0, ties + 1)
+    return np.bincount(ranks, minlength=values.shape[0] + 1)
+
+
+def score_ensemble(
+        times: np.ndarray,
+        values: np.ndarray,
+        observed_times: np.ndarray,
+        observed_values: np.ndarray,
+        quantile_levels: Sequence[float] = DEFAULT_QUANTILES,
+        thresholds: Sequence[float] = (),
+        seed: int = 0
+) -> dict:
+    """Compute the statistics and scores of an ensemble against an observed series.
+
+    Observations are matched to the ensemble's time steps; steps without
+    one get NaN scores. Returns the fields of ``EnsembleScores`` after
+    ``times``.
+    """
+    observed = np.full(len(times), np.nan, dtype=np.float64)
+    _, at, matched = np.intersect1d(times, observed_times, assume_unique=True, return_indices=True)
+    observed[at] = observed_values[matched]
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    exceedance = exceedance_probability(values, thresholds)
+    return {
+        "mean": ensemble_mean(values),
+        "quantile_levels": np.asarray(quantile_levels, dtype=np.float64),
+        "quantiles": ensemble_quantiles(values, quantile_levels),
+        "thresholds": thresholds,
+        "exceedance": exceedance,
+        "observed": observed,
+        "crps": crps_ensemble(values, observed),
+        "brier": brier_score(exceedance, observed, thresholds),
+        "rank_histogram": rank_histogram(values, observed, np.random.default_rng(seed)),
+    }
+
+
+def fingerprint(cache: CardfileCache, station: str, variables: Iterable[str], **params) -> str:
+    """Return a digest of the cached series of a station and the parameters."""
+    sources = [
+        (path, entry["source_mtime_ns"], entry["source_size"])
+        for variable in variables
+        for path, entry in sorted(cache.find(station, variable))
+    ]
+    text = json.dumps(
+        {"version": STATS_VERSION, "station": station, "sources": sources, "params": params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _read_scores(path: Path) -> Optional[EnsembleScores]:
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            fields = {name: data[name] for name in EnsembleScores._fields}
+    except (OSError, ValueError, KeyError):
+        return None
+    for name in ("station", "variable", "observed_variable"):
+        fields[name] = str(fields[name])
+    return EnsembleScores(**fields)
+
+
+def _write_scores(path: Path, scores: EnsembleScores) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(tmp_path, **scores._asdict())
+    os.replace(tmp_path, path)
+
+
+def station_scores(
+        cache: CardfileCache,
+        station: str,
+        variable: str,
+        observed_variable: str,
+        quantile_levels: Sequence[float] = DEFAULT_QUANTILES,
+        thresholds: Sequence[float] = (),
+        start: Optional[TimeLike] = None,
+        end: Optional[TimeLike] = None,
+        seed: int = 0
+) -> EnsembleScores:
+    """Score one station's ``variable`` ensemble against its ``observed_variable`` series.
+
+    Uses the first cached series of ``observed_variable`` as the
+    observations. Results are cached by the fingerprint of the inputs.
+    """
+    params = {
+        "variable": variable,
+        "observed_variable": observed_variable,
+        "quantile_levels": list(quantile_levels),
+        "thresholds": list(thresholds),
+        "start": start,
+        "end": end,
+        "seed": seed,
+    }
+    digest = fingerprint(cache, station, [variable, observed_variable], **params)
+    path = cache.cache_dir.parent / STATS_CACHE_DIRNAME / f"{digest}.npz"
+    scores = _read_scores(path) if path.exists() else None
+    if scores is not None:
+        return scores
+    ensemble = read_ensemble(None, None, station, variable, start, end, cache=cache)
+    observed = read_ensemble(None, None, station, observed_variable, start, end, cache=cache)
+    scores = EnsembleScores(
+        station=station,
+        variable=variable,
+        observed_variable=observed_variable,
+        times=ensemble.times,
+        **score_ensemble(
+            ensemble.times, ensemble.values, observed.times, observed.values[0],
+            quantile_levels, thresholds, seed,
+        ),
+    )
+    _write_scores(path, scores)
+    return scores
+
+
+@functools.lru_cache(maxsize=4)
+def _worker_cache(cardfile_dir: str, cache_dir: str, index_mtime_ns: int) -> CardfileCache:
+    return CardfileCache(cardfile_dir, cache_dir)
+
+
+def _station_scores_worker(cardfile_dir: str, cache_dir: str, station: str, kwargs: dict) -> EnsembleScores:
+    """Score one station; runs in a worker process, which reads the index once."""
+    index_mtime_ns = Path(cache_dir, INDEX_FILENAME).stat().st_mtime_ns
+    return station_scores(_worker_cache(cardfile_dir, cache_dir, index_mtime_ns), station, **kwargs)
+
+
+def verify_ensembles(
+        download_dir: Union[str, Path],
+        rfc: str,
+        variable: str,
+        observed_variable: str,
+        stations: Optional[Iterable[str]] = None,
+        quantile_levels: Sequence[float] = DEFAULT_QUANTILES,
+        thresholds: Sequence[float] = (),
+        start: Optional[TimeLike] = None,
+        end: Optional[TimeLike] = None,
+        max_workers: Optional[int] = None,
+        cache: Optional[CardfileCache] = None,
+        callback: Optional[Callable[[EnsembleScores], None]] = None
+) -> Dict[str, EnsembleScores]:
+    """Score the ``variable`` ensembles of an RFC's stations in parallel.
+
+    ``stations`` defaults to every station with both ``variable`` and
+    ``observed_variable`` series. Stations that cannot be scored are
+    logged and left out. ``callback`` is called with each station's scores.
+    Pass an up-to-date ``cache`` to skip the check for changed cardfiles.
+    """
+    if cache is None:
+        directory = cardfile_dir(download_dir, rfc)
+        if not directory.exists():
+            raise ValueError(
+                f"The directory: {directory}, does not exist. "
+                "Please download the historical data first!"
+            )
+        cache = CardfileCache(directory)
+        cache.update()
+    available = {entry["station"] for _, entry in cache.find(variable=variable)} \
+        & {entry["station"] for _, entry in cache.find(variable=observed_variable)}
+    stations = sorted(available if stations is None else set(stations) & available)
+    kwargs = {
+        "variable": variable,
+        "observed_variable": observed_variable,
+        "quantile_levels": tuple(quantile_levels),
+        "thresholds": tuple(thresholds),
+        "start": start,
+        "end": end,
+    }
+    results = {}
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        jobs = {
+            executor.submit(
+                _station_scores_worker,
+                str(cache.cardfile_dir), str(cache.cache_dir), station, kwargs,
+            ): station
+            for station in stations
+        }
+        for job in futures.as_completed(jobs):
+            station = jobs[job]
+            try:
+                results[station] = job.result()
+            except ValueError as e:
+                logger.warning(f"Could not score {station}: {e}")
+                continue
+            if callback is not None:
+                callback(results[station])
+    return dict(sorted(results.items()))
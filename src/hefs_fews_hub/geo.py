@@ -0,0 +1,188 @@
+"""Simplified, multi-resolution RFC boundary layers.
+
+The full-resolution ``geo/rfc_boundaries.geojson`` is much larger than the
+map needs at the zoom levels the dashboard shows. ``build_boundary_levels``
+writes one simplified, coordinate-quantized copy per zoom level, and the
+dashboard serves the level that matches the current zoom.
+
+Simplification is topology preserving: rings are split into arcs wherever
+the set of polygons sharing a vertex changes, and every arc is simplified
+once in a canonical direction, so borders shared by neighbouring RFCs stay
+identical and no gaps or slivers open up between them.
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+GEO_DIR = Path(__file__).parent / "geo"
+RFC_BOUNDARIES = GEO_DIR / "rfc_boundaries.geojson"
+# Minimum map zoom -> (simplification tolerance in degrees, decimals kept)
+BOUNDARY_LEVELS = {
+    0: (0.05, 2),
+    5: (0.01, 3),
+    7: (0.002, 4),
+}
+KEEP_PROPERTIES = ("BASIN_ID",)
+
+Point = Tuple[float, float]
+
+
+def boundaries_path(level: int) -> Path:
+    """Return the path of the simplified boundaries for a zoom level."""
+    return GEO_DIR / f"rfc_boundaries_z{level}.geojson"
+
+
+def level_for_zoom(zoom: float) -> int:
+    """Return the boundary level to display at a map zoom."""
+    return max(level for level in BOUNDARY_LEVELS if level <= zoom)
+
+
+def _perpendicular_distance(point: Point, start: Point, end: Point) -> float:
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    return abs(dy * x - dx * y + x2 * y1 - y2 * x1) / (dx * dx + dy * dy) ** 0.5
+
+
+def douglas_peucker(points: Sequence[Point], tolerance: float) -> List[Point]:
+    """Simplify a line, keeping its end points."""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance, index = 0.0, None
+        for i in range(first + 1, last):
+            distance = _perpendicular_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.extend([(first, index), (index, last)])
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _rings(geometry: dict) -> List[List[Point]]:
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return []
+    return [[tuple(p[:2]) for p in ring] for polygon in polygons for ring in polygon]
+
+
+def _quantize(ring: List[Point], decimals: int) -> List[Point]:
+    quantized = []
+    for x, y in ring:
+        point = (round(x, decimals), round(y, decimals))
+        if not quantized or quantized[-1] != point:
+            quantized.append(point)
+    return quantized
+
+
+def _simplify_ring(
+        ring: List[Point],
+        owners: Dict[Point, frozenset],
+        tolerance: float,
+        arcs: Dict[tuple, List[Point]]
+) -> List[Point]:
+    """Simplify a closed ring arc by arc, reusing arcs simplified before."""
+    points = ring[:-1] if ring[0] == ring[-1] else ring
+    n = len(points)
+    if n < 4:
+        return ring
+    breaks = [
+        i for i in range(n)
+        if owners[points[i]] != owners[points[i - 1]]
+        or owners[points[i]] != owners[points[(i + 1) % n]]
+    ]
+    if not breaks:
+        # An unshared ring: pin the first point and the point farthest from it
+        x0, y0 = points[0]
+        far = max(
+            range(n),
+            key=lambda i: (points[i][0] - x0) ** 2 + (points[i][1] - y0) ** 2,
+        )
+        breaks = [0, far] if far else [0]
+    simplified = []
+    for start, end in zip(breaks, breaks[1:] + [breaks[0] + n]):
+        arc = [points[i % n] for i in range(start, end + 1)]
+        canonical = tuple(arc) if arc[0] <= arc[-1] else tuple(reversed(arc))
+        if canonical not in arcs:
+            arcs[canonical] = douglas_peucker(canonical, tolerance)
+        if canonical == tuple(arc):
+            simplified.extend(arcs[canonical][:-1])
+        else:
+            simplified.extend(list(reversed(arcs[canonical]))[:-1])
+    simplified.append(simplified[0])
+    return simplified if len(simplified) >= 4 else ring
+
+
+def simplify_feature_collection(
+        collection: dict,
+        tolerance: float,
+        decimals: int,
+        keep_properties: Optional[Sequence[str]] = KEEP_PROPERTIES
+) -> dict:
+    """Return a simplified, quantized copy of a polygon feature collection."""
+    quantized = []
+    owners: Dict[Point, set] = {}
+    ring_id = 0
+    for feature in collection["features"]:
+        rings = [_quantize(ring, decimals) for ring in _rings(feature["geometry"])]
+        quantized.append(rings)
+        for ring in rings:
+            ring_id += 1
+            for point in ring:
+                owners.setdefault(point, set()).add(ring_id)
+    frozen = {point: frozenset(ids) for point, ids in owners.items()}
+
+    arcs: Dict[tuple, List[Point]] = {}
+    features = []
+    for feature, rings in zip(collection["features"], quantized):
+        geometry = feature["geometry"]
+        simplified = [_simplify_ring(ring, frozen, tolerance, arcs) for ring in rings]
+        if geometry["type"] == "Polygon":
+            coordinates = [[list(p) for p in ring] for ring in simplified]
+        else:
+            coordinates, offset = [], 0
+            for polygon in geometry["coordinates"]:
+                coordinates.append([
+                    [list(p) for p in ring]
+                    for ring in simplified[offset:offset + len(polygon)]
+                ])
+                offset += len(polygon)
+        properties = feature.get("properties") or {}
+        if keep_properties is not None:
+            properties = {k: v for k, v in properties.items() if k in keep_properties}
+        features.append({
+            "type": "Feature",
+            "properties": properties,
+            "geometry": {"type": geometry["type"], "coordinates": coordinates},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def build_boundary_levels(
+        source: Union[str, Path] = RFC_BOUNDARIES,
+        output_dir: Union[str, Path] = GEO_DIR
+) -> List[Path]:
+    """Write one simplified boundary file per zoom level."""
+    with open(source) as f:
+        collection = json.load(f)
+    paths = []
+    for level, (tolerance, decimals) in BOUNDARY_LEVELS.items():
+        simplified = simplify_feature_collection(collection, tolerance, decimals)
+        path = Path(output_dir, boundaries_path(level).name)
+        with open(path, "w") as f:
+            json.dump(simplified, f, separators=(",", ":"))
+        logger.info(f"Wrote {path} ({path.stat().st_size} bytes).")
+        paths.append(path)
+    return paths
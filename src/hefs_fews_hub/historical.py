@@ -0,0 +1,285 @@
+"""Query the historical data an RFC has downloaded.
+
+Selects series from the ``CardfileCache`` of ``{download_dir}/{rfc}`` by
+station, variable, time window and bounding box. Station locations come
+from ``{rfc}/stations.geojson``, a point FeatureCollection whose features
+carry a ``STATION_ID`` (the station id of the cardfiles) and optionally a
+``BASIN_ID``, a ``NAME`` and ``CARDFILES``, the paths of the station's
+cardfiles relative to ``historicalData`` (by default, files named
+``{STATION_ID}.*``). Time windows are resolved against the start and
+length recorded in the cache index, so only the memory-mapped blocks inside
+the window are read, and results are yielded in bounded chunks.
+``read_ensemble`` aligns every series of a station and variable (e.g. the
+members of a hindcast) into one ``(member, time)`` array.
+"""
+import functools
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from hefs_fews_hub.cardfiles import CardfileCache
+from hefs_fews_hub.spatial import StationIndex
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+STATIONS_FILENAME = "stations.geojson"
+DEFAULT_CHUNK_VALUES = 2**20
+# Datacards mark missing values with -999 (sometimes -998)
+MISSING_BELOW = -997.5
+
+TimeLike = Union[str, datetime, np.datetime64]
+# (min_lon, min_lat, max_lon, max_lat)
+BBox = Tuple[float, float, float, float]
+
+
+class SeriesChunk(NamedTuple):
+    """A contiguous block of one cardfile series."""
+
+    path: str
+    station: str
+    variable: str
+    units: str
+    times: np.ndarray
+    values: np.ndarray
+
+
+class Ensemble(NamedTuple):
+    """The aligned series of one station and variable."""
+
+    station: str
+    variable: str
+    units: str
+    members: List[str]
+    times: np.ndarray
+    values: np.ndarray
+
+
+def cardfile_dir(download_dir: Union[str, Path], rfc: str) -> Path:
+    """Return the directory the historical data of an RFC is downloaded to."""
+    return Path(download_dir, rfc, "cardfiles")
+
+
+def stations_path(download_dir: Union[str, Path], rfc: str) -> Path:
+    """Return the path of the downloaded station metadata of an RFC."""
+    return Path(download_dir, rfc, STATIONS_FILENAME)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_stations(path: str, mtime_ns: int) -> Dict[str, dict]:
+    with open(path) as f:
+        collection = json.load(f)
+    stations = {}
+    for feature in collection["features"]:
+        properties = feature.get("properties") or {}
+        station = properties.get("STATION_ID")
+        geometry = feature.get("geometry") or {}
+        if station is None or geometry.get("type") != "Point":
+            continue
+        lon, lat = geometry["coordinates"][:2]
+        stations[str(station)] = {
+            "lon": lon,
+            "lat": lat,
+            "basin_id": properties.get("BASIN_ID"),
+            "name": properties.get("NAME", ""),
+            "cardfiles": properties.get("CARDFILES"),
+        }
+    return stations
+
+
+def read_stations(download_dir: Union[str, Path], rfc: str) -> Dict[str, dict]:
+    """Return the station metadata of an RFC keyed by station id.
+
+    Returns an empty dict if no station metadata was downloaded.
+    """
+    path = stations_path(download_dir, rfc)
+    if not path.exists():
+        return {}
+    return _read_stations(str(path), path.stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=32)
+def _station_index(path: str, mtime_ns: int) -> StationIndex:
+    return StationIndex(_read_stations(path, mtime_ns))
+
+
+def station_index(download_dir: Union[str, Path], rfc: str) -> StationIndex:
+    """Return the spatial index of the downloaded station metadata of an RFC."""
+    path = stations_path(download_dir, rfc)
+    if not path.exists():
+        return StationIndex({})
+    return _station_index(str(path), path.stat().st_mtime_ns)
+
+
+def cardfiles_for_stations(
+        files: Iterable[str],
+        stations: Iterable[str],
+        metadata: Dict[str, dict]
+) -> List[str]:
+    """Return the cardfiles among ``files`` (relative to ``historicalData``) of ``stations``."""
+    files = set(files)
+    stations = set(stations)
+    selected = set()
+    for station in stations:
+        listed = (metadata.get(station) or {}).get("cardfiles")
+        if listed:
+            selected.update(path for path in listed if path in files)
+    unlisted = {s for s in stations if not (metadata.get(s) or {}).get("cardfiles")}
+    selected.update(
+        path for path in files
+        if Path(path).name.split(".")[0] in unlisted
+    )
+    return sorted(selected)
+
+
+def _hours(value: TimeLike) -> np.datetime64:
+    return np.datetime64(value, "h")
+
+
+def window_slice(entry: dict, start: Optional[TimeLike], end: Optional[TimeLike]) -> slice:
+    """Return the value indices of a cache entry inside ``[start, end]``."""
+    base, step, count = _hours(entry["start"]), entry["timestep_hours"], entry["count"]
+    # Value i is at base + (i + 1) * step
+    first = 0
+    if start is not None:
+        offset = int((_hours(start) - base).astype(int))
+        first = min(max(-(-offset // step) - 1, 0), count)
+    last = count
+    if end is not None:
+        offset = int((_hours(end) - base).astype(int))
+        last = min(max(offset // step, 0), count)
+    return slice(first, max(first, last))
+
+
+def query_historical(
+        download_dir: Union[str, Path],
+        rfc: str,
+        stations: Optional[Iterable[str]] = None,
+        variables: Optional[Iterable[str]] = None,
+        start: Optional[TimeLike] = None,
+        end: Optional[TimeLike] = None,
+        bbox: Optional[BBox] = None,
+        chunk_size: int = DEFAULT_CHUNK_VALUES
+) -> Iterator[SeriesChunk]:
+    """Yield the downloaded series of an RFC matching a selection.
+
+    ``stations`` and ``variables`` (datacard data types, e.g. ``MAP``) limit
+    the series; ``start`` and ``end`` limit the time window (inclusive);
+    ``bbox`` keeps stations whose location in ``stations.geojson`` lies
+    inside it. Each series is yielded in chunks of at most ``chunk_size``
+    values, copied out of the memory-mapped cache, so memory stays bounded.
+    """
+    directory = cardfile_dir(download_dir, rfc)
+    if not directory.exists():
+        raise ValueError(
+            f"The directory: {directory}, does not exist. "
+            "Please download the historical data first!"
+        )
+    cache = CardfileCache(directory)
+    cache.update()
+
+    selected = set(stations) if stations is not None else None
+    if bbox is not None:
+        inside = station_index(download_dir, rfc).in_bbox(bbox)
+        selected = inside if selected is None else selected & inside
+    variables = set(variables) if variables is not None else None
+
+    for path, entry in cache.find():
+        if selected is not None and entry["station"] not in selected:
+            continue
+        if variables is not None and entry["variable"] not in variables:
+            continue
+        window = window_slice(entry, start, end)
+        if window.start == window.stop:
+            continue
+        values = cache.values(path)
+        base, step = _hours(entry["start"]), entry["timestep_hours"]
+        for first in range(window.start, window.stop, chunk_size):
+            last = min(first + chunk_size, window.stop)
+            steps = np.arange(first + 1, last + 1) * step
+            yield SeriesChunk(
+                path=path,
+                station=entry["station"],
+                variable=entry["variable"],
+                units=entry["units"],
+                times=base + steps.astype("timedelta64[h]"),
+                values=np.array(values[first:last]),
+            )
+
+
+def _ensemble_entries(cache: CardfileCache, station: str, variable: str) -> List[Tuple[str, dict]]:
+    entries = sorted(cache.find(station, variable))
+    if not entries:
+        raise ValueError(f"No {variable} series of {station} in {cache.cache_dir}.")
+    if len({entry["timestep_hours"] for _, entry in entries}) > 1:
+        raise ValueError(f"The {variable} series of {station} have different time steps.")
+    return entries
+
+
+def ensemble_axis(cache: CardfileCache, station: str, variable: str) -> dict:
+    """Return the common time axis of a station and variable's series.
+
+    The axis is described like a cache entry (``start``, ``timestep_hours``
+    and ``count``), so ``window_slice`` applies to it.
+    """
+    entries = _ensemble_entries(cache, station, variable)
+    step = entries[0][1]["timestep_hours"]
+    base = min(_hours(entry["start"]) for _, entry in entries)
+    count = max(
+        int((_hours(entry["start"]) - base).astype(int)) // step + entry["count"]
+        for _, entry in entries
+    )
+    return {"start": str(base), "timestep_hours": step, "count": count}
+
+
+def read_ensemble(
+        download_dir: Optional[Union[str, Path]],
+        rfc: Optional[str],
+        station: str,
+        variable: str,
+        start: Optional[TimeLike] = None,
+        end: Optional[TimeLike] = None,
+        cache: Optional[CardfileCache] = None
+) -> Ensemble:
+    """Return every cached series of a station and variable as one ensemble.
+
+    Members are the cardfiles of the station and variable, aligned on the
+    axis of ``ensemble_axis``; ``values`` has shape ``(member, time)`` with
+    missing values and times outside a member's period as NaN. ``start``
+    and ``end`` limit the window. Pass an up-to-date ``cache`` to skip the
+    check for changed cardfiles; ``download_dir`` and ``rfc`` are then unused.
+    """
+    if cache is None:
+        directory = cardfile_dir(download_dir, rfc)
+        if not directory.exists():
+            raise ValueError(
+                f"The directory: {directory}, does not exist. "
+                "Please download the historical data first!"
+            )
+        cache = CardfileCache(directory)
+        cache.update()
+    entries = _ensemble_entries(cache, station, variable)
+    axis = ensemble_axis(cache, station, variable)
+    base, step = _hours(axis["start"]), axis["timestep_hours"]
+    window = window_slice(axis, start, end)
+    values = np.full((len(entries), window.stop - window.start), np.nan, dtype=np.float32)
+    for row, (path, entry) in enumerate(entries):
+        offset = int((_hours(entry["start"]) - base).astype(int)) // step
+        member = cache.values(path)
+        first = max(window.start - offset, 0)
+        last = min(window.stop - offset, len(member))
+        if first < last:
+            values[row, offset + first - window.start:offset + last - window.start] = member[first:last]
+    values[values < MISSING_BELOW] = np.nan
+    times = base + (np.arange(window.start + 1, window.stop + 1) * step).astype("timedelta64[h]")
+    return Ensemble(
+        station=station,
+        variable=variable,
+        units=entries[0][1]["units"],
+        members=[path for path, _ in entries],
+        times=times,
+        values=values,
+    )
@@ -0,0 +1,211 @@
+"""Background job manager for dashboard downloads.
+
+Downloads run in a worker pool shared by every session of the Panel
+process, so button callbacks return immediately and the UI stays
+responsive. Each job reports byte-level progress and can be cancelled.
+Submitting a job whose key matches one that is still running returns the
+running job instead of starting a duplicate, e.g. when two sessions install
+the same RFC into the same directory.
+"""
+from concurrent import futures
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+DEFAULT_MAX_WORKERS = 4
+# One prefetch at a time, so a cancelled prefetch ends before the next starts
+PREFETCH_MAX_WORKERS = 1
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled."""
+
+
+def format_bytes(nbytes: float) -> str:
+    """Format a byte count for display."""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(nbytes) < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TiB"
+
+
+class JobProgress:
+    """Thread-safe byte counter shared between a job and its observers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.started = time.monotonic()
+        self.cancel_event = threading.Event()
+
+    def add_total(self, nbytes: int) -> None:
+        """Announce ``nbytes`` more bytes of work."""
+        with self._lock:
+            self.bytes_total += nbytes
+
+    def advance(self, nbytes: int) -> None:
+        """Record ``nbytes`` of completed work; raise if the job was cancelled."""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        with self._lock:
+            self.bytes_done += nbytes
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def fraction(self) -> float:
+        """Return the completed fraction between 0 and 1."""
+        with self._lock:
+            if not self.bytes_total:
+                return 0.0
+            return min(self.bytes_done / self.bytes_total, 1.0)
+
+    @property
+    def throughput(self) -> float:
+        """Return the average throughput in bytes per second."""
+        elapsed = time.monotonic() - self.started
+        return self.bytes_done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Return the estimated seconds remaining, or None if unknown."""
+        throughput = self.throughput
+        if not throughput or not self.bytes_total:
+            return None
+        return max(self.bytes_total - self.bytes_done, 0) / throughput
+
+
+class Job:
+    """A download running in the job manager's worker pool."""
+
+    def __init__(self, key: Hashable, description: str, progress: JobProgress):
+        self.key = key
+        self.description = description
+        self.progress = progress
+        self.future: Optional[futures.Future] = None
+
+    @property
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    @property
+    def state(self) -> str:
+        """Return one of ``running``, ``done``, ``failed`` or ``cancelled``."""
+        if not self.done:
+            return "running"
+        if self.future.cancelled() or self.progress.cancelled:
+            return "cancelled"
+        return "failed" if self.future.exception() is not None else "done"
+
+    def cancel(self) -> None:
+        """Ask the job to stop at the next progress update."""
+        self.progress.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def status_text(self) -> str:
+        """Return a one-line summary of the job's progress."""
+        progress = self.progress
+        state = self.state
+        if state == "failed":
+            return f"{self.description}: failed ({self.future.exception()})"
+        if state != "running":
+            return f"{self.description}: {state} ({format_bytes(progress.bytes_done)})"
+        text = (
+            f"{self.description}: {format_bytes(progress.bytes_done)} of "
+            f"{format_bytes(progress.bytes_total)} at "
+            f"{format_bytes(progress.throughput)}/s"
+        )
+        if progress.eta is not None:
+            text += f", {progress.eta:.0f}s remaining"
+        return text
+
+
+class JobManager:
+    """Run download jobs in a worker pool, deduplicating identical requests."""
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, name: str = "hefs-job"):
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self._jobs: Dict[Hashable, Job] = {}
+
+    def submit(
+            self,
+            key: Hashable,
+            func: Callable,
+            *args,
+            description: str = "",
+            **kwargs
+    ) -> Job:
+        """Run ``func(*args, progress=..., **kwargs)`` in the worker pool.
+
+        If a job with the same ``key`` is still running it is returned
+        instead of starting another one.
+        """
+        with self._lock:
+            existing = self._jobs.get(key)
+            if existing is not None and not existing.done:
+                logger.info(f"Joining running job: {existing.description}")
+                return existing
+            job = Job(key, description or str(key), JobProgress())
+            job.future = self._executor.submit(
+                self._run, job, func, *args, progress=job.progress, **kwargs
+            )
+            self._jobs[key] = job
+        return job
+
+    @staticmethod
+    def _run(job: Job, func: Callable, *args, **kwargs):
+        logger.info(f"Started job: {job.description}")
+        try:
+            result = func(*args, **kwargs)
+        except JobCancelled:
+            logger.info(f"Cancelled job: {job.description}")
+            raise
+        except Exception:
+            logger.exception(f"Job failed: {job.description}")
+            raise
+        logger.info(f"Finished job: {job.description}")
+        return result
+
+    def get(self, key: Hashable) -> Optional[Job]:
+        """Return the most recent job with ``key``."""
+        with self._lock:
+            return self._jobs.get(key)
+
+    def cancel(self, key: Hashable) -> None:
+        """Cancel the job with ``key`` if it is running."""
+        job = self.get(key)
+        if job is not None and not job.done:
+            job.cancel()
+
+    def active(self) -> List[Job]:
+        """Return the jobs that are still running."""
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.done]
+
+
+@functools.lru_cache(maxsize=None)
+def get_job_manager() -> JobManager:
+    """Return the job manager shared by every session of this process."""
+    return JobManager()
+
+
+@functools.lru_cache(maxsize=None)
+def get_prefetch_manager() -> JobManager:
+    """Return the job manager running background prefetches of this process.
+
+    It is separate from ``get_job_manager`` so prefetches never hold up the
+    downloads users ask for.
+    """
+    return JobManager(max_workers=PREFETCH_MAX_WORKERS, name="hefs-prefetch")
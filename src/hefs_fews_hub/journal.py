@@ -0,0 +1,106 @@
+"""On-disk checkpoint journal for resumable downloads."""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Set, Tuple, Union
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+
+class TransferJournal:
+    """Append-only record of completed objects and byte ranges.
+
+    Every line is a JSON object describing either a completed object or a
+    completed byte range of a partially downloaded object. Entries are keyed
+    by remote path, ETag and size so a changed object is never resumed from
+    stale data. A truncated last line, e.g. after the session was killed
+    mid-write, is ignored.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.completed = {}
+        self.ranges = {}
+        self._file = None
+        self._load()
+
+    @staticmethod
+    def _key(item) -> Tuple[str, str, int]:
+        return (item.remote, item.etag, item.size)
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                key = (entry["remote"], entry["etag"], entry["size"])
+                if "range" in entry:
+                    self.ranges.setdefault(key, set()).add(tuple(entry["range"]))
+                else:
+                    self.completed[key] = True
+        logger.info(
+            f"Resuming from {self.path}: {len(self.completed)} objects done, "
+            f"{len(self.ranges)} partially downloaded."
+        )
+
+    def _append(self, entry: dict) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def is_complete(self, item) -> bool:
+        """Return True if ``item`` was fully downloaded."""
+        return self._key(item) in self.completed
+
+    def completed_ranges(self, item) -> Set[Tuple[int, int]]:
+        """Return the byte ranges of ``item`` that were already written."""
+        return self.ranges.get(self._key(item), set())
+
+    def record_range(self, item, start: int, end: int) -> None:
+        """Record that bytes ``[start, end)`` of ``item`` were written."""
+        self.ranges.setdefault(self._key(item), set()).add((start, end))
+        self._append({
+            "remote": item.remote,
+            "etag": item.etag,
+            "size": item.size,
+            "range": [start, end],
+        })
+
+    def record_complete(self, item) -> None:
+        """Record that ``item`` was downloaded and renamed into place."""
+        self.completed[self._key(item)] = True
+        self.ranges.pop(self._key(item), None)
+        self._append({"remote": item.remote, "etag": item.etag, "size": item.size})
+
+    def close(self) -> None:
+        """Close the journal, keeping it on disk for a later resume."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """Close and delete the journal once the transfer finished."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def has_size(path: Union[str, Path], size: int) -> bool:
+    """Return True if ``path`` is a file of exactly ``size`` bytes."""
+    try:
+        return os.stat(path).st_size == size
+    except FileNotFoundError:
+        return False
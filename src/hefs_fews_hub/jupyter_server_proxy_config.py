@@ -1,10 +1,14 @@
 """
 Jupyter Server Proxy configuration for Panel Dashboard
 """
+import os
 import shutil
 import sys
 from pathlib import Path
 
+# Worker processes serving dashboard sessions; each loads shared assets once
+DASHBOARD_PROCS_ENV = "HEFS_FEWS_DASHBOARD_PROCS"
+
 
 def setup_panel_dashboard():
     """
@@ -32,6 +36,9 @@ def setup_panel_dashboard():
             str(dashboard_path),
             "--port", "{port}",
             "--allow-websocket-origin=*",
+            "--num-procs", os.environ.get(DASHBOARD_PROCS_ENV, "1"),
+            # Run the app once per process at startup to fill the process-wide caches
+            "--warm",
             # "--log-level", "debug",
             # "--show", "--autoreload"
         ],
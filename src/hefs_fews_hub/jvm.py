@@ -0,0 +1,208 @@
+"""FEWS JVM launch profiles sized for the container.
+
+``launch_profile`` sizes the heap and chooses the garbage collector from
+the pod's cgroup memory limit and the size of the installed Config.
+``start_script`` writes a launcher recording the profile it uses. With
+class-data sharing enabled the first launch records the classes FEWS
+loads and, once FEWS exits, dumps them into an AppCDS archive next to the
+configuration; later launches map that archive instead of loading and
+verifying the classes again. The archive is rebuilt when the FEWS jars
+change. This uses the class-list workflow, which works from JDK 11 on.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+import shlex
+import subprocess
+from typing import NamedTuple, Optional, Union
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+CGROUP_V2_LIMIT = Path("/sys/fs/cgroup/memory.max")
+CGROUP_V1_LIMIT = Path("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+# Values above this are how cgroup v1 reports "no limit"
+UNLIMITED = 2**60
+CDS_ARCHIVE_FILENAME = "fews-cds.jsa"
+CDS_CLASS_LIST_FILENAME = "fews-cds.classlist"
+
+MIN_HEAP_MB = 256
+BASE_HEAP_MB = 512
+# Heap per MiB of Config: FEWS holds much of the parsed configuration in memory
+HEAP_PER_CONFIG_MB = 4
+# Share of the memory limit the heap may use, leaving room for metaspace,
+# code cache, thread stacks and native buffers
+MAX_HEAP_FRACTION = 0.75
+G1_MIN_HEAP_MB = 2048
+
+
+class LaunchProfile(NamedTuple):
+    """JVM settings of a FEWS launch."""
+
+    name: str
+    heap_mb: int
+    initial_heap_mb: int
+    gc: str
+    memory_limit_mb: int
+    config_size_mb: int
+    class_data_sharing: bool
+
+    def jvm_options(self) -> list:
+        """Return the JVM options of the profile, without class-data sharing."""
+        options = [f"-Xms{self.initial_heap_mb}m", f"-Xmx{self.heap_mb}m"]
+        if self.gc == "G1":
+            options += ["-XX:+UseG1GC", "-XX:MaxGCPauseMillis=200"]
+        else:
+            options += ["-XX:+UseSerialGC"]
+        return options
+
+    def describe(self) -> str:
+        return json.dumps(self._asdict(), sort_keys=True)
+
+
+def memory_limit() -> int:
+    """Return the memory limit of this container in bytes.
+
+    Reads the cgroup v2 or v1 limit and falls back to the physical memory
+    when there is none.
+    """
+    for path in (CGROUP_V2_LIMIT, CGROUP_V1_LIMIT):
+        try:
+            value = path.read_text().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < UNLIMITED:
+            return int(value)
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def directory_size(path: Union[str, Path]) -> int:
+    """Return the total size in bytes of the files under ``path``."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def launch_profile(
+        configuration_dir: Union[str, Path],
+        limit_bytes: Optional[int] = None,
+        config_bytes: Optional[int] = None,
+        class_data_sharing: bool = True
+) -> LaunchProfile:
+    """Size a FEWS launch for this container and configuration.
+
+    ``limit_bytes`` and ``config_bytes`` default to the container's memory
+    limit and the size of ``{configuration_dir}/Config``.
+    """
+    if limit_bytes is None:
+        limit_bytes = memory_limit()
+    if config_bytes is None:
+        config_bytes = directory_size(Path(configuration_dir, "Config"))
+    limit_mb = limit_bytes // 2**20
+    config_mb = config_bytes // 2**20
+    ceiling = max(int(limit_mb * MAX_HEAP_FRACTION), MIN_HEAP_MB)
+    heap_mb = min(max(BASE_HEAP_MB + HEAP_PER_CONFIG_MB * config_mb, MIN_HEAP_MB), ceiling)
+    if heap_mb < 1024:
+        name = "small"
+    elif heap_mb < 4096:
+        name = "medium"
+    else:
+        name = "large"
+    return LaunchProfile(
+        name=name,
+        heap_mb=heap_mb,
+        initial_heap_mb=min(heap_mb, MIN_HEAP_MB),
+        gc="G1" if heap_mb >= G1_MIN_HEAP_MB else "Serial",
+        memory_limit_mb=limit_mb,
+        config_size_mb=config_mb,
+        class_data_sharing=class_data_sharing,
+    )
+
+
+def java_command(
+        fews_root_dir: Union[str, Path],
+        configuration_dir: Union[str, Path],
+        profile: LaunchProfile,
+        extra_options: Optional[list] = None
+) -> str:
+    """Return the java command line starting FEWS with a profile."""
+    options = [
+        f"-Dregion.home={configuration_dir}",
+        *profile.jvm_options(),
+        *(extra_options or []),
+        f"-splash:{fews_root_dir}/fews-splash.jpg",
+        f"-Djava.library.path={fews_root_dir}/linux",
+        f"-XX:ErrorFile={configuration_dir}/jvm-error.txt",
+        "-XX:-UsePerfData",
+    ]
+    return f"{fews_root_dir}/linux/jre/bin/java {' '.join(options)} " \
+        f"-cp '{fews_root_dir}/*' Delft.FEWS"
+
+
+def start_script(
+        fews_root_dir: Union[str, Path],
+        configuration_dir: Union[str, Path],
+        profile: LaunchProfile
+) -> str:
+    """Return the body of ``start_fews_standalone.sh`` for a profile."""
+    header = f"# HEFS launch profile: {profile.describe()}\n"
+    if not profile.class_data_sharing:
+        return header + java_command(fews_root_dir, configuration_dir, profile) + "\n"
+    java = f"{fews_root_dir}/linux/jre/bin/java"
+    archive = shlex.quote(f"{configuration_dir}/{CDS_ARCHIVE_FILENAME}")
+    class_list = shlex.quote(f"{configuration_dir}/{CDS_CLASS_LIST_FILENAME}")
+    return header + f"""ARCHIVE={archive}
+CLASS_LIST={class_list}
+# Rebuild the class-data sharing archive when the FEWS jars change
+if [ -f "$ARCHIVE" ] && [ -n "$(find {fews_root_dir} -maxdepth 1 -name '*.jar' -newer "$ARCHIVE")" ]; then
+    rm -f "$ARCHIVE" "$CLASS_LIST"
+fi
+if [ -f "$ARCHIVE" ]; then
+    CDS_OPTIONS="-XX:SharedArchiveFile=$ARCHIVE -Xshare:auto"
+else
+    CDS_OPTIONS="-XX:DumpLoadedClassList=$CLASS_LIST"
+fi
+{java_command(fews_root_dir, configuration_dir, profile, ["$CDS_OPTIONS"])}
+if [ ! -f "$ARCHIVE" ] && [ -s "$CLASS_LIST" ]; then
+    {java} -Xshare:dump -XX:SharedClassListFile="$CLASS_LIST" \\
+        -XX:SharedArchiveFile="$ARCHIVE" -cp '{fews_root_dir}/*' > /dev/null 2>&1 \\
+        || rm -f "$ARCHIVE"
+fi
+"""
+
+
+def build_cds_archive(
+        fews_root_dir: Union[str, Path],
+        configuration_dir: Union[str, Path]
+) -> bool:
+    """Dump the AppCDS archive from a recorded class list; return True on success.
+
+    Does the same as the launcher after the first run, without starting
+    FEWS, e.g. when provisioning an image from a recorded class list.
+    """
+    class_list = Path(configuration_dir, CDS_CLASS_LIST_FILENAME)
+    archive = Path(configuration_dir, CDS_ARCHIVE_FILENAME)
+    if not class_list.exists():
+        raise ValueError(f"No recorded class list: {class_list}")
+    result = subprocess.run(
+        [
+            f"{fews_root_dir}/linux/jre/bin/java",
+            "-Xshare:dump",
+            f"-XX:SharedClassListFile={class_list}",
+            f"-XX:SharedArchiveFile={archive}",
+            "-cp", f"{fews_root_dir}/*",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        logger.warning(f"Could not dump the class-data sharing archive: {result.stderr[-500:]}")
+        archive.unlink(missing_ok=True)
+        return False
+    logger.info(f"Wrote {archive} ({archive.stat().st_size} bytes).")
+    return True
@@ -0,0 +1,198 @@
+"""Per-stage timing and metrics for installs and downloads.
+
+Wrap every stage of an install in ``stage(name, rfc=...)``. When the stage
+ends its elapsed time, bytes, object count, retries and outcome are written
+to the log as one JSON line and recorded in a process-wide registry, which
+``render_metrics`` exposes in the Prometheus text format. The Panel process
+serves it from ``start_metrics_server`` when ``HEFS_FEWS_METRICS_PORT`` is
+set, so install latency percentiles can be tracked across hub users.
+"""
+import contextlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+METRICS_PORT_ENV = "HEFS_FEWS_METRICS_PORT"
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf"))
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[tuple, list] = {}
+_server: Optional[ThreadingHTTPServer] = None
+_server_attempted = False
+
+METRIC_HELP = {
+    "hefs_stage_duration_seconds": ("histogram", "Duration of install and download stages."),
+    "hefs_stage_bytes_total": ("counter", "Bytes transferred by stage."),
+    "hefs_stage_objects_total": ("counter", "Objects transferred by stage."),
+    "hefs_stage_retries_total": ("counter", "Request retries by stage."),
+    "hefs_stage_runs_total": ("counter", "Completed stage runs by outcome."),
+    "hefs_storage_objects_total": ("counter", "Objects looked up per storage tier by outcome."),
+    "hefs_storage_bytes_total": ("counter", "Bytes looked up per storage tier by outcome."),
+}
+
+
+class Span:
+    """Measurements of one running stage."""
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.counts = Counter(bytes=0, objects=0, retries=0)
+        self.started = time.monotonic()
+
+    def add(self, stats: Optional[dict] = None, **counts) -> None:
+        """Add transfer statistics, e.g. those returned by ``download_items``."""
+        self.counts.update(stats or {})
+        self.counts.update(counts)
+
+
+def _increment(name: str, labels: tuple, value: float) -> None:
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + value
+
+
+def increment(name: str, value: float = 1, **labels) -> None:
+    """Add to a counter of ``METRIC_HELP`` outside of a stage."""
+    _increment(name, tuple(sorted(labels.items())), value)
+
+
+def _observe(name: str, labels: tuple, value: float) -> None:
+    with _lock:
+        buckets = _histograms.setdefault((name, labels), [0] * len(DURATION_BUCKETS) + [0.0])
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+        buckets[-1] += value
+
+
+@contextlib.contextmanager
+def stage(name: str, **labels):
+    """Time a stage and record its measurements when it ends."""
+    span = Span(name, labels)
+    outcome = "error"
+    try:
+        yield span
+        outcome = "ok"
+    finally:
+        elapsed = time.monotonic() - span.started
+        key = tuple(sorted({"stage": name, **labels}.items()))
+        _observe("hefs_stage_duration_seconds", key, elapsed)
+        _increment("hefs_stage_bytes_total", key, span.counts["bytes"])
+        _increment("hefs_stage_objects_total", key, span.counts["objects"])
+        _increment("hefs_stage_retries_total", key, span.counts["retries"])
+        _increment("hefs_stage_runs_total", key + (("outcome", outcome),), 1)
+        logger.info(json.dumps({
+            "event": "stage",
+            "stage": name,
+            **labels,
+            "outcome": outcome,
+            "seconds": round(elapsed, 3),
+            **span.counts,
+        }))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + pairs + "}"
+
+
+def render_metrics() -> str:
+    """Render the registry in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            for (metric, labels), buckets in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS, buckets):
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {buckets[-1]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {buckets[-2]}")
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _forget_server_in_child() -> None:
+    """Drop the parent's exporter in a forked child; its serving thread is gone."""
+    global _server, _server_attempted
+    if _server is not None:
+        _server.socket.close()
+    _server = None
+    _server_attempted = False
+
+
+os.register_at_fork(after_in_child=_forget_server_in_child)
+
+
+def start_metrics_server(
+        port: int,
+        host: str = "0.0.0.0",
+        ports: int = 1
+) -> Optional[ThreadingHTTPServer]:
+    """Serve ``/metrics`` from a daemon thread; only one server per process.
+
+    The first free port of ``port`` to ``port + ports - 1`` is used, so
+    several worker processes of one server each get their own. If none is
+    free a warning is logged and None is returned; later calls in the same
+    process do not try again.
+    """
+    global _server, _server_attempted
+    with _lock:
+        if _server_attempted:
+            return _server
+        _server_attempted = True
+        for candidate in range(port, port + max(ports, 1)):
+            try:
+                _server = ThreadingHTTPServer((host, candidate), _MetricsHandler)
+            except OSError as e:
+                logger.debug(f"Metrics port {candidate} unavailable: {e}")
+                continue
+            threading.Thread(
+                target=_server.serve_forever, name="hefs-metrics", daemon=True
+            ).start()
+            logger.info(f"Serving metrics on http://{host}:{candidate}/metrics")
+            break
+        else:
+            logger.warning(
+                f"Not serving metrics: ports {port}-{port + max(ports, 1) - 1} are in use."
+            )
+    return _server
@@ -1,14 +1,36 @@
 # import debugpy; debugpy.listen(5678); debugpy.wait_for_client() # noqa
 import contextlib
 import json
+import os
 from pathlib import Path
 import logging
+from typing import TYPE_CHECKING
 import panel as pn
 from panel.pane import IPyWidget
+from param.parameterized import discard_events
 
 # from ipywidgets_bokeh import IPyWidget
-from hefs_fews_hub.dashboard_funcs import install_fews_standalone
-from ipyleaflet import Map, GeoJSON
+# numpy, the cardfile cache and decimation are imported by the viewer
+# callbacks that use them, so the page renders before they load
+from hefs_fews_hub.catalog import total_size
+from hefs_fews_hub.dashboard_funcs import (
+    BUCKET_NAME,
+    PREFETCH_ENV,
+    RFC_IDS,
+    download_historical_data,
+    install_fews_standalone,
+    plan_historical,
+    plan_install,
+    prefetch_config,
+    staging_dir,
+)
+from hefs_fews_hub.geo import RFC_BOUNDARIES, boundaries_path, level_for_zoom
+from hefs_fews_hub.jobs import format_bytes, get_job_manager, get_prefetch_manager
+from hefs_fews_hub.jupyter_server_proxy_config import DASHBOARD_PROCS_ENV
+from hefs_fews_hub.metrics import METRICS_PORT_ENV, start_metrics_server
+
+if TYPE_CHECKING:
+    from hefs_fews_hub.cardfiles import CardfileCache
 
 
 FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
@@ -22,31 +44,14 @@ def reconfig_basic_config(format_=FORMAT, level=logging.INFO):
 
 
 with contextlib.suppress(Exception):
-    from hefs_fews_hub.dashboard_funcs import s3_download_directory_cli, set_up_logger
+    from hefs_fews_hub.dashboard_funcs import set_up_logger
 
 pn.extension("ipywidgets", sizing_mode="stretch_width")
 
 ACCENT_BASE_COLOR = "#5d6d7e"
-RFC_BOUNDARIES = Path(__file__).parent / "geo" / "rfc_boundaries.geojson"
 FEWS_INSTALL_DIR = Path("/opt", "fews")
 MAP_CENTER_X = 38.80
 MAP_CENTER_Y = -99.14
-BUCKET_NAME = "ciroh-rti-hefs-data"
-RFC_IDS = [
-    "ABRFC",
-    "APRFC",
-    "CBRFC",
-    "CNRFC",
-    "LMRFC",
-    "MARFC",
-    "MBRFC",
-    "NCRFC",
-    "NERFC",
-    "NWRFC",
-    "OHRFC",
-    "SERFC",
-    "WGRFC",
-]
 
 download_dir_text = pn.widgets.TextInput(
     name="Directory to download the data:", value="/home/jovyan"
@@ -56,18 +61,123 @@ logger_filepath = Path(download_dir_text.value, "hefs_fews_config_panel.log")
 print(f"Logging to: {logger_filepath}")
 logger = set_up_logger(logger_filepath)
 
+# Install stage timings in the Prometheus text format, once per worker process
+# on the first free port from HEFS_FEWS_METRICS_PORT
+if os.environ.get(METRICS_PORT_ENV):
+    start_metrics_server(
+        int(os.environ[METRICS_PORT_ENV]),
+        # One port per worker, plus one if the parent started an exporter before forking
+        ports=int(os.environ.get(DASHBOARD_PROCS_ENV, "1")) + 1,
+    )
+
+
+JOB_POLL_PERIOD_MS = 500
+job_manager = get_job_manager()
+session_jobs = []
+poll_callback = None
+
+
+def update_job_status():
+    """Reflect the progress of this session's jobs in the widgets."""
+    global poll_callback
+    running = [job for job in session_jobs if not job.done]
+    shown = running[0] if running else session_jobs[-1]
+    progress_bar.value = int(shown.progress.fraction * 100)
+    progress_bar.visible = bool(running)
+    cancel_button.visible = bool(running)
+    job_status.object = "<br>".join(job.status_text() for job in session_jobs[-3:])
+    if not running and poll_callback is not None:
+        poll_callback.stop()
+        poll_callback = None
+    return
+
 
-def turn_off_indeterminate():
-    indeterminate.name = "Download Complete"
-    indeterminate.active = False
-    indeterminate.visible = False
+def watch_job(job):
+    """Show a job's progress in this session until it finishes."""
+    global poll_callback
+    if job not in session_jobs:
+        session_jobs.append(job)
+    if poll_callback is None:
+        poll_callback = pn.state.add_periodic_callback(
+            update_job_status, period=JOB_POLL_PERIOD_MS
+        )
+    update_job_status()
     return
 
 
-def turn_on_indeterminate():
-    indeterminate.name = "Downloading..."
-    indeterminate.visible = True
-    indeterminate.active = True
+def cancel_jobs(event) -> None:
+    """Cancel the jobs started or joined by this session."""
+    for job in session_jobs:
+        if not job.done:
+            job.cancel()
+    return
+
+
+@pn.cache
+def load_rfc_boundaries(level: int) -> dict:
+    """Load the RFC boundaries for a zoom level once per process.
+
+    Falls back to the full-resolution boundaries if the simplified levels
+    were not built.
+    """
+    path = boundaries_path(level)
+    if not path.exists():
+        path = RFC_BOUNDARIES
+    with open(path) as f:
+        return json.load(f)
+
+
+def describe_rfc(rfc: str, download_dir: str, selection_version: int = 0) -> str:
+    """Summarize what the catalog publishes for an RFC and what a download would take."""
+    try:
+        config_size = total_size(rfc, BUCKET_NAME, "Config")
+        historical_size = total_size(rfc, BUCKET_NAME, "historicalData")
+        plans = [plan_install(download_dir, rfc)]
+        if historical_size:
+            geometry = selected_geometry()
+            try:
+                plans.append(plan_historical(download_dir, rfc, geometry=geometry))
+            except ValueError:
+                # No station metadata downloaded yet to resolve the selection
+                plans.append(plan_historical(download_dir, rfc))
+    except FileNotFoundError:
+        return ""
+    except Exception as e:
+        logger.warning(f"Could not read the catalog of {rfc}: {e}")
+        return ""
+    text = f"**{rfc}**: configuration {format_bytes(config_size)}"
+    if historical_size:
+        text += f", historical data {format_bytes(historical_size)}"
+    else:
+        text += ", no historical data published"
+    for plan in plans:
+        text += f"\n\n- {plan.summary()}"
+    return text
+
+
+# Opt-in: stage the selected RFC's configuration while the user looks at it
+prefetch_job = None
+
+
+def prefetch_selected_rfc(*events) -> None:
+    """Start prefetching the selected RFC, cancelling the previous prefetch."""
+    global prefetch_job
+    download_dir = Path(download_dir_text.value).resolve()
+    rfc = rfc_selector.value
+    key = ("prefetch", rfc, download_dir.as_posix())
+    if prefetch_job is not None and not prefetch_job.done and prefetch_job.key != key:
+        prefetch_job.cancel()
+    if not prefetch_checkbox.value or not download_dir.exists():
+        prefetch_status.object = ""
+        return
+    prefetch_job = get_prefetch_manager().submit(
+        key,
+        prefetch_config,
+        download_dir.as_posix(),
+        rfc,
+        description=f"{rfc} configuration prefetch",
+    )
+    prefetch_status.object = f"Prefetching the {rfc} configuration in the background."
     return
 
 
@@ -75,61 +185,318 @@ def on_geojson_click(event, feature, **kwargs):
     rfc_selector.value = feature["properties"]["BASIN_ID"]
 
 
+# Polygons drawn on the map limit historical data downloads to their stations
+drawn_geometries = []
+draw_control = None
+
+
+def selected_geometry():
+    """Return the drawn shapes as one MultiPolygon, or None if nothing is drawn."""
+    if not drawn_geometries:
+        return None
+    return {
+        "type": "MultiPolygon",
+        "coordinates": [geometry["coordinates"] for geometry in drawn_geometries],
+    }
+
+
+def update_selection_status():
+    count = len(drawn_geometries)
+    selection_status.object = (
+        f"Historical data limited to the stations inside {count} drawn "
+        f"shape{'s' if count > 1 else ''}." if count else ""
+    )
+    clear_selection_button.visible = bool(count)
+    selection_version.value += 1
+    return
+
+
+def on_draw(control, action, geo_json):
+    geometry = geo_json["geometry"]
+    if action == "created" and geometry["type"] == "Polygon":
+        drawn_geometries.append(geometry)
+    elif action == "deleted" and geometry in drawn_geometries:
+        drawn_geometries.remove(geometry)
+    update_selection_status()
+
+
+def clear_selection(event) -> None:
+    drawn_geometries.clear()
+    if draw_control is not None:
+        draw_control.clear()
+    update_selection_status()
+    return
+
+
 def get_marker_and_map():
+    global draw_control
+    # ipyleaflet is imported here so it does not slow down the first render
+    from ipyleaflet import DrawControl, Map, GeoJSON
+
     center = (MAP_CENTER_X, MAP_CENTER_Y)
     lmap = Map(center=center, zoom=4, height=500)
+    geojson_layer = GeoJSON(
+        data=load_rfc_boundaries(level_for_zoom(lmap.zoom)),
+        hover_style={"color": "red", "dashArray": "0", "fillOpacity": 0.6},
+    )
+    geojson_layer.on_click(on_geojson_click)
+
+    def on_zoom(change):
+        level = level_for_zoom(change["new"])
+        if level != level_for_zoom(change["old"]):
+            geojson_layer.data = load_rfc_boundaries(level)
+
+    lmap.observe(on_zoom, names="zoom")
     lmap.add(geojson_layer)
+    shape_options = {"shapeOptions": {"color": "#2e86c1", "fillOpacity": 0.2}}
+    draw_control = DrawControl(
+        polygon=shape_options,
+        rectangle=shape_options,
+        polyline={},
+        circle={},
+        circlemarker={},
+        marker={},
+    )
+    draw_control.on_draw(on_draw)
+    lmap.add(draw_control)
     lmap.layout.height = "100%"
     lmap.layout.width = "100%"
     return lmap
 
 
-def download_historical_data(event) -> None:
-    """Download historical data for selected RFC."""
-    fews_download_dir = Path(download_dir_text.value)
-    if not fews_download_dir.exists():
-        raise ValueError(
-            f"The directory: {fews_download_dir}, "
-            "does not exist. Please create it first!"
+map_widget = None
+
+
+def load_map() -> None:
+    """Build the map once the page has rendered."""
+    global map_widget
+    try:
+        map_widget = get_marker_and_map()
+        lmap = IPyWidget(map_widget, sizing_mode="stretch_both", min_height=500)
+    except Exception as e:
+        logger.error(f"Error creating map: {e}")
+        lmap = pn.pane.Markdown(
+            "## Error loading map\n"
+            "Map could not be loaded. Please ensure that ipyleaflet is "
+            "installed and working correctly."
         )
+    map_container.objects = [lmap]
+    return
 
-    logger.info(f"Downloading historical data to {fews_download_dir.as_posix()}...")
-    s3_download_directory_cli(
-        prefix=f"{rfc_selector.value}/historicalData",
-        local=Path(fews_download_dir, f"{rfc_selector.value}/cardfiles").as_posix(),
+
+def download_historical_data_pf(event) -> None:
+    """Download historical data for selected RFC in the background."""
+    download_dir = Path(download_dir_text.value).resolve()
+    rfc = rfc_selector.value
+    geometry = selected_geometry()
+    job = job_manager.submit(
+        ("historical", rfc, download_dir.as_posix(), json.dumps(geometry)),
+        download_historical_data,
+        download_dir.as_posix(),
+        rfc,
+        geometry=geometry,
+        description=f"{rfc} historical data" + (" (map selection)" if geometry else ""),
     )
-    logger.info("Data download complete.")
+    watch_job(job)
+    return
 
 
 def install_fews_standalone_pf(event) -> None:
-    """Download standalone configuration from S3 to the working directory."""
-    turn_on_indeterminate()
-    install_fews_standalone(download_dir_text.value, rfc_selector.value)
-    turn_off_indeterminate()
+    """Download standalone configuration from S3 in the background."""
+    download_dir = Path(download_dir_text.value).resolve()
+    rfc = rfc_selector.value
+    staging = None
+    if prefetch_checkbox.value:
+        # Finalize from what was staged; the install fetches the rest itself
+        get_prefetch_manager().cancel(("prefetch", rfc, download_dir.as_posix()))
+        staging = staging_dir(download_dir).as_posix()
+        prefetch_status.object = ""
+    job = job_manager.submit(
+        ("install", rfc, download_dir.as_posix()),
+        install_fews_standalone,
+        download_dir.as_posix(),
+        rfc,
+        staging=staging,
+        description=f"{rfc} configuration",
+    )
+    watch_job(job)
     return
 
 
-# MAP (ipyleaflet)
-with open(RFC_BOUNDARIES) as f:
-    geojson_data = json.load(f)
+# ENSEMBLE VIEWER: series are decimated on the server for the visible range
+VIEWER_TARGET_POINTS = 2000
+viewer_state = {}
 
-geojson_layer = GeoJSON(
-    data=geojson_data,
-    hover_style={"color": "red", "dashArray": "0", "fillOpacity": 0.6},
-)
-try:
-    lmap = get_marker_and_map()
-    geojson_layer.on_click(on_geojson_click)
-except Exception as e:
-    logger.error(f"Error creating map: {e}")
-    lmap = pn.pane.Markdown(
-        "## Error loading map\n"
-        "Map could not be loaded. Please ensure that ipyleaflet is "
-        "installed and working correctly."
+
+@pn.cache(max_items=16)
+def load_cardfile_cache(directory: str, index_mtime_ns: int) -> "CardfileCache":
+    """Return a cardfile cache with its index loaded, shared by every session.
+
+    The index modification time is part of the key, so an update of the
+    cache is picked up by the next session or refresh.
+    """
+    from hefs_fews_hub.cardfiles import CardfileCache
+
+    cache = CardfileCache(directory)
+    cache.index
+    return cache
+
+
+def update_viewer_options(*events) -> None:
+    """List the stations and variables of the selected RFC's cardfile cache."""
+    from hefs_fews_hub.cardfiles import CardfileCache
+    from hefs_fews_hub.historical import cardfile_dir
+
+    download_dir = Path(download_dir_text.value).resolve()
+    rfc = rfc_selector.value
+    cache = CardfileCache(cardfile_dir(download_dir, rfc))
+    with contextlib.suppress(OSError):
+        cache = load_cardfile_cache(
+            cache.cardfile_dir.as_posix(), cache.index_path.stat().st_mtime_ns
+        )
+    entries = [entry for _, entry in cache.find()]
+    viewer_state.update(cache=cache, download_dir=download_dir, rfc=rfc)
+    # Redraw once below rather than on every option change
+    with discard_events(viewer_station), discard_events(viewer_variable):
+        viewer_station.options = sorted({entry["station"] for entry in entries})
+        viewer_variable.options = sorted(
+            {entry["variable"] for entry in entries if entry["station"] == viewer_station.value}
+        )
+    draw_ensemble()
+    return
+
+
+def viewer_traces(first=None, last=None):
+    """Return the decimated member traces of the current series for an index range."""
+    import numpy as np
+    from hefs_fews_hub.decimation import decimate_view
+    from hefs_fews_hub.historical import read_ensemble
+
+    cache, axis = viewer_state["cache"], viewer_state["axis"]
+    station, variable = viewer_station.value, viewer_variable.value
+    base = np.datetime64(axis["start"], "h")
+    step = np.timedelta64(axis["timestep_hours"], "h")
+
+    def load(first, last):
+        return read_ensemble(
+            viewer_state["download_dir"], viewer_state["rfc"], station, variable,
+            start=base + (first + 1) * step, end=base + last * step, cache=cache,
+        ).values
+
+    level = decimate_view(
+        viewer_state["key"], load, axis["count"], first or 0, last,
+        method=viewer_method.value, target_points=VIEWER_TARGET_POINTS,
+    )
+    times = base + (level.indices.astype(np.int64) + 1) * step
+    return [(times[row], level.values[row]) for row in range(level.values.shape[0])]
+
+
+def draw_ensemble(*events) -> None:
+    """Plot every member of the selected station and variable."""
+    import plotly.graph_objects as go
+    from hefs_fews_hub.historical import ensemble_axis
+
+    station, variable = viewer_station.value, viewer_variable.value
+    cache = viewer_state.get("cache")
+    if cache is None or not station or not variable:
+        viewer_pane.object = None
+        return
+    members = sorted(cache.find(station, variable))
+    viewer_state["axis"] = ensemble_axis(cache, station, variable)
+    # Invalidate the cached levels when a member's cardfile changes
+    viewer_state["key"] = (
+        cache.cache_dir.as_posix(), station, variable,
+        tuple((path, entry["source_mtime_ns"]) for path, entry in members),
     )
+    figure = go.Figure(
+        [
+            go.Scattergl(x=x, y=y, mode="lines", name=Path(path).name, line={"width": 1})
+            for (x, y), (path, _) in zip(viewer_traces(), members)
+        ],
+        layout={
+            "title": f"{station} {variable}",
+            "yaxis": {"title": members[0][1]["units"]},
+            "uirevision": "ensemble",
+            "showlegend": len(members) <= 20,
+            "margin": {"t": 40, "b": 30},
+        },
+    )
+    viewer_pane.object = figure
+    return
+
+
+def on_viewer_relayout(event) -> None:
+    """Decimate again for the zoomed range."""
+    import numpy as np
+    from hefs_fews_hub.historical import window_slice
+
+    relayout = event.new or {}
+    figure = viewer_pane.object
+    if figure is None or "axis" not in viewer_state:
+        return
+    if relayout.get("xaxis.autorange"):
+        first, last = None, None
+    elif "xaxis.range[0]" in relayout or "xaxis.range" in relayout:
+        bounds = relayout.get("xaxis.range") \
+            or [relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]]
+        start, end = (
+            np.datetime64(str(bound)[:19].replace(" ", "T"), "h") for bound in bounds
+        )
+        window = window_slice(viewer_state["axis"], start, end)
+        first, last = window.start, window.stop
+    else:
+        return
+    with figure.batch_update():
+        for trace, (x, y) in zip(figure.data, viewer_traces(first, last)):
+            trace.x, trace.y = x, y
+    viewer_pane.param.trigger("object")
+    return
+
+
+def cleanup_session(session_context) -> None:
+    """Release what this session holds once its browser tab is gone.
+
+    Downloads keep running in the shared job manager, but the prefetch is
+    speculative and is cancelled. The map's widgets are closed so the
+    ipywidgets registry does not keep them alive.
+    """
+    global poll_callback, map_widget
+    if poll_callback is not None:
+        poll_callback.stop()
+        poll_callback = None
+    if prefetch_job is not None and not prefetch_job.done:
+        prefetch_job.cancel()
+    session_jobs.clear()
+    drawn_geometries.clear()
+    viewer_state.clear()
+    viewer_pane.object = None
+    if map_widget is not None:
+        with contextlib.suppress(Exception):
+            for widget in [*map_widget.layers, *map_widget.controls, map_widget]:
+                widget.close()
+        map_widget = None
+    return
+
+
+pn.state.on_session_destroyed(cleanup_session)
+
+# MAP (ipyleaflet), built after the first render
+map_container = pn.Column(
+    pn.indicators.LoadingSpinner(value=True, size=50, name="Loading map..."),
+    sizing_mode="stretch_both",
+    min_height=500,
+)
+pn.state.onload(load_map)
 
 # WIDGETS
 rfc_selector = pn.widgets.Select(name="", options=RFC_IDS, value=RFC_IDS[5])
+prefetch_checkbox = pn.widgets.Checkbox(
+    name="Prefetch the selected RFC's configuration",
+    value=os.environ.get(PREFETCH_ENV, "") not in ("", "0"),
+)
+prefetch_status = pn.pane.Markdown("")
+rfc_selector.param.watch(prefetch_selected_rfc, "value")
+prefetch_checkbox.param.watch(prefetch_selected_rfc, "value")
 
 
 download_configs_button = pn.widgets.Button(
@@ -138,24 +505,66 @@ download_configs_button = pn.widgets.Button(
 download_configs_button.on_click(install_fews_standalone_pf)
 
 download_data_button = pn.widgets.Button(name="Download Data", button_type="primary")
-download_data_button.on_click(download_historical_data)
+download_data_button.on_click(download_historical_data_pf)
 
-indeterminate = pn.indicators.Progress(
-    name="Indeterminate Progress",
-    active=False,
+progress_bar = pn.indicators.Progress(
+    name="Download Progress",
+    value=0,
+    max=100,
     visible=False,
     styles={"height": "15px"},
 )
+cancel_button = pn.widgets.Button(name="Cancel", button_type="warning", visible=False)
+cancel_button.on_click(cancel_jobs)
+job_status = pn.pane.HTML("")
+selection_status = pn.pane.Markdown("")
+clear_selection_button = pn.widgets.Button(
+    name="Clear map selection", button_type="light", visible=False
+)
+clear_selection_button.on_click(clear_selection)
+
+viewer_station = pn.widgets.Select(name="Station", options=[])
+viewer_variable = pn.widgets.Select(name="Variable", options=[])
+viewer_method = pn.widgets.RadioButtonGroup(
+    name="Decimation", options=["minmax", "lttb"], value="minmax"
+)
+viewer_refresh_button = pn.widgets.Button(name="Refresh series", button_type="light")
+viewer_pane = pn.pane.Plotly(None, height=450, config={"responsive": True})
+viewer_refresh_button.on_click(update_viewer_options)
+rfc_selector.param.watch(update_viewer_options, "value")
+download_dir_text.param.watch(update_viewer_options, "value")
+viewer_station.param.watch(update_viewer_options, "value")
+viewer_variable.param.watch(draw_ensemble, "value")
+viewer_method.param.watch(draw_ensemble, "value")
+viewer_pane.param.watch(on_viewer_relayout, "relayout_data")
+
+# Bumped whenever the map selection changes, to refresh the download plan
+selection_version = pn.widgets.IntInput(value=0, visible=False)
+rfc_info = pn.panel(
+    pn.bind(describe_rfc, rfc_selector, download_dir_text, selection_version),
+    defer_load=True,
+)
 
 # LAYOUT
 download_row = pn.Row(rfc_selector, download_configs_button, download_data_button)
 
 column = pn.Column(
-    IPyWidget(lmap, sizing_mode="stretch_both", min_height=500),
+    map_container,
     download_row,
+    pn.Row(rfc_info),
+    pn.Row(selection_status, clear_selection_button),
     pn.Row(download_dir_text),
-    pn.Row(indeterminate),
+    pn.Row(prefetch_checkbox, prefetch_status),
+    pn.Row(progress_bar, cancel_button),
+    pn.Row(job_status),
+    pn.Card(
+        pn.Row(viewer_station, viewer_variable, viewer_method, viewer_refresh_button),
+        viewer_pane,
+        title="Ensemble viewer",
+        collapsed=True,
+    ),
 )
+pn.state.onload(update_viewer_options)
 
 logo_path = Path(__file__).parent / "images" / "CIROHLogo_200x200.png"
 template = pn.template.FastListTemplate(
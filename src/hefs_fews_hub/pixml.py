@@ -0,0 +1,186 @@
+"""Convert downloaded cardfiles into FEWS PI-XML time series for bulk import.
+
+FEWS parses datacards line by line when it imports them on first start,
+which is slow and memory-hungry for large RFCs. ``convert_to_pixml`` writes
+every series of the ``CardfileCache`` as a PI-XML timeseries file under
+``{rfc}/Import/historical`` instead, which the FEWS import module reads in
+bulk (point a ``PI`` import of the configuration at that folder).
+
+Files are converted in parallel worker processes. Each worker streams its
+series from the memory-mapped cache array in fixed-size chunks, so memory
+stays bounded whatever the length of the series. Conversion is
+incremental: a state file records the source modification time and size
+of every converted cardfile and only new or changed ones are converted
+again; outputs of removed cardfiles are deleted.
+"""
+from concurrent import futures
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Union
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from hefs_fews_hub.cardfiles import CardfileCache
+from hefs_fews_hub.historical import MISSING_BELOW
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+PI_IMPORT_DIRNAME = Path("Import", "historical")
+STATE_FILENAME = ".hefs_pixml_state.json"
+MISSING_VALUE = "-999.0"
+CHUNK_VALUES = 2**16
+# Datacard types holding totals over the time step; everything else is instantaneous
+ACCUMULATIVE_TYPES = {"MAP", "MAPX", "MAPS", "PELV", "RAIM", "ROCL"}
+
+PI_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<TimeSeries xmlns="http://www.wldelft.nl/fews/PI"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="http://www.wldelft.nl/fews/PI http://fews.wldelft.nl/schemas/version1.0/pi-schemas/pi_timeseries.xsd"
+    version="1.2">
+  <timeZone>0.0</timeZone>
+  <series>
+    <header>
+      <type>{type}</type>
+      <locationId>{location}</locationId>
+      <parameterId>{parameter}</parameterId>
+      <timeStep unit="second" multiplier="{seconds}"/>
+      <startDate date="{start_date}" time="{start_time}"/>
+      <endDate date="{end_date}" time="{end_time}"/>
+      <missVal>{missing}</missVal>
+      <units>{units}</units>
+    </header>
+"""
+PI_FOOTER = """  </series>
+</TimeSeries>
+"""
+
+
+def pixml_dir(download_dir: Union[str, Path], rfc: str) -> Path:
+    """Return the directory the PI-XML files of an RFC are written to."""
+    return Path(download_dir, rfc, PI_IMPORT_DIRNAME)
+
+
+def _split(timestamp: np.datetime64) -> tuple:
+    text = str(np.datetime64(timestamp, "s"))
+    return text[:10], text[11:19]
+
+
+def write_pixml(values: np.ndarray, entry: dict, path: Union[str, Path]) -> int:
+    """Write one cache entry's series as a PI-XML file; return the number of events.
+
+    ``values`` may be a memory map; it is read ``CHUNK_VALUES`` at a time.
+    """
+    path = Path(path)
+    base = np.datetime64(entry["start"], "h")
+    step = np.timedelta64(entry["timestep_hours"], "h")
+    count = len(values)
+    start_date, start_time = _split(base + step)
+    end_date, end_time = _split(base + count * step)
+    header = PI_HEADER.format(
+        type="accumulative" if entry["variable"] in ACCUMULATIVE_TYPES else "instantaneous",
+        location=escape(entry["station"]),
+        parameter=escape(entry["variable"]),
+        seconds=entry["timestep_hours"] * 3600,
+        start_date=start_date,
+        start_time=start_time,
+        end_date=end_date,
+        end_time=end_time,
+        missing=MISSING_VALUE,
+        units=escape(entry["units"]),
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(header)
+        for first in range(0, count, CHUNK_VALUES):
+            chunk = np.asarray(values[first:first + CHUNK_VALUES], dtype=np.float64)
+            times = np.datetime_as_string(
+                base + np.arange(first + 1, first + len(chunk) + 1) * step, unit="s"
+            )
+            text = np.char.mod("%.7g", chunk)
+            text[~(chunk >= MISSING_BELOW)] = MISSING_VALUE
+            f.write("".join(
+                f'    <event date="{t[:10]}" time="{t[11:]}" value="{v}"/>\n'
+                for t, v in zip(times.tolist(), text.tolist())
+            ))
+        f.write(PI_FOOTER)
+    os.replace(tmp_path, path)
+    return count
+
+
+def _convert_worker(cache_dir: str, entry: dict, target: str) -> int:
+    """Convert one cached series; runs in a worker process."""
+    values = np.load(Path(cache_dir, entry["array"]), mmap_mode="r")
+    return write_pixml(values, entry, target)
+
+
+def _read_state(output_dir: Path) -> Dict[str, dict]:
+    try:
+        with open(output_dir / STATE_FILENAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(output_dir: Path, state: Dict[str, dict]) -> None:
+    path = output_dir / STATE_FILENAME
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def convert_to_pixml(
+        cache: CardfileCache,
+        output_dir: Union[str, Path],
+        max_workers: Optional[int] = None
+) -> int:
+    """Write PI-XML files of the new and changed series of a cache; return how many.
+
+    ``cache`` must be up to date (see ``CardfileCache.update``). Each
+    cardfile ``{path}`` becomes ``{output_dir}/{path}.xml``.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state = _read_state(output_dir)
+    entries = dict(cache.find())
+    for relative_path in [path for path in state if path not in entries]:
+        Path(output_dir, f"{relative_path}.xml").unlink(missing_ok=True)
+        del state[relative_path]
+    stale = {
+        relative_path: entry for relative_path, entry in entries.items()
+        if state.get(relative_path) != {
+            "source_mtime_ns": entry["source_mtime_ns"],
+            "source_size": entry["source_size"],
+        } or not Path(output_dir, f"{relative_path}.xml").exists()
+    }
+    if stale:
+        logger.info(f"Converting {len(stale)} of {len(entries)} cardfiles to PI-XML in {output_dir}.")
+        with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            jobs = {
+                executor.submit(
+                    _convert_worker,
+                    str(cache.cache_dir),
+                    entry,
+                    str(Path(output_dir, f"{relative_path}.xml")),
+                ): relative_path
+                for relative_path, entry in stale.items()
+            }
+            for job in futures.as_completed(jobs):
+                relative_path = jobs[job]
+                try:
+                    job.result()
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not convert {relative_path}: {e}")
+                    state.pop(relative_path, None)
+                    continue
+                entry = stale[relative_path]
+                state[relative_path] = {
+                    "source_mtime_ns": entry["source_mtime_ns"],
+                    "source_size": entry["source_size"],
+                }
+    _write_state(output_dir, state)
+    return len(stale)
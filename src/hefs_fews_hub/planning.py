@@ -0,0 +1,185 @@
+"""Pre-flight planning of downloads.
+
+A ``DownloadPlan`` lists the objects a download will fetch (largest
+first, so the long transfers start early and small files backfill the
+remaining slots), compares their size with the free space of the target
+filesystem and estimates the duration from the throughput observed by
+earlier downloads. ``check_space`` refuses to start a download that would
+fill the volume halfway through.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from hefs_fews_hub.jobs import format_bytes
+from hefs_fews_hub.transfer import DEFAULT_CONCURRENCY, TransferItem
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+# Head room kept free on the target volume, also covering small extra files
+SPACE_MARGIN_BYTES = 256 * 2**20
+# Assumed until a download has been measured
+DEFAULT_THROUGHPUT = 50 * 2**20
+# Request latency paid per object, spread over the requests in flight
+PER_OBJECT_SECONDS = 0.05
+THROUGHPUT_FILE = Path.home() / ".cache" / "hefs_fews_hub" / "throughput.json"
+MIN_MEASURED_BYTES = 8 * 2**20
+
+_lock = threading.Lock()
+_throughput: Optional[float] = None
+
+
+class DownloadPlan(NamedTuple):
+    """What a directory download will fetch, and whether it fits."""
+
+    description: str
+    local: str
+    items: List[TransferItem]
+    manifest: Dict[str, dict]
+    deleted: List[str]
+    free_bytes: int
+    estimated_seconds: float
+
+    @property
+    def fetch_bytes(self) -> int:
+        return sum(item.size for item in self.items)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self.manifest.values())
+
+    @property
+    def fits(self) -> bool:
+        return self.fetch_bytes + SPACE_MARGIN_BYTES <= self.free_bytes
+
+    def summary(self) -> str:
+        """Return a one-line description of the plan."""
+        text = (
+            f"{self.description}: {len(self.items)} of {len(self.manifest)} objects, "
+            f"{format_bytes(self.fetch_bytes)} to download "
+            f"({format_bytes(self.total_bytes)} in total), "
+            f"{format_bytes(self.free_bytes)} free"
+        )
+        if self.items:
+            text += f", about {format_duration(self.estimated_seconds)}"
+        return text if self.fits else text + " - not enough space"
+
+
+class InsufficientSpaceError(Exception):
+    """Raised when a download would not fit on the target volume.
+
+    ``subset`` holds the largest number of the plan's objects that do fit.
+    """
+
+    def __init__(self, plan: DownloadPlan):
+        self.plan = plan
+        self.subset = fit_subset(plan.items, plan.free_bytes - SPACE_MARGIN_BYTES)
+        super().__init__(
+            f"{plan.description} needs {format_bytes(plan.fetch_bytes)} but only "
+            f"{format_bytes(plan.free_bytes)} is free in {plan.local} "
+            f"({len(self.subset)} of {len(plan.items)} objects would fit)."
+        )
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration for display."""
+    if seconds < 90:
+        return f"{seconds:.0f}s"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def free_space(path: Union[str, Path]) -> int:
+    """Return the bytes available to this user on the filesystem of ``path``.
+
+    ``path`` need not exist yet; its nearest existing parent is used.
+    Quotas reported through ``statvfs`` (e.g. XFS project quotas on
+    persistent volumes) are included.
+    """
+    path = Path(path).absolute()
+    while not path.exists():
+        path = path.parent
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def schedule_largest_first(items: List[TransferItem]) -> List[TransferItem]:
+    """Order items largest first so small files backfill at the end."""
+    return sorted(items, key=lambda item: item.size, reverse=True)
+
+
+def fit_subset(items: List[TransferItem], available: int) -> List[TransferItem]:
+    """Return as many items as fit in ``available`` bytes, smallest first."""
+    subset, used = [], 0
+    for item in sorted(items, key=lambda item: item.size):
+        if used + item.size > available:
+            break
+        subset.append(item)
+        used += item.size
+    return subset
+
+
+def expected_throughput() -> float:
+    """Return the throughput in bytes per second observed by recent downloads."""
+    global _throughput
+    with _lock:
+        if _throughput is None:
+            try:
+                with open(THROUGHPUT_FILE) as f:
+                    _throughput = float(json.load(f)["bytes_per_second"])
+            except (OSError, ValueError, KeyError):
+                _throughput = DEFAULT_THROUGHPUT
+        return _throughput
+
+
+def record_throughput(nbytes: int, seconds: float) -> None:
+    """Fold a measured download into the expected throughput."""
+    global _throughput
+    if nbytes < MIN_MEASURED_BYTES or seconds <= 0:
+        return
+    current = expected_throughput()
+    with _lock:
+        _throughput = 0.7 * current + 0.3 * nbytes / seconds
+        try:
+            THROUGHPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(THROUGHPUT_FILE, "w") as f:
+                json.dump({"bytes_per_second": _throughput}, f)
+        except OSError:
+            pass
+
+
+def estimate_seconds(items: List[TransferItem], concurrency: int = DEFAULT_CONCURRENCY) -> float:
+    """Estimate how long downloading ``items`` takes."""
+    nbytes = sum(item.size for item in items)
+    return nbytes / expected_throughput() + len(items) * PER_OBJECT_SECONDS / concurrency
+
+
+def make_plan(
+        description: str,
+        local: Union[str, Path],
+        items: List[TransferItem],
+        manifest: Dict[str, dict],
+        deleted: Optional[List[str]] = None,
+        concurrency: int = DEFAULT_CONCURRENCY
+) -> DownloadPlan:
+    """Build the plan of a download into ``local``."""
+    return DownloadPlan(
+        description=description,
+        local=str(local),
+        items=schedule_largest_first(items),
+        manifest=manifest,
+        deleted=deleted or [],
+        free_bytes=free_space(local),
+        estimated_seconds=estimate_seconds(items, concurrency),
+    )
+
+
+def check_space(plan: DownloadPlan) -> None:
+    """Raise InsufficientSpaceError unless the plan fits on its volume."""
+    if not plan.fits:
+        raise InsufficientSpaceError(plan)
+    logger.info(plan.summary())
@@ -0,0 +1,129 @@
+"""Spatial index of station locations.
+
+``STRtree`` is a static R-tree bulk-loaded with Sort-Tile-Recursive
+packing: entries are sorted into vertical slices by x, each slice is
+sorted by y and cut into nodes of ``node_capacity`` entries, and the same
+packing is repeated on the nodes until a single level remains. Queries
+descend only into nodes whose bounding box intersects the query box.
+``StationIndex`` uses it to select stations by bounding box, by polygon
+(e.g. a shape drawn on the dashboard map) or by basin.
+"""
+import math
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+BBox = Tuple[float, float, float, float]
+NODE_CAPACITY = 16
+
+
+def _union(boxes: Iterable[BBox]) -> BBox:
+    min_x, min_y, max_x, max_y = zip(*boxes)
+    return min(min_x), min(min_y), max(max_x), max(max_y)
+
+
+def _intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _pack(entries: List[tuple], capacity: int) -> List[Tuple[BBox, list]]:
+    """Group entries (tuples whose first item is a bbox) into STR-packed nodes."""
+    leaves = math.ceil(len(entries) / capacity)
+    slice_size = capacity * math.ceil(leaves / math.ceil(math.sqrt(leaves)))
+    entries = sorted(entries, key=lambda e: e[0][0] + e[0][2])
+    nodes = []
+    for i in range(0, len(entries), slice_size):
+        vertical_slice = sorted(entries[i:i + slice_size], key=lambda e: e[0][1] + e[0][3])
+        for j in range(0, len(vertical_slice), capacity):
+            group = vertical_slice[j:j + capacity]
+            nodes.append((_union(e[0] for e in group), group))
+    return nodes
+
+
+class STRtree:
+    """A static R-tree over ``(bbox, value)`` items."""
+
+    def __init__(self, items: Iterable[Tuple[BBox, object]], node_capacity: int = NODE_CAPACITY):
+        items = list(items)
+        self._root = []
+        if not items:
+            return
+        nodes = [(bbox, group, True) for bbox, group in _pack(items, node_capacity)]
+        while len(nodes) > node_capacity:
+            nodes = [(bbox, group, False) for bbox, group in _pack(nodes, node_capacity)]
+        self._root = nodes
+
+    def query(self, bbox: BBox) -> List[object]:
+        """Return the values whose bounding box intersects ``bbox``."""
+        results = []
+        stack = list(self._root)
+        while stack:
+            node_bbox, children, leaf = stack.pop()
+            if not _intersects(node_bbox, bbox):
+                continue
+            if leaf:
+                results.extend(value for box, value in children if _intersects(box, bbox))
+            else:
+                stack.extend(children)
+        return results
+
+
+def _polygons(geometry: dict) -> List[Sequence[Sequence[Sequence[float]]]]:
+    if geometry.get("type") == "Feature":
+        geometry = geometry["geometry"]
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+
+
+def geometry_bbox(geometry: dict) -> BBox:
+    """Return the bounding box of a GeoJSON (Multi)Polygon or Feature."""
+    points = [p for polygon in _polygons(geometry) for ring in polygon for p in ring]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_geometry(x: float, y: float, geometry: dict) -> bool:
+    """Return True if a point lies inside a GeoJSON (Multi)Polygon (even-odd rule)."""
+    for polygon in _polygons(geometry):
+        inside = False
+        for ring in polygon:
+            for start, end in zip(ring, list(ring[1:]) + list(ring[:1])):
+                (x1, y1), (x2, y2) = start[:2], end[:2]
+                if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        if inside:
+            return True
+    return False
+
+
+class StationIndex:
+    """Select stations by location from their metadata."""
+
+    def __init__(self, stations: Dict[str, dict]):
+        self.stations = stations
+        self._tree = STRtree(
+            ((meta["lon"], meta["lat"], meta["lon"], meta["lat"]), station)
+            for station, meta in stations.items()
+        )
+
+    def in_bbox(self, bbox: BBox) -> set:
+        """Return the stations inside ``(min_lon, min_lat, max_lon, max_lat)``."""
+        return set(self._tree.query(bbox))
+
+    def in_geometry(self, geometry: dict) -> set:
+        """Return the stations inside a GeoJSON (Multi)Polygon or Feature."""
+        return {
+            station for station in self._tree.query(geometry_bbox(geometry))
+            if point_in_geometry(
+                self.stations[station]["lon"], self.stations[station]["lat"], geometry
+            )
+        }
+
+    def in_basins(self, basin_ids: Iterable[str]) -> set:
+        """Return the stations whose ``BASIN_ID`` is one of ``basin_ids``."""
+        basin_ids = set(basin_ids)
+        return {
+            station for station, meta in self.stations.items()
+            if meta["basin_id"] in basin_ids
+        }
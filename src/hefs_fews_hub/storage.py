@@ -0,0 +1,344 @@
+"""Tiered storage: resolve objects from a local mirror, the shared cache or S3.
+
+Each object of a download is taken from the first tier that has it:
+
+* ``staging``: files prefetched for this download, when given.
+* ``mirror``: a directory mirroring the bucket (``HEFS_FEWS_MIRROR_DIR``),
+  e.g. an NFS or EFS copy of ``ciroh-rti-hefs-data`` kept by the cluster.
+  An object matches when its size and its content hash (the ETag) do;
+  fixed-width files often change without changing size.
+* ``cache``: the shared content-addressed cache (``HEFS_FEWS_CACHE_DIR``).
+* ``s3``: the bucket itself, through the async transfer engine.
+
+``HEFS_FEWS_STORAGE_TIERS`` sets the order (default ``mirror,cache,s3``);
+unconfigured tiers are skipped. Without an ``s3`` tier, listings and object
+info also come from the mirror, so the whole pipeline runs against a plain
+directory. Each tier copies with its own concurrency
+(``HEFS_FEWS_MIRROR_CONCURRENCY``, ``HEFS_FEWS_CACHE_CONCURRENCY``), objects
+fetched from a later tier are stored in the cache, and hits and misses per
+tier are counted in ``tier_statistics`` and the metrics registry. Repairs
+pass ``tiers=("s3",)`` to ``get_storage`` so they never reinstall the same
+bad copy from the staging directory, a mirror or the cache.
+"""
+from collections import Counter
+from concurrent import futures
+from datetime import datetime, timezone
+import functools
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterable, List, Optional, Union
+
+from hefs_fews_hub.cache import ContentCache, get_cache, materialize
+from hefs_fews_hub.jobs import JobProgress
+from hefs_fews_hub.metrics import increment
+from hefs_fews_hub.transfer import (
+    DEFAULT_CONCURRENCY,
+    PART_SUFFIX,
+    TransferItem,
+    download_items,
+    get_transfer_filesystem,
+)
+from hefs_fews_hub.verify import file_matches
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+STORAGE_TIERS_ENV = "HEFS_FEWS_STORAGE_TIERS"
+MIRROR_DIR_ENV = "HEFS_FEWS_MIRROR_DIR"
+MIRROR_CONCURRENCY_ENV = "HEFS_FEWS_MIRROR_CONCURRENCY"
+CACHE_CONCURRENCY_ENV = "HEFS_FEWS_CACHE_CONCURRENCY"
+DEFAULT_TIERS = "mirror,cache,s3"
+DEFAULT_LOCAL_CONCURRENCY = 8
+
+_stats_lock = threading.Lock()
+_tier_stats: Counter = Counter()
+
+
+def tier_statistics() -> Dict[str, dict]:
+    """Return the objects and bytes resolved by each tier of this process."""
+    with _stats_lock:
+        stats = Counter(_tier_stats)
+    result = {}
+    for (tier, outcome, unit), value in stats.items():
+        result.setdefault(tier, {})[f"{outcome}_{unit}"] = value
+    for tier, counts in result.items():
+        lookups = counts.get("hit_objects", 0) + counts.get("miss_objects", 0)
+        counts["hit_rate"] = counts.get("hit_objects", 0) / lookups if lookups else 0.0
+    return result
+
+
+def _record(tier: str, outcome: str, items: List[TransferItem]) -> None:
+    nbytes = sum(item.size for item in items)
+    with _stats_lock:
+        _tier_stats[(tier, outcome, "objects")] += len(items)
+        _tier_stats[(tier, outcome, "bytes")] += nbytes
+    increment("hefs_storage_objects_total", len(items), tier=tier, outcome=outcome)
+    increment("hefs_storage_bytes_total", nbytes, tier=tier, outcome=outcome)
+
+
+class StorageTier:
+    """A place objects can be resolved from."""
+
+    name = "tier"
+
+    def __init__(self, concurrency: int = DEFAULT_LOCAL_CONCURRENCY):
+        self.concurrency = concurrency
+
+    def fetch(self, item: TransferItem) -> bool:
+        """Place ``item`` at its local path; return False if this tier lacks it.
+
+        Tiers that resolve objects in bulk, like ``S3Tier``, keep this
+        default and implement ``download`` instead.
+        """
+        return False
+
+    def fetch_many(self, items: List[TransferItem]) -> List[TransferItem]:
+        """Fetch items with this tier's concurrency; return the misses."""
+        with futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            found = list(executor.map(self.fetch, items))
+        return [item for item, hit in zip(items, found) if not hit]
+
+    def store_many(self, items: List[TransferItem]) -> None:
+        """Keep items fetched from a later tier; most tiers are read-only."""
+
+    def info(self, remote: str) -> Optional[dict]:
+        """Return s3fs-style info of an object, or None if this tier cannot tell."""
+        return None
+
+
+@functools.lru_cache(maxsize=65536)
+def _mirror_file_matches(path: str, mtime_ns: int, size: int, etag: str) -> bool:
+    """Return True if a mirror file has the content of an ETag; memoized per file version."""
+    return file_matches(path, {"size": size, "etag": etag})
+
+
+class MirrorTier(StorageTier):
+    """A directory holding a copy of the bucket's keys.
+
+    Objects are copied by default: hardlinks would let an install modify
+    the shared mirror.
+    """
+
+    name = "mirror"
+
+    def __init__(
+            self,
+            root: Union[str, Path],
+            concurrency: int = DEFAULT_LOCAL_CONCURRENCY,
+            link: str = "copy",
+            name: str = "mirror"
+    ):
+        super().__init__(concurrency)
+        self.root = Path(root)
+        self.link = link
+        self.name = name
+
+    def path(self, remote: str) -> Path:
+        """Return the mirror path of ``{bucket}/{key}``."""
+        return self.root / remote.partition("/")[2]
+
+    def fetch(self, item: TransferItem) -> bool:
+        path = self.path(item.remote)
+        try:
+            stat = path.stat()
+            if stat.st_size != item.size:
+                return False
+            # Without an ETag (mirror-only listings) the size is all there is to compare
+            if item.etag and not _mirror_file_matches(
+                    str(path), stat.st_mtime_ns, stat.st_size, item.etag):
+                logger.info(f"Ignoring the stale {self.name} copy of {item.remote}.")
+                return False
+            materialize(path, item.local, self.link)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def info(self, remote: str) -> Optional[dict]:
+        try:
+            stat = self.path(remote).stat()
+        except FileNotFoundError:
+            return None
+        return {
+            "size": stat.st_size,
+            "ETag": "",
+            "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            "type": "file",
+        }
+
+    def list_objects(self, prefix: str) -> Dict[str, dict]:
+        """List the mirrored objects under a key prefix, like ``catalog.list_objects``."""
+        base = self.root / prefix.strip("/")
+        objects = {}
+        for root, _, files in os.walk(base):
+            for name in files:
+                if name.endswith(PART_SUFFIX):
+                    continue
+                path = Path(root, name)
+                stat = path.stat()
+                objects[path.relative_to(base).as_posix()] = {
+                    "size": stat.st_size,
+                    "etag": "",
+                    "last_modified": str(datetime.fromtimestamp(stat.st_mtime, timezone.utc)),
+                }
+        return objects
+
+
+class CacheTier(StorageTier):
+    """The shared content-addressed cache."""
+
+    name = "cache"
+
+    def __init__(self, cache: ContentCache, concurrency: int = DEFAULT_LOCAL_CONCURRENCY):
+        super().__init__(concurrency)
+        self.cache = cache
+
+    def fetch(self, item: TransferItem) -> bool:
+        return self.cache.fetch(item)
+
+    def store_many(self, items: List[TransferItem]) -> None:
+        self.cache.store_many(items)
+
+
+class S3Tier(StorageTier):
+    """The bucket, through the async transfer engine; always has every object."""
+
+    name = "s3"
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY):
+        super().__init__(concurrency)
+
+    def download(self, items: List[TransferItem], **kwargs) -> Dict[str, int]:
+        kwargs.setdefault("concurrency", self.concurrency)
+        return download_items(items, **kwargs)
+
+    def info(self, remote: str) -> Optional[dict]:
+        return get_transfer_filesystem().info(remote)
+
+
+class TieredStorage:
+    """Resolve objects from an ordered list of tiers."""
+
+    def __init__(self, tiers: List[StorageTier]):
+        if not tiers:
+            raise ValueError("At least one storage tier is required.")
+        self.tiers = tiers
+
+    @property
+    def s3(self) -> Optional[S3Tier]:
+        return next((tier for tier in self.tiers if isinstance(tier, S3Tier)), None)
+
+    @property
+    def mirror(self) -> Optional[MirrorTier]:
+        return next(
+            (tier for tier in self.tiers if isinstance(tier, MirrorTier) and tier.name == "mirror"),
+            None,
+        )
+
+    def info(self, remote: str) -> dict:
+        """Return the info of ``{bucket}/{key}``, from S3 when it is a tier."""
+        tiers = [self.s3] if self.s3 is not None else self.tiers
+        for tier in tiers:
+            info = tier.info(remote)
+            if info is not None:
+                return info
+        raise FileNotFoundError(remote)
+
+    def fetch(
+            self,
+            items: Iterable[TransferItem],
+            progress: Optional[JobProgress] = None,
+            **kwargs
+    ) -> Dict[str, int]:
+        """Place every item at its local path, tier by tier.
+
+        Keyword arguments are passed on to ``download_items`` for the S3
+        tier. Returns its statistics plus ``cached_objects``, the number of
+        objects served by the other tiers. Raises FileNotFoundError if a
+        non-S3 last tier lacks objects.
+        """
+        items = list(items)
+        if progress is not None:
+            progress.add_total(sum(item.size for item in items))
+            # Raises JobCancelled if the job was cancelled in the meantime
+            progress.advance(0)
+        stats = {"objects": 0, "bytes": 0, "retries": 0, "cached_objects": 0}
+        resolved: List[List[TransferItem]] = []
+        remaining = items
+        for tier in self.tiers:
+            if not remaining:
+                resolved.append([])
+                continue
+            if isinstance(tier, S3Tier):
+                if progress is not None:
+                    kwargs["callback"] = progress.advance
+                for key, value in tier.download(remaining, **kwargs).items():
+                    stats[key] += value
+                hits, remaining = remaining, []
+            else:
+                misses = tier.fetch_many(remaining)
+                missed = set(misses)
+                hits = [item for item in remaining if item not in missed]
+                stats["cached_objects"] += len(hits)
+                if progress is not None:
+                    progress.advance(sum(item.size for item in hits))
+                _record(tier.name, "miss", misses)
+                remaining = misses
+            _record(tier.name, "hit", hits)
+            resolved.append(hits)
+            if hits and tier is not self.tiers[-1]:
+                logger.info(f"{len(hits)} of {len(items)} objects from the {tier.name} tier.")
+        if remaining:
+            raise FileNotFoundError(
+                f"{len(remaining)} objects are in no storage tier, e.g. {remaining[0].remote}"
+            )
+        # Let earlier tiers keep what later tiers had to provide
+        for i, tier in enumerate(self.tiers):
+            later = [item for hits in resolved[i + 1:] for item in hits]
+            if later:
+                tier.store_many(later)
+        return stats
+
+
+def get_storage(
+        staging: Optional[Union[str, Path]] = None,
+        tiers: Optional[Iterable[str]] = None
+) -> TieredStorage:
+    """Return the storage tiers configured by the environment.
+
+    ``staging`` is a directory laid out like the bucket, e.g. filled by a
+    prefetch, that is tried before every other tier. Its files are linked
+    rather than copied where possible. ``tiers`` restricts the result to
+    the named tiers (``staging``, ``mirror``, ``cache``, ``s3``), e.g.
+    ``("s3",)`` to repair files an earlier tier provided.
+    """
+    selected = None if tiers is None else set(tiers)
+    tiers = []
+    if staging is not None and (selected is None or "staging" in selected):
+        tiers.append(MirrorTier(staging, link="auto", name="staging"))
+    for name in os.environ.get(STORAGE_TIERS_ENV, DEFAULT_TIERS).split(","):
+        name = name.strip()
+        if name not in ("mirror", "cache", "s3", ""):
+            raise ValueError(f"Unknown storage tier: {name}")
+        if selected is not None and name not in selected:
+            continue
+        if name == "mirror" and os.environ.get(MIRROR_DIR_ENV):
+            tiers.append(MirrorTier(
+                os.environ[MIRROR_DIR_ENV],
+                concurrency=int(os.environ.get(MIRROR_CONCURRENCY_ENV, DEFAULT_LOCAL_CONCURRENCY)),
+            ))
+        elif name == "cache":
+            cache = get_cache()
+            if cache is not None:
+                tiers.append(CacheTier(
+                    cache,
+                    concurrency=int(os.environ.get(CACHE_CONCURRENCY_ENV, DEFAULT_LOCAL_CONCURRENCY)),
+                ))
+        elif name == "s3":
+            tiers.append(S3Tier())
+    if not tiers and selected is not None:
+        raise ValueError(
+            f"None of the storage tiers {', '.join(sorted(selected))} is configured "
+            f"in {STORAGE_TIERS_ENV}."
+        )
+    return TieredStorage(tiers)
@@ -0,0 +1,512 @@
+"""Asynchronous S3 transfer engine for the HEFS dashboard.
+
+Downloads run on fsspec's IO event loop through s3fs's async API, so many
+objects are in flight at once over a single shared connection pool. Large
+objects are split into byte ranges that are fetched in parallel and written
+in place.
+
+Uploads use the same loop: large files are sent as multipart uploads whose
+parts are read in order, hashed and uploaded in parallel, so a file's
+SHA-256 is known once its upload completes without reading it twice.
+
+Objects are written to a temporary ``.hefs-part`` name and renamed into
+place once complete, so readers never see a truncated file. With a journal,
+completed objects and byte ranges are checkpointed and an interrupted
+transfer resumes where it stopped.
+
+``set_transfer_limits`` caps the requests in flight and the bandwidth of
+all transfers in the process together, e.g. when several RFCs are
+installed at once. Streamed reads of s3fs files, such as bundle chunks,
+go through the same limits when wrapped in a ``LimitedReader``.
+"""
+import asyncio
+import contextlib
+import functools
+import hashlib
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+from hefs_fews_hub.journal import TransferJournal, has_size
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_PART_SIZE = 8 * 2**20
+DEFAULT_MULTIPART_THRESHOLD = 32 * 2**20
+DEFAULT_RETRIES = 5
+RETRY_BASE_DELAY = 0.5
+PART_SUFFIX = ".hefs-part"
+
+
+class BandwidthLimiter:
+    """Pace requests on the IO loop to at most ``bytes_per_second``."""
+
+    def __init__(self, bytes_per_second: float):
+        self.bytes_per_second = bytes_per_second
+        self._available_at = 0.0
+
+    async def acquire(self, nbytes: int) -> None:
+        """Reserve ``nbytes`` of bandwidth and wait for its slot."""
+        now = time.monotonic()
+        start = max(now, self._available_at)
+        self._available_at = start + nbytes / self.bytes_per_second
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+# Process-wide limits shared by every call to download_items
+_limits = {"requests": None, "semaphore": None, "bandwidth": None}
+
+
+def set_transfer_limits(
+        max_requests: Optional[int] = None,
+        bytes_per_second: Optional[float] = None
+) -> None:
+    """Cap the requests in flight and bandwidth across all transfers.
+
+    ``None`` removes a limit. Applies to transfers started afterwards.
+    """
+    _limits["requests"] = max_requests
+    _limits["semaphore"] = asyncio.Semaphore(max_requests) if max_requests else None
+    _limits["bandwidth"] = BandwidthLimiter(bytes_per_second) if bytes_per_second else None
+
+
+class LimitedReader:
+    """A file wrapper reading an s3fs file within the process-wide transfer limits.
+
+    Every read holds a request slot and is charged to the shared bandwidth
+    limiter, so streamed reads count against ``set_transfer_limits`` like
+    ``download_items``. ``loop`` is the filesystem's IO loop.
+    """
+
+    def __init__(self, f, loop):
+        self.f = f
+        self.loop = loop
+
+    async def _read(self, size: int) -> bytes:
+        async with _limits["semaphore"] or contextlib.nullcontext():
+            data = await asyncio.to_thread(self.f.read, size)
+        for limiter in _bandwidth_limiters(None):
+            await limiter.acquire(len(data))
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if _limits["semaphore"] is None and _limits["bandwidth"] is None:
+            return self.f.read(size)
+        from fsspec.asyn import sync
+
+        return sync(self.loop, self._read, size)
+
+
+class TransferItem(NamedTuple):
+    """A single object to download."""
+
+    remote: str
+    local: str
+    size: int
+    etag: str = ""
+
+
+@functools.lru_cache(maxsize=None)
+def get_transfer_filesystem(concurrency: int = DEFAULT_CONCURRENCY):
+    """Return a process-wide s3fs client with a pool sized for ``concurrency``."""
+    import s3fs
+    return s3fs.S3FileSystem(
+        anon=False,
+        skip_instance_cache=True,
+        config_kwargs={
+            "max_pool_connections": concurrency,
+            "retries": {"max_attempts": DEFAULT_RETRIES, "mode": "adaptive"},
+        },
+    )
+
+
+def iter_ranges(size: int, part_size: int) -> List[tuple]:
+    """Split ``size`` bytes into ``(start, end)`` ranges of ``part_size``."""
+    return [
+        (start, min(start + part_size, size))
+        for start in range(0, size, part_size)
+    ]
+
+
+async def _with_retries(func, *args, retries=DEFAULT_RETRIES, on_retry=None, **kwargs):
+    """Await ``func`` retrying transient errors with jittered exponential backoff.
+
+    ``on_retry`` is called before every retry.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args, **kwargs)
+        except (FileNotFoundError, PermissionError, ValueError):
+            raise
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = random.uniform(0, RETRY_BASE_DELAY * 2**attempt)
+            if on_retry is not None:
+                on_retry()
+            logger.warning(
+                f"Retrying {args[0] if args else func} in {delay:.1f}s "
+                f"after error: {e!r}"
+            )
+            await asyncio.sleep(delay)
+
+
+async def _gather_or_cancel(coros) -> list:
+    """Gather ``coros``; on the first failure cancel and await the others."""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _bandwidth_limiters(bytes_per_second: Optional[float]) -> List[BandwidthLimiter]:
+    """Return the process-wide bandwidth limiter and one for this call, where set."""
+    limiters = [_limits["bandwidth"]]
+    if bytes_per_second:
+        limiters.append(BandwidthLimiter(bytes_per_second))
+    return [limiter for limiter in limiters if limiter is not None]
+
+
+class _PartFile:
+    """The ``.hefs-part`` file of a download, created when the first bytes arrive.
+
+    ``size`` preallocates the file for ranged writes; ``resume`` keeps the
+    bytes of an interrupted download.
+    """
+
+    def __init__(self, path: str, size: Optional[int] = None, resume: bool = False):
+        self.path = path
+        self.size = size
+        self.resume = resume
+        self.fd: Optional[int] = None
+
+    def open(self) -> int:
+        if self.fd is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            flags = os.O_WRONLY | os.O_CREAT | (0 if self.resume else os.O_TRUNC)
+            self.fd = os.open(self.path, flags, 0o644)
+            if self.size is not None and not self.resume:
+                os.ftruncate(self.fd, self.size)
+        return self.fd
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+async def _download_items(
+        fs,
+        items: List[TransferItem],
+        concurrency: int,
+        part_size: int,
+        multipart_threshold: int,
+        retries: int,
+        callback: Optional[Callable[[int], None]],
+        journal: Optional[TransferJournal],
+        stats: Dict[str, int],
+        bytes_per_second: Optional[float] = None,
+) -> None:
+    """Download ``items`` with at most ``concurrency`` requests in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    def count_retry():
+        stats["retries"] += 1
+
+    shared_semaphore = _limits["semaphore"] or contextlib.nullcontext()
+    limiters = _bandwidth_limiters(bytes_per_second)
+
+    def report(nbytes):
+        if callback is not None and nbytes:
+            callback(nbytes)
+
+    # Objects being written at once; bounds the open part files and file descriptors
+    item_slots = asyncio.Semaphore(concurrency)
+
+    async def fetch_range(item, part, start, end):
+        for limiter in limiters:
+            await limiter.acquire(item.size if start is None else end - start)
+        async with semaphore, shared_semaphore:
+            data = await _with_retries(
+                fs._cat_file, item.remote, start=start, end=end,
+                retries=retries, on_retry=count_retry,
+            )
+        stats["bytes"] += len(data)
+        await asyncio.to_thread(os.pwrite, part.open(), data, start or 0)
+        if journal is not None and start is not None:
+            journal.record_range(item, start, end)
+        report(len(data))
+
+    async def fetch_item(item):
+        if journal is not None and journal.is_complete(item) \
+                and has_size(item.local, item.size):
+            report(item.size)
+            return
+        async with item_slots:
+            part_path = item.local + PART_SUFFIX
+            done_ranges = set()
+            if journal is not None and has_size(part_path, item.size):
+                done_ranges = journal.completed_ranges(item)
+            multipart = item.size >= multipart_threshold
+            part = _PartFile(part_path, item.size if multipart else None, resume=bool(done_ranges))
+            try:
+                if multipart:
+                    ranges = iter_ranges(item.size, part_size)
+                    pending = [r for r in ranges if r not in done_ranges]
+                    report(item.size - sum(end - start for start, end in pending))
+                    await _gather_or_cancel(
+                        fetch_range(item, part, start, end) for start, end in pending
+                    )
+                elif item.size > 0:
+                    await fetch_range(item, part, None, None)
+                part.open()
+            except BaseException:
+                part.close()
+                # Without a journal nothing can resume from the partial file
+                if journal is None:
+                    Path(part_path).unlink(missing_ok=True)
+                raise
+            part.close()
+            os.replace(part_path, item.local)
+        stats["objects"] += 1
+        if journal is not None:
+            journal.record_complete(item)
+
+    await _gather_or_cancel(fetch_item(item) for item in items)
+
+
+def download_items(
+        items: Iterable[TransferItem],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        part_size: int = DEFAULT_PART_SIZE,
+        multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+        retries: int = DEFAULT_RETRIES,
+        callback: Optional[Callable[[int], None]] = None,
+        journal_path: Optional[Union[str, Path]] = None,
+        bytes_per_second: Optional[float] = None,
+) -> Dict[str, int]:
+    """Download objects from S3 concurrently.
+
+    Objects of at least ``multipart_threshold`` bytes are fetched as parallel
+    ranged GETs of ``part_size`` bytes. ``callback`` is called with the
+    number of bytes written after every completed request. If
+    ``journal_path`` is given, progress is checkpointed there; the journal is
+    kept if the transfer fails and removed once it succeeds.
+    ``bytes_per_second`` caps this call's bandwidth, on top of the
+    process-wide limits.
+
+    Returns the number of objects and bytes fetched and of retries made.
+    """
+    from fsspec.asyn import sync
+
+    items = list(items)
+    stats = {"objects": 0, "bytes": 0, "retries": 0}
+    if not items:
+        return stats
+    # Size the connection pool for the process-wide cap when one is set
+    fs = get_transfer_filesystem(_limits["requests"] or concurrency)
+    journal = TransferJournal(journal_path) if journal_path else None
+    try:
+        sync(
+            fs.loop,
+            _download_items,
+            fs,
+            items,
+            concurrency,
+            part_size,
+            multipart_threshold,
+            retries,
+            callback,
+            journal,
+            stats,
+            bytes_per_second,
+        )
+    finally:
+        if journal is not None:
+            journal.close()
+    if journal is not None:
+        journal.remove()
+    return stats
+
+
+# S3 allows at most this many parts per multipart upload, of at least this size
+MAX_UPLOAD_PARTS = 10000
+MIN_UPLOAD_PART_SIZE = 5 * 2**20
+
+
+def _read_and_hash(fd: int, nbytes: int, offset: int, digest) -> bytes:
+    data = os.pread(fd, nbytes, offset)
+    digest.update(data)
+    return data
+
+
+async def _upload_items(
+        fs,
+        items: List[TransferItem],
+        concurrency: int,
+        part_size: int,
+        multipart_threshold: int,
+        retries: int,
+        callback: Optional[Callable[[int], None]],
+        stats: Dict[str, int],
+        results: Dict[str, dict],
+        bytes_per_second: Optional[float] = None,
+) -> None:
+    """Upload ``items`` with at most ``concurrency`` parts read or in flight."""
+    # Held from reading a part until it is uploaded, which bounds the memory used
+    semaphore = asyncio.Semaphore(concurrency)
+    # Files being uploaded at once; bounds the open file descriptors
+    item_slots = asyncio.Semaphore(concurrency)
+    shared_semaphore = _limits["semaphore"] or contextlib.nullcontext()
+    limiters = _bandwidth_limiters(bytes_per_second)
+
+    def count_retry():
+        stats["retries"] += 1
+
+    async def call(method, **kwargs):
+        async with shared_semaphore:
+            return await _with_retries(
+                fs._call_s3, method, retries=retries, on_retry=count_retry, **kwargs
+            )
+
+    async def send(method, data, **kwargs):
+        try:
+            for limiter in limiters:
+                await limiter.acquire(len(data))
+            response = await call(method, Body=data, **kwargs)
+        finally:
+            semaphore.release()
+        stats["bytes"] += len(data)
+        if callback is not None and data:
+            callback(len(data))
+        return response
+
+    async def upload_item(item):
+        async with item_slots:
+            await upload_file(item)
+
+    async def upload_file(item):
+        bucket, _, key = item.remote.partition("/")
+        digest = hashlib.sha256()
+        fd = os.open(item.local, os.O_RDONLY)
+        try:
+            if item.size < multipart_threshold:
+                await semaphore.acquire()
+                try:
+                    data = await asyncio.to_thread(_read_and_hash, fd, item.size, 0, digest)
+                except BaseException:
+                    semaphore.release()
+                    raise
+                response = await send("put_object", data, Bucket=bucket, Key=key)
+                etag = response["ETag"]
+            else:
+                size = max(part_size, MIN_UPLOAD_PART_SIZE, -(-item.size // MAX_UPLOAD_PARTS))
+                upload = await call("create_multipart_upload", Bucket=bucket, Key=key)
+                upload_id = upload["UploadId"]
+                tasks = []
+                try:
+                    for number, (start, end) in enumerate(iter_ranges(item.size, size), 1):
+                        await semaphore.acquire()
+                        try:
+                            data = await asyncio.to_thread(
+                                _read_and_hash, fd, end - start, start, digest
+                            )
+                        except BaseException:
+                            semaphore.release()
+                            raise
+                        tasks.append(asyncio.ensure_future(send(
+                            "upload_part", data, Bucket=bucket, Key=key,
+                            UploadId=upload_id, PartNumber=number,
+                        )))
+                    responses = await asyncio.gather(*tasks)
+                    response = await call(
+                        "complete_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id,
+                        MultipartUpload={"Parts": [
+                            {"ETag": part["ETag"], "PartNumber": number}
+                            for number, part in enumerate(responses, 1)
+                        ]},
+                    )
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    try:
+                        await fs._call_s3(
+                            "abort_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id
+                        )
+                    except Exception as e:
+                        logger.warning(
+                            f"Could not abort the multipart upload of {item.remote}: {e!r}"
+                        )
+                    raise
+                etag = response["ETag"]
+        finally:
+            os.close(fd)
+        # PUT responses carry no modification time; take the one S3 lists
+        head = await call("head_object", Bucket=bucket, Key=key)
+        stats["objects"] += 1
+        results[item.remote] = {
+            "etag": etag.strip('"'),
+            "last_modified": str(head["LastModified"]),
+            "sha256": digest.hexdigest(),
+        }
+
+    await _gather_or_cancel(upload_item(item) for item in items)
+
+
+def upload_items(
+        items: Iterable[TransferItem],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        part_size: int = DEFAULT_PART_SIZE,
+        multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+        retries: int = DEFAULT_RETRIES,
+        callback: Optional[Callable[[int], None]] = None,
+        bytes_per_second: Optional[float] = None,
+) -> Dict[str, dict]:
+    """Upload local files to S3 concurrently; ``remote`` is ``bucket/key``.
+
+    Files of at least ``multipart_threshold`` bytes are sent as multipart
+    uploads of ``part_size`` bytes (raised to 5 MiB, the S3 minimum), with
+    their parts uploaded in parallel. Every file is read once, and hashed
+    while it is read. ``callback`` is called with the number of bytes sent
+    after every completed request. A failed multipart upload is aborted.
+
+    Returns the ETag, S3 modification time and SHA-256 hex digest of every
+    object, keyed by remote.
+    """
+    from fsspec.asyn import sync
+
+    items = list(items)
+    results: Dict[str, dict] = {}
+    if not items:
+        return results
+    stats = {"objects": 0, "bytes": 0, "retries": 0}
+    fs = get_transfer_filesystem(_limits["requests"] or concurrency)
+    sync(
+        fs.loop,
+        _upload_items,
+        fs,
+        items,
+        concurrency,
+        part_size,
+        multipart_threshold,
+        retries,
+        callback,
+        stats,
+        results,
+        bytes_per_second,
+    )
+    logger.info(
+        f"Uploaded {stats['objects']} objects ({stats['bytes']} bytes, "
+        f"{stats['retries']} retries)."
+    )
+    return results
@@ -0,0 +1,182 @@
+"""Integrity verification of downloaded files against the bucket.
+
+Local files are checked against their manifest entry: a published
+``sha256`` if present, otherwise the S3 ETag, which is the MD5 of the
+object for single-part uploads and the MD5 of the concatenated part MD5s
+followed by ``-{parts}`` for multipart uploads (the part size is not
+recorded, so the common sizes consistent with the part count are tried in
+the same read pass). Hashing runs in a thread pool; hashlib releases the
+GIL on large buffers, so it uses several cores. Results are cached per
+directory and files whose size and modification time are unchanged since
+they last verified are skipped.
+"""
+from concurrent import futures
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+logger = logging.getLogger("HEFS-Dashboard")
+
+VERIFY_CACHE_FILENAME = ".hefs_verify_cache.json"
+READ_BLOCK_SIZE = 2**20
+# Part sizes used by common S3 clients (boto3, aws cli, s3fs, console), in MiB
+CANDIDATE_PART_SIZES = [5, 8, 15, 16, 50, 64, 100, 128, 256, 512]
+DEFAULT_VERIFY_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+
+class VerifyReport(NamedTuple):
+    """Outcome of verifying a directory against a manifest."""
+
+    checked: int
+    skipped: int
+    mismatched: List[str]
+    missing: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return not self.mismatched and not self.missing
+
+    @property
+    def bad(self) -> List[str]:
+        return sorted(self.mismatched + self.missing)
+
+    def summary(self) -> str:
+        return (
+            f"{self.checked} files hashed, {self.skipped} unchanged since the last "
+            f"check, {len(self.mismatched)} mismatched, {len(self.missing)} missing."
+        )
+
+
+def _part_sizes(size: int, parts: int) -> List[int]:
+    candidates = [mib * 2**20 for mib in CANDIDATE_PART_SIZES]
+    # Also the smallest whole MiB part size giving this many parts
+    candidates.append(math.ceil(size / parts / 2**20) * 2**20)
+    return sorted({p for p in candidates if math.ceil(size / p) == parts})
+
+
+def file_matches(path: Union[str, Path], entry: dict) -> bool:
+    """Return True if a local file matches its manifest entry."""
+    path = Path(path)
+    size = entry["size"]
+    if path.stat().st_size != size:
+        return False
+    sha256 = entry.get("sha256")
+    etag = entry.get("etag", "").strip('"')
+    if sha256:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while block := f.read(READ_BLOCK_SIZE):
+                digest.update(block)
+        return digest.hexdigest() == sha256
+    if not etag:
+        return True
+    if "-" not in etag:
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            while block := f.read(READ_BLOCK_SIZE):
+                digest.update(block)
+        return digest.hexdigest() == etag
+    parts = int(etag.rsplit("-", 1)[1])
+    part_sizes = _part_sizes(size, parts)
+    if not part_sizes:
+        return False
+    # One running part digest and list of finished part digests per candidate
+    states = {p: [hashlib.md5(), [], 0] for p in part_sizes}
+    with open(path, "rb") as f:
+        while block := f.read(READ_BLOCK_SIZE):
+            for part_size, state in states.items():
+                view = memoryview(block)
+                while view:
+                    take = min(len(view), part_size - state[2])
+                    state[0].update(view[:take])
+                    state[2] += take
+                    view = view[take:]
+                    if state[2] == part_size:
+                        state[1].append(state[0].digest())
+                        state[0], state[2] = hashlib.md5(), 0
+    for part_size, (digest, digests, filled) in states.items():
+        if filled:
+            digests.append(digest.digest())
+        combined = hashlib.md5(b"".join(digests)).hexdigest()
+        if f"{combined}-{len(digests)}" == etag:
+            return True
+    return False
+
+
+def _read_cache(local: Path) -> Dict[str, dict]:
+    try:
+        with open(local / VERIFY_CACHE_FILENAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(local: Path, cache: Dict[str, dict]) -> None:
+    path = local / VERIFY_CACHE_FILENAME
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def verify_directory(
+        local: Union[str, Path],
+        manifest: Dict[str, dict],
+        max_workers: int = DEFAULT_VERIFY_WORKERS,
+        callback: Optional[Callable[[int], None]] = None
+) -> VerifyReport:
+    """Verify the files of a local directory against a manifest.
+
+    ``manifest`` maps paths relative to ``local`` to entries with ``size``
+    and ``etag`` and optionally ``sha256``. Files not in the manifest are
+    ignored. ``callback`` is called with the bytes of every file checked.
+    """
+    local = Path(local)
+    if not local.exists():
+        raise ValueError(f"The directory: {local}, does not exist.")
+    cache = _read_cache(local)
+    missing, to_check, skipped = [], {}, 0
+    for relative_path, entry in manifest.items():
+        path = local / relative_path
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            missing.append(relative_path)
+            continue
+        verified = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "etag": entry.get("sha256") or entry.get("etag"),
+        }
+        if cache.get(relative_path) == verified:
+            skipped += 1
+            if callback is not None:
+                callback(stat.st_size)
+            continue
+        to_check[relative_path] = (path, entry, verified)
+
+    mismatched = []
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jobs = {
+            executor.submit(file_matches, path, entry): relative_path
+            for relative_path, (path, entry, _) in to_check.items()
+        }
+        for job in futures.as_completed(jobs):
+            relative_path = jobs[job]
+            path, entry, verified = to_check[relative_path]
+            if callback is not None:
+                callback(verified["size"])
+            if job.result():
+                cache[relative_path] = verified
+            else:
+                logger.warning(f"{path} does not match the bucket.")
+                cache.pop(relative_path, None)
+                mismatched.append(relative_path)
+    for relative_path in missing:
+        cache.pop(relative_path, None)
+    _write_cache(local, cache)
+    return VerifyReport(len(to_check), skipped, sorted(mismatched), sorted(missing))